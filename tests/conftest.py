@@ -0,0 +1,12 @@
+import pytest
+
+@pytest.fixture
+def rom(tmp_path):
+    '''
+    Writes the opcodes given (ints) to a ROM file and returns its path.
+    '''
+    def write(*opcodes):
+        path = tmp_path / 'test.ch8'
+        path.write_bytes(b''.join(op.to_bytes(2, 'big') for op in opcodes))
+        return str(path)
+    return write
@@ -0,0 +1,31 @@
+import io
+from struct import unpack
+from tortilla8 import Guacamole
+from tortilla8.churro import Churro, read_churro, churro_to_apng
+
+def test_high_resolution_frames_are_kept(rom):
+    # 0x200: drw v0, v1, 1
+    # 0x202: high
+    # 0x204: drw v0, v1, 1
+    # 0x206: jp 0x206
+    emu = Guacamole(rom(0xD011, 0x00FF, 0xD011, 0x1206), rewind_frames=0)
+    emu.index_register = 0x206 # 0x12, pixels 3 and 6
+    buffer = io.BytesIO()
+    video = Churro(buffer)
+    for _ in range(3):
+        emu.run_for(1)
+        video.capture(emu)
+    video.close()
+
+    buffer.seek(0)
+    fps, frames = read_churro(buffer)
+    frames = [(index, rows) for index, _, rows in frames]
+    assert [(index, len(rows)) for index, rows in frames] == [(0, 32), (1, 64), (2, 64)]
+    assert frames[0][1][0] == 0x12 << 56
+    assert frames[1][1] == [0] * 64
+    assert frames[2][1][0] == 0x12 << 120
+
+    buffer.seek(0)
+    image = io.BytesIO()
+    churro_to_apng(buffer, image, scale=2)
+    assert unpack('>II', image.getvalue()[16:24]) == (256, 128)
@@ -0,0 +1,29 @@
+from tortilla8 import Guacamole
+from tortilla8.comal import Comal
+
+def test_only_backward_jumps_are_loops(rom):
+    # 0x200: call 0x20a
+    # 0x202: add v0, 1
+    # 0x204: se v0, 3
+    # 0x206: jp 0x200
+    # 0x208: jp 0x208
+    # 0x20a: ret
+    emu = Guacamole(rom(0x220A, 0x7001, 0x3003, 0x1200, 0x1208, 0x00EE), rewind_frames=0)
+    profiler = Comal()
+    profiler.attach(emu)
+    emu.run_for(20)
+
+    assert set(profiler.loops) == {(0x200, 0x206), (0x208, 0x208)}
+    assert profiler.loops[(0x200, 0x206)] == 2
+
+def test_running_off_the_end_of_ram(rom):
+    # jp 0xffe, RAM ends with cls at 0xffe so the pc moves to 0x1000
+    emu = Guacamole(rom(0x1FFE), rewind_frames=0, init_ram=True)
+    emu.ram[0xFFE], emu.ram[0xFFF] = 0x00, 0xE0
+    profiler = Comal()
+    profiler.attach(emu)
+    emu.run_for(5)
+
+    assert emu.fatal
+    assert sorted(profiler.hottest()) == [0x200, 0xFFE]
+    assert sum(profiler.counts) == 2
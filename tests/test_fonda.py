@@ -0,0 +1,42 @@
+import asyncio
+from tortilla8 import Guacamole
+from tortilla8.fonda import Fonda, FondaSession, unpack_messages, MSG_STATE, STATE_FATAL, STATE_RUNNING
+
+class Viewer:
+    '''
+    Stands in for a client's StreamWriter, keeping what is sent to it.
+    '''
+    def __init__(self):
+        self.sent = bytearray()
+        self.transport = self
+
+    def write(self, data):
+        self.sent += data
+
+    def get_write_buffer_size(self):
+        return 0
+
+def test_rewind_is_off_by_default():
+    assert Fonda().emu_args['rewind_frames'] == 0
+    assert Fonda(rewind_frames=50, seed=1).emu_args == {'rewind_frames': 50, 'seed': 1}
+
+def test_a_crashing_session_does_not_stop_the_others(rom):
+    # ret with nothing on the stack raises from inside the emulator
+    bad = FondaSession(1, Guacamole(rom(0x00EE), rewind_frames=0))
+    # add v0, 1; jp 0x200
+    good = FondaSession(2, Guacamole(rom(0x7001, 0x1200), rewind_frames=0))
+    viewer = Viewer()
+    bad.join(viewer)
+    host = Fonda()
+    host.sessions = [bad, good]
+
+    async def run_briefly():
+        try:
+            await asyncio.wait_for(host.schedule(), 0.25)
+        except asyncio.TimeoutError:
+            pass
+    asyncio.run(run_briefly())
+
+    assert bad.state == STATE_FATAL and bad.parked_at is not None
+    assert (MSG_STATE, bytes((STATE_FATAL,))) in unpack_messages(viewer.sent)
+    assert good.state == STATE_RUNNING and good.instructions > 10
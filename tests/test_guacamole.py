@@ -0,0 +1,65 @@
+import pytest
+from tortilla8 import Guacamole
+
+@pytest.mark.parametrize('cpuhz', [200, 500, 1000])
+def test_delay_timer_wait_is_not_an_infinite_loop(rom, cpuhz):
+    # 0x200: ld v0, 0x30
+    # 0x202: ld dt, v0
+    # 0x204: ld v1, dt
+    # 0x206: se v1, 0
+    # 0x208: jp 0x204
+    # 0x20a: jp 0x20a
+    emu = Guacamole(rom(0x6030, 0xF015, 0xF107, 0x3100, 0x1204, 0x120A), cpuhz=cpuhz, rewind_frames=0)
+    emu.detect_loops = True
+    emu.run_for(cpuhz * 2)
+
+    assert emu.delay_timer_register == 0
+    assert emu.program_counter == 0x20A
+
+@pytest.mark.parametrize('cpuhz', [10, 45, 60, 500])
+def test_timers_tick_at_60hz_for_any_cpu_frequency(rom, cpuhz):
+    # ld v0, 0xff; ld dt, v0; ld st, v0; then loop between two jumps
+    emu = Guacamole(rom(0x60FF, 0xF015, 0xF018, 0x1208, 0x1206), cpuhz=cpuhz, rewind_frames=0)
+    frames, sounds = [], []
+    emu.frame_hooks.append(frames.append)
+    emu.sound_hooks.append(sounds.append)
+    emu.run_for(3)
+    dt, st = emu.delay_timer_register, emu.sound_timer_register
+    emu.run_for(cpuhz)
+
+    assert len(frames) == len(sounds) == 60 * (cpuhz + 3) // cpuhz
+    assert dt - emu.delay_timer_register == st - emu.sound_timer_register == 60
+
+@pytest.mark.parametrize('profile, v0, vf, index, pc', [
+    ('modern',       1, 0, 0x07F, 0x221),
+    ('cosmac',       2, 0, 0x081, 0x222),
+    ('schip-compat', 1, 0, 0x07F, 0x31F),
+    ('amiga',        1, 1, 0x07F, 0x221)])
+def test_quirk_profiles(rom, profile, v0, vf, index, pc):
+    # ld v0, 3; ld v1, 5; shr v0, v1; ld i, 0xf80; ld [i], v1;
+    # ld vf, 0; ld v2, 0xff; add i, v2; jp v0, 0x220
+    emu = Guacamole(rom(0x6003, 0x6105, 0x8016, 0xAF80, 0xF155,
+                        0x6F00, 0x62FF, 0xF21E, 0xB220), rewind_frames=0, quirks=profile)
+    for _ in range(9):
+        emu.cpu_tick()
+
+    assert (emu.register[0], emu.register[0xF], emu.index_register, emu.program_counter) == \
+        (v0, vf, index, pc)
+
+def test_hashing_at_the_end_of_ram(rom):
+    # jp 0xfff, the last byte of RAM can't hold an instruction
+    emu = Guacamole(rom(0x1FFF), rewind_frames=0, init_ram=True)
+    emu.hashing = True
+    emu.detect_loops = True
+    emu.run_for(5)
+
+    assert emu.fatal
+    assert emu.program_counter == 0xFFF
+
+def test_debug_at_the_end_of_ram(rom):
+    emu = Guacamole(rom(0x1FFF), rewind_frames=0, init_ram=True)
+    emu.debug = True
+    emu.run_for(5)
+
+    assert emu.fatal
+    assert emu.program_counter == 0xFFF
@@ -0,0 +1,15 @@
+import pytest
+from tortilla8 import Guacamole
+from tortilla8.habanero import Habanero
+
+@pytest.mark.parametrize('target, executed', [(0xFFF, []), (0xFFE, [0xFFE])])
+def test_running_off_the_end_of_ram(rom, target, executed):
+    # jp target, RAM ends with cls at 0xffe so the pc moves past 0xfff
+    emu = Guacamole(rom(0x1000 | target), rewind_frames=0, init_ram=True)
+    emu.ram[0xFFE], emu.ram[0xFFF] = 0x00, 0xE0
+    heat = Habanero()
+    heat.attach(emu)
+    emu.run_for(5)
+
+    assert emu.fatal
+    assert [a for a in range(0x300, 0x1000) if heat.fetches[a] and a % 2 == 0] == executed
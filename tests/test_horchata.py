@@ -0,0 +1,42 @@
+from array import array
+import wave
+import pytest
+from tortilla8 import Guacamole
+from tortilla8.horchata import Horchata, WaveSink
+
+def tone_samples(rom, path, ticks):
+    # ld v0, ticks; ld st, v0; then loop between two jumps
+    emu = Guacamole(rom(0x6000 | ticks, 0xF018, 0x1206, 0x1204), cpuhz=600, rewind_frames=0)
+    audio = Horchata(WaveSink(path))
+    audio.attach(emu)
+    emu.run_for(600)
+    audio.close()
+    with wave.open(path, 'rb') as fh:
+        samples = array('h', fh.readframes(fh.getnframes()))
+    return sum(1 for s in samples if s), audio.tick_samples
+
+@pytest.mark.parametrize('ticks', [1, 2, 30])
+def test_tone_lasts_sound_timer_ticks(rom, tmp_path, ticks):
+    played, tick_samples = tone_samples(rom, str(tmp_path / 'out.wav'), ticks)
+    assert played == ticks * tick_samples
+
+def test_tone_held_by_reloading_every_frame(rom, tmp_path):
+    # ld v0, 5; ld v2, 20; then 20 times: ld st, v0 and wait a frame on dt
+    path = str(tmp_path / 'out.wav')
+    emu = Guacamole(rom(0x6005, 0x6214, 0xF018, 0x6101, 0xF115, 0xF107, 0x3100, 0x120A,
+                        0x72FF, 0x3200, 0x1204, 0x1218, 0x1216), cpuhz=600, rewind_frames=0)
+    sounding = []
+    emu.sound_hooks.append(lambda emu: sounding.append(emu.sound_timer_register != 0))
+    sink = WaveSink(path)
+    plays = []
+    play = sink.play
+    sink.play = lambda samples, at: plays.append(at) or play(samples, at)
+    audio = Horchata(sink)
+    audio.attach(emu)
+    emu.run_for(600)
+    audio.close()
+    with wave.open(path, 'rb') as fh:
+        samples = array('h', fh.readframes(fh.getnframes()))
+    assert sum(sounding) > 20
+    assert sum(1 for s in samples if s) == sum(sounding) * audio.tick_samples
+    assert len(plays) == 2
@@ -0,0 +1,16 @@
+from tortilla8 import Guacamole
+from tortilla8.mole import Mole, read_mole
+
+def test_trace_stops_at_missing_instruction(rom, tmp_path):
+    # ld v1, 0x22; jp 0x400, which was never written
+    emu = Guacamole(rom(0x6122, 0x1400), rewind_frames=0)
+    path = str(tmp_path / 'run.trc')
+    mole = Mole(path)
+    mole.attach(emu)
+    emu.run_for(10)
+    mole.close()
+
+    assert emu.fatal
+    with open(path, 'rb') as fh:
+        records = list(read_mole(fh))
+    assert [(r.program_counter, r.opcode) for r in records] == [(0x200, 0x6122), (0x202, 0x1400)]
@@ -0,0 +1,40 @@
+import io
+from tortilla8 import Guacamole
+from tortilla8.palomitas import Palomitas, read_palomitas
+
+# 0x200: rnd v0, 0xff
+# 0x202: ld v1, k
+# 0x204: add v2, v1
+# 0x206: rnd v3, 0x0f
+# 0x208: ld i, 0x300
+# 0x20a: add i, v0
+# 0x20c: ld [i], v3
+# 0x20e: jp 0x200
+PROGRAM = (0xC0FF, 0xF10A, 0x8214, 0xC30F, 0xA300, 0xF01E, 0xF355, 0x1200)
+
+def test_replay_repeats_the_recorded_run(rom):
+    path = rom(*PROGRAM)
+    emu = Guacamole(path, rewind_frames=0)
+    movie = Palomitas()
+    movie.record(emu, path)
+    for key in (0x3, 0xA, 0x3, 0xF, 0x0, 0x7):
+        emu.run_for(40)
+        emu.keypad[key] = True
+        emu.run_for(25)
+        emu.keypad[key] = False
+    emu.run_for(40)
+    movie.stop()
+
+    buffer = io.BytesIO()
+    movie.export(buffer)
+    buffer.seek(0)
+    replay = Guacamole(path, rewind_frames=0)
+    read_palomitas(buffer).play(replay, path)
+    replay.run_for(movie.length)
+
+    assert replay.cycle_count == emu.cycle_count
+    assert replay.ram == emu.ram
+    assert replay.register == emu.register
+    assert replay.index_register == emu.index_register
+    assert replay.program_counter == emu.program_counter
+    assert emu.register[2] != 0
@@ -0,0 +1,13 @@
+from tortilla8 import Guacamole
+from tortilla8.totopo import Totopo
+
+def test_running_off_the_end_of_ram(rom):
+    # jp 0xffe, RAM ends with cls at 0xffe so the pc moves to 0x1000
+    emu = Guacamole(rom(0x1FFE), rewind_frames=0, init_ram=True)
+    emu.ram[0xFFE], emu.ram[0xFFF] = 0x00, 0xE0
+    cov = Totopo()
+    cov.attach(emu)
+    emu.run_for(5)
+
+    assert emu.fatal
+    assert cov.addresses() == [0x200, 0xFFE]
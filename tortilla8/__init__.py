@@ -42,9 +42,22 @@ class EmulationError(Enum):
 
 # Skipping platter and instructions, they are not useful to programmers
 from .blackbean import *
+from .churro import *
+from .comal import *
 from .cilantro import *
+from .elote import *
+from .escabeche import *
+from .fonda import *
 from .guacamole import *
+from .habanero import *
+from .totopo import *
 from .jalapeno import *
+from .mole import *
+from .palomitas import *
+from .pozole import *
+from .queso import *
 from .salsa import *
+from .tamal import *
+from .tepache import *
 
 
@@ -2,16 +2,32 @@
 
 import os
 import select
+import asyncio
 import contextlib
 from time import sleep
 from sys import platform, argv
 from argparse import ArgumentParser, ArgumentTypeError
 from .jalapeno import Jalapeno
-from .blackbean import Blackbean
+from .blackbean import Blackbean, read_symbols
 from .salsa import Salsa
-from .guacamole import Guacamole
+from .guacamole import Guacamole, Rng, QUIRK_PROFILES
 from .platter import Platter
+from .tostada import Tostada
 from .nacho import Nacho
+from .churro import Churro, churro_to_apng
+from .horchata import Horchata, WaveSink
+from .mole import Mole, read_mole, read_mole_header, filter_mole, print_mole, mole_summary
+from .comal import Comal
+from .elote import Elote
+from .habanero import Habanero
+from .totopo import Totopo, read_coverage
+from .queso import Queso
+from .palomitas import Palomitas, read_palomitas, rom_checksum
+from .fonda import Fonda
+from .sope import Sope
+from .tepache import Tepache
+from .escabeche import Escabeche, read_escabeche, restore_savestate
+from .cocina import Cocina, Scenario, SCENARIOS
 
 def pos_int(value):
     ivalue = int(value)
@@ -29,6 +45,125 @@ def dissassemble_file(in_handler, out_handler):
     if file_size % 2 == 1:
         out_handler.write(hex(int.from_bytes(in_handler.read(1), 'big'))[2:].zfill(2) + '\n')
 
+def hex_int(value):
+    try:
+        return int(value, 16)
+    except ValueError:
+        raise ArgumentTypeError("%s is an invalid hex value." % value)
+
+def add_profile_args(parser):
+    parser.add_argument('-p','--profile', nargs='?', const='-', help=
+        'Count how often every address and mnemonic is executed, and the time spent on each, ' +\
+        'and report the hottest addresses and loops on exit. The report is printed, or ' +\
+        'written to PROFILE if given.')
+    parser.add_argument('-g','--flamegraph', help=
+        'Sample the Chip-8 call stack and write it to FLAMEGRAPH in the folded stack ' +\
+        'format read by flamegraph tools.')
+    parser.add_argument('--sample_interval', type=pos_int, default=100, help=
+        'Number of instructions between call stack samples. 100 by default.')
+    parser.add_argument('-y','--symbols', help=
+        'Symbol file (from assemble --symbols) used to show addresses as labels.')
+    parser.add_argument('--coverage', help=
+        'Record which addresses were executed, and how often, to COVERAGE. ' +\
+        'Use assemble --coverage to mark them in a listing.')
+    parser.add_argument('-m','--heatmap', help=
+        'Count reads and writes of every RAM address and write them to HEATMAP, ' +\
+        'as a 64x64 image if it ends in .png or as CSV otherwise.')
+
+def start_profile(opts, emu):
+    symbols = None
+    if opts.symbols:
+        with open(opts.symbols) as fh:
+            symbols = read_symbols(fh)
+
+    profiler, sampler, heatmap, coverage = None, None, None, None
+    if opts.coverage:
+        coverage = Totopo()
+        coverage.attach(emu)
+    if opts.heatmap:
+        heatmap = Habanero()
+        heatmap.attach(emu)
+    if opts.profile:
+        profiler = Comal(symbols)
+        profiler.attach(emu)
+    if opts.flamegraph:
+        sampler = Elote(opts.sample_interval, symbols)
+        sampler.attach(emu)
+    return profiler, sampler, heatmap, coverage
+
+def end_profile(opts, profilers, emu):
+    profiler, sampler, heatmap, coverage = profilers
+    if coverage is not None:
+        with open(opts.coverage, 'wb') as fh:
+            coverage.export(fh)
+    if heatmap is not None:
+        if opts.heatmap.lower().endswith('.png'):
+            with open(opts.heatmap, 'wb') as fh:
+                heatmap.export_png(fh)
+        else:
+            with open(opts.heatmap, 'w') as fh:
+                heatmap.export_csv(fh)
+    if profiler is not None:
+        if opts.profile == '-':
+            profiler.report(emu.ram)
+        else:
+            with open(opts.profile, 'w') as fh:
+                profiler.report(emu.ram, file_handler=fh)
+    if sampler is not None:
+        with open(opts.flamegraph, 'w') as fh:
+            sampler.export_folded(fh)
+
+def start_movie(opts, emu):
+    if not opts.movie:
+        return None
+    movie = Palomitas()
+    movie.record(emu, opts.rom)
+    return movie
+
+def end_movie(opts, movie):
+    if movie is not None:
+        movie.stop()
+        with open(opts.movie, 'wb') as fh:
+            movie.export(fh)
+
+def start_metrics(opts, emu, timeline=None):
+    if opts.metrics is None:
+        return None
+    metrics = Tepache()
+    metrics.attach(emu, timeline)
+    metrics.serve(opts.metrics)
+    return metrics
+
+def read_autosave(opts):
+    '''
+    The savestate to resume from, checked before any screen is set up.
+    '''
+    if not opts.autosave or not os.path.isfile(opts.autosave):
+        return None
+    with open(opts.autosave, 'rb') as fh:
+        savestate = read_escabeche(fh)
+    if savestate is not None and savestate.rom_crc != rom_checksum(opts.rom):
+        raise ValueError("'" + opts.autosave + "' is an autosave of another ROM")
+    return savestate
+
+def start_autosave(opts, emu, savestate, timeline=None):
+    '''
+    Resumes from the savestate if there is one, then keeps saving.
+    '''
+    if not opts.autosave:
+        return None
+    if savestate is not None:
+        restore_savestate(emu, savestate)
+        if timeline is not None:
+            timeline.clear()
+    saver = Escabeche(opts.autosave, max(1, int(opts.autosave_interval * opts.delaytimer)))
+    saver.attach(emu, opts.rom)
+    return saver
+
+def end_autosave(saver):
+    if saver is not None:
+        saver.detach()
+
 def parse_args():
     parser = ArgumentParser(description=
         '''
@@ -69,6 +204,11 @@ def parse_args():
         'Generate listing file and store to OUTPUT.lst file.',action='store_true')
     asm_parser.add_argument('-s','--strip', help=
         'Strip comments and store to OUTPUT.strip file.',action='store_true')
+    asm_parser.add_argument('-y','--symbols', help=
+        'Store every label and its address to OUTPUT.sym file.',action='store_true')
+    asm_parser.add_argument('-c','--coverage', help=
+        'Coverage file (from execute or emulate --coverage) used to mark every line ' +\
+        'of the listing with how often it was executed.')
     asm_parser.add_argument('-e','--enforce',action='store_true',help=
         'Force original Chip-8 specification and do not allow SHR, SHL, XOR, or SUBN instructions.')
 
@@ -101,8 +241,87 @@ def parse_args():
         'Initialize RAM to all zero values.', action='store_true')
     ex_parser.add_argument('-ls','--legacy_shift', help=
         'Use the legacy shift method of bit shift Y and storing to X.', action='store_true')
+    ex_parser.add_argument('-q','--quirks', choices=sorted(QUIRK_PROFILES), help=
+        'Emulate the quirks of another interpreter, overrides --legacy_shift.')
+    ex_parser.add_argument('--seed', type=int, help=
+        'Seed for the random numbers of rnd, runs with the same seed are identical. Random by default.')
+    ex_parser.add_argument('-pl','--play', help=
+        'Play the key presses of a movie recorded with emulate --movie. Runs for as many ' +\
+        'instructions as the movie unless --cycles is given.')
+    ex_parser.add_argument('-ds','--debug_sweep', type=int, default=4096, help=
+        'When printing instructions, every instruction checks the registers and the RAM it ' +\
+        'wrote, and all of RAM is checked every DEBUG_SWEEP instructions (zero for never). 4096 by default.')
+    ex_parser.add_argument('-lp','--loops', action='store_true', help=
+        'Stop when the whole machine state repeats, which means the ROM is in an infinite loop.')
     ex_parser.add_argument("-e","--enforce_instructions", default='None', help=
         'Warning to log if an unoffical instruction is executed. Options: None Info Warning Fatal')
+    ex_parser.add_argument("-c","--cycles", type=pos_int, help=
+        'Run this many instructions as fast as possible and exit. Timers are stepped by ' +\
+        'instruction count so runs are repeatable.')
+    ex_parser.add_argument("-r","--record", help=
+        'Record the screen to this file (60 frames per second). Use the video option to export it.')
+    ex_parser.add_argument("-w","--wave", help=
+        'Write the sound produced by the sound timer to this WAV file.')
+    ex_parser.add_argument("-t","--trace", help=
+        'Write a binary trace of every executed instruction to this file instead of printing ' +\
+        'them. Use the trace option to read it.')
+    ex_parser.add_argument("-z","--zlib", action='store_true', help=
+        'Compress the trace with zlib.')
+    ex_parser.add_argument('--metrics', type=pos_int, help=
+        'Serve live metrics in the Prometheus text format at http://127.0.0.1:METRICS/metrics.')
+    add_profile_args(ex_parser)
+
+    tr_parser = subparsers.add_parser('trace', help=
+        '''
+        Read a trace made with 'execute --trace'. Prints every recorded instruction,
+        or a summary, optionally filtered by address, mnemonic, and cycle.
+        ''')
+    tr_parser.add_argument('trace', help=
+        'Trace to read.')
+    tr_parser.add_argument('-p','--pc', nargs='+', type=hex_int, help=
+        'Only show instructions at these addresses (hex).')
+    tr_parser.add_argument('-m','--mnemonic', nargs='+', help=
+        'Only show these mnemonics.')
+    tr_parser.add_argument('-f','--first', type=int, help=
+        'First cycle to show.')
+    tr_parser.add_argument('-l','--last', type=int, help=
+        'Last cycle to show.')
+    tr_parser.add_argument('-s','--summary', action='store_true', help=
+        'Print the number of instructions and the most executed addresses and mnemonics.')
+    tr_parser.add_argument('-o','--output', help=
+        'File to write to, by default output is printed.')
+
+    prof_parser = subparsers.add_parser('profile', help=
+        '''
+        Profile the emulator itself. Runs ROMs headlessly, with rewind enabled and the
+        screen rendered to memory, under cProfile or tracemalloc and writes the reports
+        (pstats files and text summaries). By default the ROMs in roms/ are used.
+        ''')
+    prof_parser.add_argument('rom', nargs='*', help=
+        'ROMs, assembly sources, or scenario names to profile, by default all canned scenarios are run: ' +\
+        ', '.join(s.name for s in SCENARIOS))
+    prof_parser.add_argument('-c','--cycles', type=pos_int, help=
+        'Number of instructions to run, by default each scenario sets its own.')
+    prof_parser.add_argument('-m','--mode', choices=('cprofile','tracemalloc'), default='cprofile', help=
+        'Profile time with cProfile or allocations with tracemalloc. cprofile by default.')
+    prof_parser.add_argument('-o','--output', default='.', help=
+        'Directory to write reports to.')
+    prof_parser.add_argument('-r','--rewind_depth', type=int, default=1000, help=
+        'Number of instructions recorded for rewinding, zero to disable.')
+    prof_parser.add_argument('-n','--no_render', action='store_true', help=
+        'Do not render the screen.')
+
+    vid_parser = subparsers.add_parser('video', help=
+        '''
+        Export a screen recording made with 'execute --record' to an animated PNG.
+        Frames that did not change are merged into a single longer frame.
+        ''')
+    vid_parser.add_argument('recording', help=
+        'Recording to export.')
+    vid_parser.add_argument('-o','--output', help=
+        'File to write to, by default RECORDING.png is used.')
+    vid_parser.add_argument('-s','--scale', type=pos_int, default=4, help=
+        'Size of a Chip-8 pixel in the exported image. 4 by default.')
 
     emu_parser = subparsers.add_parser('emulate', help=
         '''
@@ -131,6 +350,14 @@ def parse_args():
     emu_parser.add_argument('-ls','--legacy_shift', action='store_true', help=
         'Use the legacy shift method of bit shift Y and storing to X. ' +\
         'By default the newer method is used where Y is ignored and X is bitshifted then stored to itself.')
+    emu_parser.add_argument('-q','--quirks', choices=sorted(QUIRK_PROFILES), help=
+        'Emulate the quirks of another interpreter, overrides --legacy_shift. ' +\
+        'cosmac shifts VY and keeps the stack in RAM, amiga sets VF when I overflows.')
+    emu_parser.add_argument('--seed', type=int, help=
+        'Seed for the random numbers of rnd. Random by default.')
+    emu_parser.add_argument('-mv','--movie', help=
+        'Record every key press to this movie, which execute --play can replay exactly. ' +\
+        'Timers are stepped by instruction count while recording.')
     emu_parser.add_argument("-e","--enforce_instructions", default='None', help=
         'Warning to log if an unoffical instruction is executed. ' +\
         'By default, no errors are logged. Options: None Info Warning Fatal')
@@ -143,6 +370,65 @@ def parse_args():
         'By default, unicode support is determined by the OS. ' +\
         'Mac displays a unicode game screen, Windows displays no unicode, ' +\
         'and GNU/Linux displays both the game and menu in unicode.')
+    emu_parser.add_argument('-t','--tostada', action='store_true', help=
+        'Use Tostada, a lightweight ANSI renderer, instead of the curses interface. ' +\
+        'Only the game screen is shown and only changed cells are redrawn, ' +\
+        'useful over slow SSH links or when output is captured. Press X to exit.')
+    emu_parser.add_argument('-b','--breakpoint', nargs='+', type=hex_int, default=[], help=
+        'Addresses (hex) to stop at, the emulator switches to step mode before executing them. ' +\
+        'Breakpoints can also be toggled at the current address with B.')
+    emu_parser.add_argument('-wa','--watch', nargs='+', default=[], help=
+        'Registers (v0-vf, i, dt, st, sp) or RAM addresses and ranges in hex (0x300-0x30f) ' +\
+        'to stop at when their value changes.')
+    emu_parser.add_argument('-c','--condition', nargs='+', default=[], help=
+        'Python expressions over registers and RAM to stop at when they become true, ' +\
+        'such as "v3 == 0x10 and i > 0x300" or "ram[0x300] != 0".')
+    emu_parser.add_argument('-as','--autosave', help=
+        'Save the session to this journal in the background, resuming from it if it exists. ' +\
+        'Only the RAM pages that changed are written, and the journal is compacted now and then.')
+    emu_parser.add_argument('--autosave_interval', type=float, default=1.0, help=
+        'Seconds between autosaves. 1 by default.')
+    emu_parser.add_argument('--metrics', type=pos_int, help=
+        'Serve live metrics (effective frequency, frames drawn, render time, rewind memory) ' +\
+        'in the Prometheus text format at http://127.0.0.1:METRICS/metrics.')
+    add_profile_args(emu_parser)
+
+    host_parser = subparsers.add_parser('host', help=
+        '''
+        Host many emulator sessions in one process. Clients connect to a Unix socket,
+        start a session with one of the ROMs in a directory (or join one to spectate),
+        send key presses, and receive the screen as a keyframe followed by deltas of the
+        rows that changed. Sessions waiting for a key are parked until one arrives.
+        ''')
+    host_parser.add_argument('socket', help=
+        'Path of the Unix socket to listen on.')
+    host_parser.add_argument('-r','--roms', default='.', help=
+        'Directory of the ROMs clients may run, the current directory by default.')
+    host_parser.add_argument('-f','--frequency', type=pos_int, default=500, help=
+        'CPU frequency of every session. 500Hz by default.')
+    host_parser.add_argument('-sl','--slices', type=pos_int, default=60, help=
+        'Time slices per second, every running session runs once per slice. 60 by default.')
+    host_parser.add_argument('-m','--max_sessions', type=pos_int, default=512, help=
+        'Most sessions hosted at once. 512 by default.')
+    host_parser.add_argument('-i','--initram', action='store_true', help=
+        'Initialize RAM to all zero values.')
+    host_parser.add_argument('-q','--quirks', choices=sorted(QUIRK_PROFILES), help=
+        'Emulate the quirks of another interpreter.')
+
+    view_parser = subparsers.add_parser('view', help=
+        '''
+        Play or spectate a session of a 'host' in a curses screen. Keys are sent to the
+        host and the screen is drawn from the changes it streams back.
+        ''')
+    view_parser.add_argument('socket', help=
+        'Path of the Unix socket of the host.')
+    group = view_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('rom', nargs='?', help=
+        'ROM to start a session with, relative to the ROM directory of the host.')
+    group.add_argument('-w','--watch', type=int, help=
+        'Id of a session to join, shown in the status line of the viewer that started it.')
+    view_parser.add_argument('-a','--ascii', action='store_true', help=
+        'Draw the screen without unicode.')
 
     return parser.parse_args()
 
@@ -179,14 +465,23 @@ def main():
         with open(opts.input) as fh:
             bb.assemble(fh)
 
+        coverage = None
+        if opts.coverage:
+            with open(opts.coverage, 'rb') as fh:
+                coverage = read_coverage(fh)
+
         if opts.list:
             with open(opts.output + '.lst', 'w') as fh:
-                bb.print_listing(fh)
+                bb.print_listing(fh, coverage)
 
         if opts.strip:
             with open(opts.output + '.strip', 'w') as fh:
                 bb.print_strip(fh)
 
+        if opts.symbols:
+            with open(opts.output + '.sym', 'w') as fh:
+                bb.print_symbols(fh)
+
         with open(opts.output + '.ch8', 'wb') as fh:
             bb.export_binary(fh)
 
@@ -204,16 +499,90 @@ def main():
             raise OSError("File '" + opts.rom + "' does not exist.")
 
         guac = Guacamole(opts.rom, opts.frequency, opts.soundtimer, opts.delaytimer,
-                         opts.initram, opts.legacy_shift, opts.enforce_instructions)
-        guac.log_to_screen = True
-        sleep_time = (1/opts.frequency)*.98
-        try:
-            while True:
-                guac.run()
-                sleep(sleep_time)
+                         opts.initram, opts.legacy_shift, opts.enforce_instructions,
+                         quirks=opts.quirks, seed=opts.seed)
+        if opts.play:
+            with open(opts.play, 'rb') as fh:
+                movie = read_palomitas(fh)
+            movie.play(guac, opts.rom)
+            opts.cycles = opts.cycles or movie.length
+        guac.detect_loops = opts.loops
+        guac.debug_sweep = opts.debug_sweep
+
+        with contextlib.ExitStack() as stack:
+            if opts.trace:
+                tracer = Mole(opts.trace, opts.zlib, seed=guac.rng.seed)
+                tracer.attach(guac)
+                stack.callback(tracer.close)
+            elif not (opts.profile or opts.flamegraph or opts.heatmap or opts.coverage):
+                guac.debug = True
+
+            profiler = start_profile(opts, guac)
+            stack.callback(end_profile, opts, profiler, guac)
+            metrics = start_metrics(opts, guac)
+            if metrics is not None:
+                stack.callback(metrics.stop)
+
+            if opts.record:
+                recorder = Churro(stack.enter_context(open(opts.record, 'wb')), opts.delaytimer)
+                recorder.attach(guac)
+                stack.callback(recorder.close)
+
+            if opts.wave:
+                audio = Horchata(WaveSink(opts.wave), timer_hz=opts.soundtimer)
+                audio.attach(guac)
+                stack.callback(audio.close)
+
+            if opts.cycles:
+                guac.run_for(opts.cycles)
+            else:
+                sleep_time = (1/opts.frequency)*.98
+                try:
+                    while True:
+                        guac.run()
+                        sleep(sleep_time)
+
+                except KeyboardInterrupt:
+                    pass
+
+    if opts.option == 'trace':
+        with contextlib.ExitStack() as stack:
+            fh = stack.enter_context(open(opts.trace, 'rb'))
+            fo = stack.enter_context(open(opts.output, 'w')) if opts.output else None
+            header = read_mole_header(fh)
+            records = filter_mole(read_mole(fh, header), opts.pc,
+                opts.mnemonic and [m.lower() for m in opts.mnemonic], opts.first, opts.last)
+            if opts.summary:
+                mole_summary(records, file_handler=fo, seed=header.seed)
+            else:
+                print_mole(records, fo)
+
+    if opts.option == 'profile':
+        scenarios = SCENARIOS
+        if opts.rom:
+            canned = {s.name: s for s in SCENARIOS}
+            scenarios = [canned[r] if r in canned else
+                Scenario(os.path.splitext(os.path.basename(r))[0], r, 50000, ()) for r in opts.rom]
+        if opts.cycles:
+            scenarios = [s._replace(cycles=opts.cycles) for s in scenarios]
+
+        os.makedirs(opts.output, exist_ok=True)
+        cocina = Cocina(opts.output, opts.rewind_depth, not opts.no_render)
+        for scenario in scenarios:
+            if not os.path.isfile(scenario.rom):
+                print("Skipping " + scenario.name + ", '" + scenario.rom + "' does not exist.")
+                continue
+            for path in cocina.run(scenario, opts.mode):
+                print("Wrote " + path)
+
+    if opts.option == 'video':
+        if not opts.output:
+            opts.output  = '.'.join(opts.recording.split('.')[0:-1]) if opts.recording.find('.') != -1 else opts.recording
+            opts.output += '.png'
 
-        except KeyboardInterrupt:
-            pass
+        with open(opts.recording, 'rb') as fi:
+            with open(opts.output, 'wb') as fo:
+                churro_to_apng(fi, fo, opts.scale)
 
     if opts.option == 'emulate':
         if not os.path.isfile(opts.rom):
@@ -221,6 +590,7 @@ def main():
 
         if opts.step:
             opts.frequency = 1000000 # 1 Ghz
+        savestate = read_autosave(opts)
 
         screen_unicode = False if platform == 'win32' else True
         menu_unicode   = True  if platform == 'linux' else False
@@ -240,11 +610,58 @@ def main():
                 else:
                     raise IOError("Unknown value following the '--unicode' flag.")
 
+        if opts.tostada:
+            disp = Tostada( opts.rom, opts.frequency, opts.soundtimer, opts.delaytimer,
+                            opts.initram, opts.legacy_shift, opts.enforce_instructions,
+                            opts.rewind_depth, screen_unicode, quirks=opts.quirks )
+            if opts.seed is not None:
+                disp.emu.rng = Rng(opts.seed)
+            profiler = start_profile(opts, disp.emu)
+            movie = start_movie(opts, disp.emu)
+            disp.metrics = start_metrics(opts, disp.emu)
+            saver = start_autosave(opts, disp.emu, savestate)
+            disp.start()
+            end_autosave(saver)
+            end_movie(opts, movie)
+            end_profile(opts, profiler, disp.emu)
+            return
+
+        breaks = Queso()
+        for address in opts.breakpoint:
+            breaks.add_breakpoint(address)
+        for target in opts.watch:
+            breaks.add_watch(target)
+        for expression in opts.condition:
+            breaks.add_condition(expression)
+
         disp = Platter( opts.rom, opts.frequency, opts.soundtimer, opts.delaytimer,
                         opts.initram, opts.legacy_shift, opts.enforce_instructions,
                         opts.rewind_depth, opts.drawfix, screen_unicode, menu_unicode,
-                        opts.audio )
+                        opts.audio, breaks, opts.quirks )
+        if opts.seed is not None:
+            disp.emu.rng = Rng(opts.seed)
+        profiler = start_profile(opts, disp.emu)
+        movie = start_movie(opts, disp.emu)
+        disp.metrics = start_metrics(opts, disp.emu, disp.timeline)
+        saver = start_autosave(opts, disp.emu, savestate, disp.timeline)
         disp.start(opts.step)
+        end_autosave(saver)
+        end_movie(opts, movie)
+        end_profile(opts, profiler, disp.emu)
+
+    if opts.option == 'host':
+        host = Fonda(opts.roms, opts.frequency, opts.slices, opts.max_sessions,
+                     init_ram=opts.initram, quirks=opts.quirks)
+        try:
+            asyncio.run(host.serve(opts.socket))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(opts.socket):
+                os.remove(opts.socket)
+
+    if opts.option == 'view':
+        Sope(opts.socket, opts.rom, opts.watch, not opts.ascii).start()
 
 if __name__ == "__main__":
     main()
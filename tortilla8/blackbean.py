@@ -2,6 +2,7 @@
 
 from . import export
 from warnings import warn
+from bisect import bisect_right
 from .cilantro import Cilantro
 from .constants.reg_rom_stack import PROGRAM_BEGIN_ADDRESS, ARG_SUB, OVERFLOW_ADDRESS, REGISTERS
 from .constants.opcodes import OP_CODES, OP_CODE_SIZE, BANNED_OP_CODES_EXPLODED
@@ -54,7 +55,7 @@ class Blackbean:
             self.calc_opcode(t)
             self.calc_data_declares(t)
 
-    def print_listing(self, file_handler=None):
+    def print_listing(self, file_handler=None, coverage=None):
         """
         Prints a the orignal file with two additonal columns, the first
         being the memory address of the first byte of the line and the
@@ -62,6 +63,11 @@ class Blackbean:
         line. Data declarations do not have their calculated hex
         values shown as they may take more than the normal two bytes
         for all other assembler instructions.
+
+        If coverage (a Totopo, see read_coverage) is given a third column
+        shows how often each instruction was executed, '-' for instructions
+        that never were, and '!' followed by the hits for data declarations
+        that were executed as code.
         """
         if not self.collection:
             warn("No file has been assembled. Nothing to print.")
@@ -70,13 +76,20 @@ class Blackbean:
         for line in self.collection:
             if line.instruction_int:
                 form_line = format(line.mem_address, '#06x') + (4*' ') +\
-                            format(line.instruction_int, '#06x') + (4*' ') +\
-                            line.original
+                            format(line.instruction_int, '#06x') + (4*' ')
+                if coverage is not None:
+                    hits = coverage.hits(line.mem_address)
+                    form_line += (str(hits) if hits else '-').rjust(10) + (4*' ')
             elif line.dd_ints:
-                form_line = format(line.mem_address, '#06x') + (14*' ') +\
-                            line.original
+                form_line = format(line.mem_address, '#06x') + (10*' ')
+                if coverage is not None:
+                    end = line.mem_address + len(line.dd_ints) * line.data_size
+                    hits = sum(coverage.hits(a) for a in range(line.mem_address, end))
+                    form_line += ('!' + str(hits) if hits else '').rjust(14)
+                form_line += 4*' '
             else:
-                form_line = (20*' ') + line.original
+                form_line = (20*' ') + (14*' ' if coverage is not None else '')
+            form_line += line.original
 
             if file_handler is None:
                 print(form_line, end='')
@@ -100,6 +113,22 @@ class Blackbean:
             else:
                 file_handler.write(line.original.split(BEGIN_COMMENT)[0].rstrip() + '\n')
 
+    def print_symbols(self, file_handler=None):
+        """
+        Prints every label and its memory address, one per line, in the
+        form '0x0208 label'. Can be read back with read_symbols.
+        """
+        if not self.mmap:
+            warn("No labels have been found. Nothing to print.")
+            return
+
+        for label, address in sorted(self.mmap.items(), key=lambda x: x[1]):
+            form_line = format(address, '#06x') + ' ' + label
+            if file_handler is None:
+                print(form_line)
+            else:
+                file_handler.write(form_line + '\n')
+
     def export_binary(self, file_handler):
         """
         Writes the assembled file to a binary blob.
@@ -276,6 +305,40 @@ class Blackbean:
 # Below are utility functions usefull if creating a class
 # is over shooting your needs.
 
+@export
+def read_symbols(file_handler):
+    """
+    Reads a symbol file written by Blackbean.print_symbols into a
+    dict of label to address, the same form as Blackbean.mmap.
+    """
+    symbols = {}
+    for line in file_handler:
+        parts = line.split()
+        if len(parts) == 2:
+            symbols[parts[1]] = int(parts[0], 16)
+    return symbols
+
+@export
+class Symbols:
+    """
+    Names addresses after the closest label at or before them, given a
+    dict of label to address such as Blackbean.mmap or from read_symbols.
+    """
+    def __init__(self, mmap=None):
+        pairs = sorted((addr, label) for label, addr in (mmap or {}).items())
+        self.addresses = [addr for addr, _ in pairs]
+        self.labels    = [label for _, label in pairs]
+
+    def name(self, address):
+        """
+        Address as 'label+offset', or in hex if no label comes before it.
+        """
+        i = bisect_right(self.addresses, address) - 1
+        if i < 0:
+            return format(address, '#05x')
+        offset = address - self.addresses[i]
+        return self.labels[i] + ('+' + str(offset) if offset else '')
+
 def util_strip_comments(file_path, outpout_handler = None):
     with open(file_path) as fhandler:
         for line in fhandler:
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+from . import export
+from struct import pack, unpack, calcsize
+from zlib import compress, crc32
+from .constants.graphics import GFX_WIDTH, GFX_HEIGHT_PX, HIRES_WIDTH, HIRES_HEIGHT_PX
+__all__ = []
+
+# Recording layout, all values big endian
+#   Header: magic, version, bytes per row, rows, frames per second
+#   Frame:  FRAME tag, frame index, number of changed rows, then for every
+#           changed row its index followed by the row bytes
+#   Size:   SIZE tag, bytes per row, rows. The screen changed resolution,
+#           every row of the next frame is stored (from version 2)
+#   End:    END tag, total number of frames
+CHURRO_MAGIC   = b'T8VR'
+CHURRO_VERSION = 2
+CHURRO_HEADER  = '>4sBBBH'
+CHURRO_FRAME   = '>IB'
+CHURRO_SIZE    = '>BB'
+CHURRO_END     = '>I'
+TAG_FRAME = 0x01
+TAG_SIZE  = 0x02
+TAG_END   = 0x00
+
+# Bytes per row of each screen height
+CHURRO_WIDTHS = {GFX_HEIGHT_PX: GFX_WIDTH, HIRES_HEIGHT_PX: HIRES_WIDTH}
+
+@export
+class Churro:
+    '''
+    Churro records the screen of a Guacamole instance to a compact run
+    length log. Only frames that differ from the one before are written,
+    and only the rows that changed. Frames that did not change are not
+    stored at all, the gap in frame indices is the repeat count. Frames
+    are stored at the resolution the emulator shows them in.
+    '''
+
+    def __init__(self, file_handler, fps=60):
+        '''
+        File handler must be opened in binary mode. FPS is only recorded
+        so exporters know how long a frame lasts, frames are captured
+        whenever capture is called (by default on every delay timer tick).
+        '''
+        self.fh = file_handler
+        self.fps = fps
+        self.frame = 0
+        self.rows = [None] * GFX_HEIGHT_PX
+        self.fh.write(pack(CHURRO_HEADER, CHURRO_MAGIC, CHURRO_VERSION,
+                           GFX_WIDTH, GFX_HEIGHT_PX, fps))
+
+    def attach(self, emu):
+        '''
+        Capture a frame every time the emulator's 60hz timer ticks.
+        '''
+        emu.frame_hooks.append(self.capture)
+
+    def detach(self, emu):
+        emu.frame_hooks.remove(self.capture)
+
+    def capture(self, emu):
+        '''
+        Store the current screen as the next frame.
+        '''
+        screen = emu.screen_rows()
+        width = CHURRO_WIDTHS[len(screen)]
+        record = []
+        if len(screen) != len(self.rows):
+            self.rows = [None] * len(screen)
+            record.append(bytes((TAG_SIZE,)) + pack(CHURRO_SIZE, width, len(screen)))
+
+        changed = []
+        for y, value in enumerate(screen):
+            row = value.to_bytes(width, 'big')
+            if row != self.rows[y]:
+                self.rows[y] = row
+                changed.append(y)
+
+        if changed:
+            record.append(bytes((TAG_FRAME,)) + pack(CHURRO_FRAME, self.frame, len(changed)))
+            for y in changed:
+                record.append(bytes((y,)) + self.rows[y])
+            self.fh.write(b''.join(record))
+        self.frame += 1
+
+    def close(self):
+        '''
+        Marks the end of the recording, the handler is left open.
+        '''
+        self.fh.write(bytes((TAG_END,)) + pack(CHURRO_END, self.frame))
+
+@export
+def read_churro(file_handler):
+    '''
+    Reads the header of a recording made by Churro. Returns the fps it was
+    recorded at and a generator that yields a tuple of (frame index, repeat
+    count, rows) for every distinct frame. Rows is a list of ints, one per
+    pixel row, the most significant bit being the left most pixel. Each
+    row is 8 bits per byte of the width in CHURRO_WIDTHS for its height.
+    '''
+    magic, version, width, height, fps = \
+        unpack(CHURRO_HEADER, file_handler.read(calcsize(CHURRO_HEADER)))
+    if magic != CHURRO_MAGIC or not 1 <= version <= CHURRO_VERSION:
+        raise ValueError("Not a tortilla8 video recording.")
+    return fps, churro_frames(file_handler, width, height)
+
+def churro_frames(file_handler, width, height):
+    rows = [0] * height
+    pending = None
+    while True:
+        tag = file_handler.read(1)
+        if not tag or tag[0] == TAG_END:
+            total = unpack(CHURRO_END, file_handler.read(calcsize(CHURRO_END)))[0] if tag else None
+            break
+        if tag[0] == TAG_SIZE:
+            width, height = unpack(CHURRO_SIZE, file_handler.read(calcsize(CHURRO_SIZE)))
+            rows = [0] * height
+            continue
+        index, numb_rows = unpack(CHURRO_FRAME, file_handler.read(calcsize(CHURRO_FRAME)))
+        if pending is not None:
+            yield pending[0], index - pending[0], pending[1]
+        for _ in range(numb_rows):
+            data = file_handler.read(width + 1)
+            rows[data[0]] = int.from_bytes(data[1:], 'big')
+        pending = (index, rows.copy())
+
+    if pending is not None:
+        yield pending[0], max(1, (total or pending[0] + 1) - pending[0]), pending[1]
+
+@export
+def churro_to_apng(in_handler, out_handler, scale=4):
+    '''
+    Exports a Churro recording to an animated PNG. Every distinct frame is
+    written once and is shown for as long as it was repeated. Only zlib is
+    needed, the image is a 1 bit grayscale PNG scaled up by 'scale'. If the
+    recording has high resolution frames, low resolution ones are doubled
+    to match them.
+    '''
+    fps, frames = read_churro(in_handler)
+    frames = list(frames)
+    if not frames:
+        raise ValueError("Recording contains no frames.")
+    rows_px = max(len(rows) for _, _, rows in frames)
+    width, height = CHURRO_WIDTHS[rows_px] * 8 * scale, rows_px * scale
+    expanders = {}
+
+    def image_data(rows):
+        # Every source byte expands to 'factor' times as many bits
+        factor = scale * rows_px // len(rows)
+        if factor not in expanders:
+            expanders[factor] = [int(''.join(c * factor for c in format(i, '08b')), 2) for i in range(256)]
+        expand = expanders[factor]
+        row_width = CHURRO_WIDTHS[len(rows)]
+        lines = []
+        for row in rows:
+            scaled = 0
+            for byte in row.to_bytes(row_width, 'big'):
+                scaled = (scaled << (8 * factor)) | expand[byte]
+            lines.append((b'\x00' + scaled.to_bytes(row_width * factor, 'big')) * factor)
+        return compress(b''.join(lines), 9)
+
+    out_handler.write(PNG_SIGNATURE)
+    out_handler.write(png_chunk(b'IHDR', pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0)))
+    out_handler.write(png_chunk(b'acTL', pack('>II', len(frames), 0)))
+
+    sequence = 0
+    for i, (_, repeat, rows) in enumerate(frames):
+        delay_num, delay_den = repeat, fps
+        while delay_num > 0xFFFF:
+            delay_num, delay_den = delay_num // 2, max(1, delay_den // 2)
+        out_handler.write(png_chunk(b'fcTL', pack('>IIIIIHHBB', sequence, width, height,
+                                              0, 0, delay_num, delay_den, 0, 0)))
+        sequence += 1
+        if i == 0:
+            out_handler.write(png_chunk(b'IDAT', image_data(rows)))
+        else:
+            out_handler.write(png_chunk(b'fdAT', pack('>I', sequence) + image_data(rows)))
+            sequence += 1
+    out_handler.write(png_chunk(b'IEND', b''))
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def png_chunk(kind, data):
+    return pack('>I', len(data)) + kind + data + pack('>I', crc32(kind + data))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+from . import export
+import io
+import os
+import pstats
+import cProfile
+import tracemalloc
+from tempfile import TemporaryDirectory
+from collections import namedtuple
+from .blackbean import Blackbean
+from .tostada import Tostada
+__all__ = []
+
+@export
+class Scenario( namedtuple('Scenario', 'name rom cycles keys') ):
+    '''
+    A ROM (assembly source or binary) to run for a number of cycles. Keys
+    is a sequence of keypad keys pressed in turn, one every 30 frames, for
+    ROMs that wait for input.
+    '''
+    pass
+
+# Canned scenarios for the ROMs shipped in roms/, next to the package
+ROMS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'roms')
+SCENARIOS = (
+    Scenario('vertical_stripes', os.path.join(ROMS_DIR, 'vertical_stripes_pp.asm'), 50000, ()),
+    Scenario('fake_mandelbrot',  os.path.join(ROMS_DIR, 'fake_mandelbrot.asm'),     50000, ()),
+    Scenario('dot_dude',         os.path.join(ROMS_DIR, 'dot_dude.asm'),            50000, (6, 2, 4, 8)),
+    Scenario('empty',            os.path.join(ROMS_DIR, 'empty.asm'),               50000, ()),
+)
+
+# Entry points whose cumulative time is reported as a component
+COMPONENTS = (
+    ('Disassembly (Salsa)', lambda f, n: n == 'Salsa'),
+    ('Instruction handlers', lambda f, n: f.endswith('instructions.py') and n.startswith('i_')),
+    ('Rewind snapshots', lambda f, n: n == 'store_RewindData'),
+    ('Rendering', lambda f, n: f.endswith('tostada.py') and n == 'draw'),
+    ('Hooks', lambda f, n: n == 'hooked_tick'),
+)
+
+@export
+class Cocina:
+    '''
+    Cocina is a harness for profiling the emulator itself. A scenario is
+    run headlessly, with rewind enabled and the screen rendered by Tostada
+    into memory, under either cProfile or tracemalloc, and the reports are
+    written to a directory.
+    '''
+
+    def __init__(self, out_dir='.', rewind_frames=1000, render=True):
+        self.out_dir = out_dir
+        self.rewind_frames = rewind_frames
+        self.render = render
+
+    def prepare(self, scenario, tmp_dir):
+        '''
+        Returns a Tostada whose emulator is loaded with the scenario's ROM,
+        assembling it first if needed.
+        '''
+        rom = scenario.rom
+        if rom.endswith('.asm'):
+            bb = Blackbean()
+            with open(rom) as fh:
+                bb.assemble(fh)
+            rom = os.path.join(tmp_dir, scenario.name + '.ch8')
+            with open(rom, 'wb') as fh:
+                bb.export_binary(fh)
+
+        disp = Tostada(rom, 1000, 60, 60, True, False, "None",
+                       self.rewind_frames, True, io.StringIO())
+        if self.render:
+            disp.emu.frame_hooks.append(lambda emu: draw_flagged(disp))
+        if scenario.keys:
+            disp.emu.frame_hooks.append(KeyPresser(scenario.keys))
+        return disp
+
+    def run(self, scenario, mode='cprofile'):
+        '''
+        Profiles a scenario, mode is either 'cprofile' or 'tracemalloc'.
+        Returns the paths of the reports written.
+        '''
+        with TemporaryDirectory() as tmp_dir:
+            disp = self.prepare(scenario, tmp_dir)
+            if mode == 'cprofile':
+                return self.run_cprofile(scenario, disp)
+            if mode == 'tracemalloc':
+                return self.run_tracemalloc(scenario, disp)
+        raise ValueError("Unknown profiling mode '" + mode + "'")
+
+    def run_cprofile(self, scenario, disp):
+        profiler = cProfile.Profile()
+        profiler.runcall(disp.emu.run_for, scenario.cycles)
+
+        stats_path = os.path.join(self.out_dir, scenario.name + '.pstats')
+        report_path = os.path.join(self.out_dir, scenario.name + '.txt')
+        profiler.dump_stats(stats_path)
+
+        with open(report_path, 'w') as fh:
+            stats = pstats.Stats(profiler, stream=fh)
+            total = stats.total_tt
+            fh.write("Scenario: " + scenario.name + ", " + str(scenario.cycles) + " cycles\n")
+            fh.write("Total: " + format(total, '.3f') + "s, " +
+                     format(1e6 * total / scenario.cycles, '.1f') + "us per instruction\n\n")
+            for name, cumulative in self.components(stats):
+                fh.write("  " + name.ljust(24) + format(cumulative, '10.3f') + "s" +
+                         format(100 * cumulative / total, '8.1f') + "%\n")
+            fh.write("\n")
+            stats.sort_stats('cumulative').print_stats(30)
+        return stats_path, report_path
+
+    def components(self, stats):
+        '''
+        Cumulative time of the entry points of each part of the emulator.
+        '''
+        totals = [0.0] * len(COMPONENTS)
+        for (filename, _, funcname), row in stats.stats.items():
+            for i, (_, match) in enumerate(COMPONENTS):
+                if match(filename, funcname):
+                    totals[i] += row[3]
+        return [(COMPONENTS[i][0], totals[i]) for i in range(len(COMPONENTS))]
+
+    def run_tracemalloc(self, scenario, disp):
+        tracemalloc.start(10)
+        before = tracemalloc.take_snapshot()
+        disp.emu.run_for(scenario.cycles)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        report_path = os.path.join(self.out_dir, scenario.name + '.alloc.txt')
+        with open(report_path, 'w') as fh:
+            fh.write("Scenario: " + scenario.name + ", " + str(scenario.cycles) + " cycles\n")
+            fh.write("Current: " + format(current / 1024, '.1f') + " KiB, peak: " +
+                     format(peak / 1024, '.1f') + " KiB\n\n")
+            fh.write("Retained by file:\n")
+            for stat in after.compare_to(before, 'filename')[:15]:
+                fh.write("  " + str(stat) + "\n")
+            fh.write("\nRetained by line:\n")
+            for stat in after.compare_to(before, 'lineno')[:30]:
+                fh.write("  " + str(stat) + "\n")
+        return (report_path,)
+
+class KeyPresser:
+    '''
+    Frame hook that presses the next key in turn every 'every' frames and
+    releases it a frame later.
+    '''
+    def __init__(self, keys, every=30):
+        self.keys = keys
+        self.every = every
+        self.frame = 0
+
+    def __call__(self, emu):
+        self.frame += 1
+        if self.frame % self.every == 0:
+            emu.keypad[self.keys[(self.frame // self.every) % len(self.keys)]] = True
+        elif self.frame % self.every == 1:
+            emu.keypad = [False] * 16
+
+def draw_flagged(disp):
+    if disp.emu.draw_flag:
+        disp.emu.draw_flag = False
+        disp.draw()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+from . import export
+from array import array
+from time import perf_counter
+from collections import Counter
+from .salsa import Salsa
+from .blackbean import Symbols
+from .constants.reg_rom_stack import BYTES_OF_RAM
+__all__ = []
+
+@export
+class Comal:
+    '''
+    Comal is a profiler for Chip-8 programs running in Guacamole. It counts
+    how often every address is executed and times each instruction
+    using counters indexed by address, and counts every backward jump to
+    find loops. Addresses are shown as labels when symbols are given.
+    '''
+
+    def __init__(self, symbols=None):
+        '''
+        Symbols is a dict of label to address, such as Blackbean.mmap or
+        the result of read_symbols.
+        '''
+        self.counts = array('L', [0] * BYTES_OF_RAM)
+        self.times  = array('d', [0.0] * BYTES_OF_RAM)
+        self.loops  = Counter()
+        self.last   = None
+        self.symbols = Symbols(symbols)
+
+    def attach(self, emu):
+        emu.add_tick_hook(self.start, before=True)
+        emu.add_tick_hook(self.sample)
+
+    def detach(self, emu):
+        emu.remove_tick_hook(self.start)
+        emu.remove_tick_hook(self.sample)
+
+    def start(self, emu):
+        self.last = perf_counter()
+
+    def sample(self, emu):
+        '''
+        Tick hook. The time since the instruction was fetched is charged to
+        it, so time spent drawing or sleeping between instructions is not.
+        Addresses past the end of RAM are not counted.
+        '''
+        now = perf_counter()
+        pc = emu.calling_pc
+        if pc >= BYTES_OF_RAM:
+            return
+        self.counts[pc] += 1
+        self.times[pc] += now - self.last
+        self.last = now
+        # Only jumps make loops, a ret or call to a lower address does not
+        ins = emu.dis_ins
+        if emu.program_counter <= pc and ins is not None and ins.mnemonic == 'jp':
+            self.loops[(emu.program_counter, pc)] += 1
+
+    def hottest(self, top=10):
+        return sorted((a for a in range(BYTES_OF_RAM) if self.counts[a]),
+                      key=lambda a: self.counts[a], reverse=True)[:top]
+
+    def by_mnemonic(self, ram):
+        '''
+        Counts and times per mnemonic, using the opcodes currently in ram.
+        '''
+        counts, times = Counter(), Counter()
+        for addr in range(BYTES_OF_RAM - 1):
+            if not self.counts[addr] or ram[addr] is None or ram[addr + 1] is None:
+                continue
+            mnemonic = Salsa(ram[addr:addr + 2]).mnemonic
+            counts[mnemonic] += self.counts[addr]
+            times[mnemonic] += self.times[addr]
+        return counts, times
+
+    def report(self, ram, top=10, file_handler=None):
+        '''
+        Prints the hottest addresses, mnemonics, and loops.
+        '''
+        total = sum(self.counts)
+        total_time = sum(self.times) or 1
+        lines = ["Instructions: " + str(total), "", "Hottest addresses:"]
+        for addr in self.hottest(top):
+            lines.append("  " + self.symbols.name(addr).ljust(20) + str(self.counts[addr]).rjust(10) +
+                format(100 * self.times[addr] / total_time, '8.2f') + "%")
+
+        counts, times = self.by_mnemonic(ram)
+        lines += ["", "Mnemonics:"]
+        for mnemonic, count in counts.most_common():
+            lines.append("  " + str(mnemonic).ljust(20) + str(count).rjust(10) +
+                format(100 * times[mnemonic] / total_time, '8.2f') + "%")
+
+        lines += ["", "Hottest loops:"]
+        for (start, end), count in self.loops.most_common(top):
+            body = sum(self.counts[a] for a in range(start, end + 1, 2))
+            lines.append("  " + (self.symbols.name(start) + " - " + self.symbols.name(end)).ljust(30) +
+                str(count).rjust(10) + " iterations" + str(body).rjust(10) + " instructions")
+
+        for line in lines:
+            if file_handler is None:
+                print(line)
+            else:
+                file_handler.write(line + '\n')
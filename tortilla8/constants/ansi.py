@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+
+# Escape sequences
+CSI          = '\x1b['
+CLEAR_SCREEN = CSI + '2J'
+CURSOR_HOME  = CSI + 'H'
+HIDE_CURSOR  = CSI + '?25l'
+SHOW_CURSOR  = CSI + '?25h'
+RESET_ATTR   = CSI + '0m'
+CLEAR_LINE   = CSI + 'K'
+
+def cursor_to(row, col):
+    # Rows and columns are 1 indexed
+    return CSI + str(row) + ';' + str(col) + 'H'
+
+# Layout, game screen is drawn at the top left with the status line below it
+SCREEN_ROW  = 1
+SCREEN_COL  = 1
+STATUS_ROW  = 18
+
+# Action keys
+ANSI_KEY_EXIT = 'x'
+KEY_DECAY     = 0.5 # Seconds a key press is held for
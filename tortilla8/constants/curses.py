@@ -38,6 +38,8 @@ KEY_EXIT  = 120 # X
 KEY_RESET = 114 # R
 KEY_REWIN = 119 # W
 KEY_RESUM = 117 # U
+KEY_BREAK = 98  # B
+KEY_FORWD = 102 # F
 
 KEY_CONTROLS={
 48:0x0, 49:0x1, 50:0x2, 51:0x3, # 0 1 2 3
@@ -47,12 +49,52 @@ KEY_CONTROLS={
 
 KEY_ARROW_MAP={65:'up',66:'down',67:'right',68:'left'}
 
+# Instruction history markers, stored in the unused upper bits of the PC
+HIST_PC_MASK = 0x0FFF
+HIST_REWIND  = 0x1000
+HIST_KEY     = 0x2000
+HIST_SPIN    = 0x3000
+
 # Graphics Draw
 from collections import namedtuple
 CHAR_SET = namedtuple('CHAR_SET', 'upper lower both empty')
 UNICODE_DRAW = CHAR_SET('▀','▄','█',' ')
 WIN_DRAW = CHAR_SET('*','o','8',' ')
 
+# Super Chip-8 high resolution is drawn with braille, a cell showing 2x4
+# pixels. Dots by pixel row for each pair of pixels (left one in the top bit)
+BRAILLE_BLANK = 0x2800
+BRAILLE_PAIRS = tuple( tuple( (left if pair & 2 else 0) | (right if pair & 1 else 0) for pair in range(4) )
+                       for left, right in ((0x01, 0x08), (0x02, 0x10), (0x04, 0x20), (0x40, 0x80)) )
+TEXT_ROWS = 16 # Text rows of the game screen in either resolution
+
+def screen_cells(rows, y, draw_char):
+    '''
+    The 64 characters of text row y of the game screen, given its pixel
+    rows as ints (see Guacamole.screen_rows). Low resolution cells hold
+    two pixels stacked. High resolution cells hold 2x4 pixels as braille,
+    or without unicode, two stacked pixels each merged from 2x2.
+    '''
+    if len(rows) == TEXT_ROWS * 4:
+        if draw_char is UNICODE_DRAW:
+            dots0, dots1, dots2, dots3 = BRAILLE_PAIRS
+            row0, row1, row2, row3 = rows[y * 4:y * 4 + 4]
+            return [chr(BRAILLE_BLANK | dots0[(row0 >> bit) & 3] | dots1[(row1 >> bit) & 3] |
+                        dots2[(row2 >> bit) & 3] | dots3[(row3 >> bit) & 3]) for bit in range(126, -1, -2)]
+        upper = merge_pairs(rows[y * 4] | rows[y * 4 + 1])
+        lower = merge_pairs(rows[y * 4 + 2] | rows[y * 4 + 3])
+    else:
+        upper, lower = rows[y * 2], rows[y * 2 + 1]
+    chars = (draw_char.empty, draw_char.upper, draw_char.lower, draw_char.both)
+    return [chars[((upper >> bit) & 1) | (((lower >> bit) & 1) << 1)] for bit in range(63, -1, -1)]
+
+def merge_pairs(row):
+    # Each pair of pixels becomes one, set if either was
+    merged = 0
+    for bit in range(126, -1, -2):
+        merged = (merged << 1) | (1 if (row >> bit) & 3 else 0)
+    return merged
+
 KEYPAD_DRAW=[
 '┌────────────────┐',
 '│     Keypad     │',
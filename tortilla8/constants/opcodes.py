@@ -8,6 +8,12 @@ OpData = namedtuple('OpData', 'regular, args, hex')
 OP_CODES = {                                 # X and Y in the right most indicates if it is for the 1st or 2nd arg
     'cls' : OpData('00e0',[],'00E0'),
     'ret' : OpData('00ee',[],'00EE'),
+    'scd' : OpData('00c.',['nibble'],'00Cx'),   # Super Chip-8 from here to 'high'
+    'scr' : OpData('00fb',[],'00FB'),
+    'scl' : OpData('00fc',[],'00FC'),
+    'exit': OpData('00fd',[],'00FD'),
+    'low' : OpData('00fe',[],'00FE'),
+    'high': OpData('00ff',[],'00FF'),
     'sys' : OpData('0(^0)..',['addr'],'0xxx'), # prevent match to cls or ret
     'call': OpData('2...',['addr'],'2xxx'),
     'skp' : OpData('e.9e',['reg'],'Ex9E'),
@@ -41,13 +47,16 @@ OP_CODES = {                                 # X and Y in the right most indicat
             OpData('f.18',['st','reg'],'Fy18'),
             OpData('f.29',['f','reg'],'Fy29'),
             OpData('f.33',['b','reg'],'Fy33'),
-            OpData('f.55',['[i]','reg'],'Fy55')),
+            OpData('f.55',['[i]','reg'],'Fy55'),
+            OpData('f.30',['hf','reg'],'Fy30'),   # Super Chip-8
+            OpData('f.75',['r','reg'],'Fy75'),    # Super Chip-8
+            OpData('f.85',['reg','r'],'Fx85')),   # Super Chip-8
     'drw' : OpData('d...',['reg','reg','nibble'],'Dxyz')
     }
 
 UNOFFICIAL_OP_CODES = ('xor','shr','shl','subn') # But still supported
 BANNED_OP_CODES = ('7f..','8f.4','8f.6','8f.e','cf..','6f..','8f.0','ff07','ff0a','ff65') # Ins that modify VF: add, shr, shl, rnd, ld
-SUPER_CHIP_OP_CODES = ('00c.','00fb','00fc','00fd','00fe','00ff','d..0','f.30','f.75','f.85') # Super chip-8, not supported
+SUPER_CHIP_OP_CODES = ('00c.','00fb','00fc','00fd','00fe','00ff','d..0','f.30','f.75','f.85') # Super chip-8
 
 # Used to explode opcodes that are not used (below)
 def explode_op_codes( op_code_list ):
@@ -56,11 +65,8 @@ def explode_op_codes( op_code_list ):
         if item.find('.') == -1:
             exploded_list.append(item)
         else:
-            upper,repl,fill = 16,'.',1
-            if item[2:] == '..':
-                upper,repl,fill = 256,'..',2
-            for i in range(0, upper):
-                exploded_list.append(item.replace(repl, hex(i)[2:].zfill(fill)))
+            for i in range(0, 16):
+                exploded_list.extend(explode_op_codes([item.replace('.', hex(i)[2:], 1)]))
     return exploded_list
 
 BANNED_OP_CODES_EXPLODED = explode_op_codes(BANNED_OP_CODES)
@@ -7,6 +7,7 @@ REGISTERS = ('v0','v1','v2','v3',
             'v4','v5','v6','v7',
             'v8','v9','va','vb',
             'vc','vd','ve','vf')
+RPL_FLAGS = 8 # Super Chip-8 'ld r, vx' storage, one per register up to v7
 
 # ROM Memory Addresses and Related
 BYTES_OF_RAM = 4096
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+from . import export
+from collections import Counter
+from .blackbean import Symbols
+__all__ = []
+
+ROOT_FRAME = 'main'
+
+@export
+class Elote:
+    '''
+    Elote samples the Chip-8 call stack of a Guacamole instance every
+    'interval' instructions and writes the samples in the folded stack
+    format used by flamegraph tools (one 'main;outer;inner count' line per
+    distinct stack). Frames are named after the subroutine that was called,
+    as a label when symbols are given.
+    '''
+
+    def __init__(self, interval=100, symbols=None):
+        self.interval = interval
+        self.countdown = interval
+        self.samples = Counter()
+        self.symbols = Symbols(symbols)
+
+    def attach(self, emu):
+        emu.add_tick_hook(self.sample)
+
+    def detach(self, emu):
+        emu.remove_tick_hook(self.sample)
+
+    def sample(self, emu):
+        '''
+        Tick hook, only does work once every 'interval' instructions.
+        '''
+        self.countdown -= 1
+        if self.countdown:
+            return
+        self.countdown = self.interval
+
+        # The stack holds the address of every call, the frame is where it went
+        ram = emu.ram
+        self.samples[tuple(((ram[site] & 0x0F) << 8) | ram[site + 1] for site in emu.stack)] += 1
+
+    def folded(self):
+        '''
+        Yields every sampled stack as a folded stack line.
+        '''
+        names = {}
+        for stack, count in self.samples.items():
+            frames = [ROOT_FRAME]
+            for addr in stack:
+                if addr not in names:
+                    names[addr] = self.symbols.name(addr)
+                frames.append(names[addr])
+            yield ';'.join(frames) + ' ' + str(count)
+
+    def export_folded(self, file_handler=None):
+        for line in self.folded():
+            if file_handler is None:
+                print(line)
+            else:
+                file_handler.write(line + '\n')
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+from . import export
+import os
+from array import array
+from queue import Queue
+from struct import Struct
+from zlib import crc32
+from threading import Thread
+from collections import namedtuple
+from sys import byteorder
+from .salsa import Salsa
+from .palomitas import rom_checksum
+from .constants.reg_rom_stack import BYTES_OF_RAM, RPL_FLAGS
+from .constants.graphics import HIRES_WIDTH, HIRES_HEIGHT_PX
+__all__ = []
+
+# Journal layout, all values big endian
+#   Header: magic, version, crc32 of the ROM
+#   Record: length of the body, crc32 of the body, instruction count, then the
+#           body: a mask of the RAM pages that follow (page 0 is the top bit),
+#           each page as signed 16 bit values (-1 for never written), and the
+#           registers (ESCABECHE_STATE), the rpl flags, and the high resolution
+#           screen if FLAG_HIRES is set. The first record after the header,
+#           and the only one after compacting, has every page.
+#   Version 1 journals have no rpl flags or high resolution screen.
+ESCABECHE_MAGIC   = b'T8AS'
+ESCABECHE_VERSION = 2
+ESCABECHE_HEADER  = Struct('>4sBI')
+ESCABECHE_RECORD  = Struct('>IIQ')
+ESCABECHE_PAGES   = Struct('>H')
+ESCABECHE_STATE   = Struct('>16sHBBHHB16HBBHHIQ')
+PAGE_SIZE  = 256
+PAGE_COUNT = BYTES_OF_RAM // PAGE_SIZE
+
+# Flags in the state
+FLAG_WAITING  = 1
+FLAG_SPINNING = 2
+FLAG_FATAL    = 4
+FLAG_HIRES    = 8
+
+@export
+class Escabeche:
+    '''
+    Escabeche autosaves an emulator in the background. Every interval
+    frames the emulation thread compares RAM with the previous save, one
+    page at a time, and queues only the pages that changed along with the
+    registers, which is a few microseconds of work. A writer thread appends
+    them to a journal and compacts it into a single full save once it
+    holds compact_after records, by writing a new file and renaming it over
+    the old, so a session killed at any point can be resumed from its last
+    save with read_escabeche and restore_savestate.
+    '''
+
+    def __init__(self, path, interval=60, compact_after=64):
+        self.path = path
+        self.interval = interval
+        self.compact_after = compact_after
+        self.queue = Queue()
+        self.saved = [None] * PAGE_COUNT
+        self.frames = 0
+        self.emu = None
+        self.thread = None
+
+    def attach(self, emu, rom=None):
+        '''
+        Starts saving emu, a save of every page is written straight away.
+        Rom is the path of the ROM, its checksum is kept to check restores.
+        '''
+        self.emu = emu
+        self.writer = JournalWriter(self.path, rom_checksum(rom), self.compact_after)
+        self.thread = Thread(target=self.writer.run, args=(self.queue,), daemon=True)
+        self.thread.start()
+        self.saved = [None] * PAGE_COUNT
+        self.save(emu)
+        emu.frame_hooks.append(self.frame)
+
+    def detach(self):
+        '''
+        Saves a last time, then waits for the writer to finish.
+        '''
+        self.emu.frame_hooks.remove(self.frame)
+        self.save(self.emu)
+        self.queue.put(None)
+        self.thread.join()
+        self.emu = None
+
+    def frame(self, emu):
+        self.frames += 1
+        if self.frames % self.interval == 0:
+            self.save(emu)
+
+    def save(self, emu):
+        '''
+        Queues the pages that changed since the previous save, and the
+        registers. Never waits on the writer.
+        '''
+        ram, pages = emu.ram, {}
+        for page in range(PAGE_COUNT):
+            data = ram[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+            if data != self.saved[page]:
+                self.saved[page] = data
+                pages[page] = data
+        self.queue.put_nowait((emu.cycle_count, pages, pack_state(emu)))
+
+class JournalWriter:
+    '''
+    The writer thread of Escabeche, it also keeps every page so it can
+    compact the journal without asking the emulation thread.
+    '''
+    def __init__(self, path, rom_crc, compact_after):
+        self.path = path
+        self.rom_crc = rom_crc
+        self.compact_after = compact_after
+        self.pages = [None] * PAGE_COUNT
+        self.records = compact_after
+
+    def run(self, queue):
+        # The first save replaces the journal, which may be the one resumed from
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            count, pages, state = item
+            for page, data in pages.items():
+                self.pages[page] = encode_page(data)
+
+            if self.records >= self.compact_after:
+                self.compact(count, state)
+            else:
+                with open(self.path, 'ab') as fh:
+                    fh.write(pack_record(count, {p: self.pages[p] for p in pages}, state))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                self.records += 1
+
+    def compact(self, count, state):
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as fh:
+            fh.write(ESCABECHE_HEADER.pack(ESCABECHE_MAGIC, ESCABECHE_VERSION, self.rom_crc))
+            fh.write(pack_record(count, dict(enumerate(self.pages)), state))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(temp, self.path)
+        self.records = 1
+
+############################################################
+# Reading saves back
+
+@export
+class Savestate( namedtuple('Savestate', 'rom_crc cycle_count ram state') ):
+    '''
+    The last save of a journal, see read_escabeche. State is the packed
+    registers (ESCABECHE_STATE) followed by the Super Chip-8 state.
+    '''
+    pass
+
+@export
+def read_escabeche(file_handler):
+    '''
+    Reads a journal written by Escabeche and returns the Savestate of its
+    last complete record, or None if there is none. A record cut short
+    by the process being killed is ignored.
+    '''
+    magic, version, rom_crc = ESCABECHE_HEADER.unpack(file_handler.read(ESCABECHE_HEADER.size))
+    if magic != ESCABECHE_MAGIC:
+        raise ValueError("Not an autosave journal")
+    if version not in (1, ESCABECHE_VERSION):
+        raise ValueError("Unsupported autosave version " + str(version))
+
+    ram, savestate = [None] * BYTES_OF_RAM, None
+    while True:
+        head = file_handler.read(ESCABECHE_RECORD.size)
+        if len(head) < ESCABECHE_RECORD.size:
+            break
+        length, crc, count = ESCABECHE_RECORD.unpack(head)
+        body = file_handler.read(length)
+        if len(body) < length or crc32(body) != crc:
+            break
+
+        mask = ESCABECHE_PAGES.unpack_from(body)[0]
+        offset = ESCABECHE_PAGES.size
+        for page in range(PAGE_COUNT):
+            if mask & (0x8000 >> page):
+                ram[page * PAGE_SIZE:(page + 1) * PAGE_SIZE] = decode_page(body[offset:offset + 2 * PAGE_SIZE])
+                offset += 2 * PAGE_SIZE
+        savestate = Savestate(rom_crc, count, ram.copy(), body[offset:])
+    return savestate
+
+@export
+def restore_savestate(emu, savestate, rom=None):
+    '''
+    Puts emu in the state saved. If the ROM is given it must be the one
+    that was saved.
+    '''
+    if rom is not None and rom_checksum(rom) != savestate.rom_crc:
+        raise ValueError("The autosave is of another ROM")
+
+    values = ESCABECHE_STATE.unpack_from(savestate.state)
+    schip = savestate.state[ESCABECHE_STATE.size:]
+    registers, index, dt, st, pc, calling_pc, sp = values[:7]
+    stack = list(values[7:23])
+    depth, flags, prev_keypad, keypad, seed, drawn = values[23:]
+    emu.ram[:] = savestate.ram
+    emu.invalidate(0, BYTES_OF_RAM)
+    emu.cycle_count = savestate.cycle_count
+    emu.register = list(registers)
+    emu.index_register = index
+    emu.delay_timer_register, emu.sound_timer_register = dt, st
+    emu.program_counter, emu.calling_pc = pc, calling_pc
+    emu.stack, emu.stack_pointer = stack[:depth], sp
+    emu.waiting_for_key = bool(flags & FLAG_WAITING)
+    emu.spinning = bool(flags & FLAG_SPINNING)
+    emu.draw_flag = True
+    emu.fatal = bool(flags & FLAG_FATAL)
+    emu.rpl_flags = list(schip[:RPL_FLAGS]) or [0] * RPL_FLAGS
+    emu.hires = bool(flags & FLAG_HIRES)
+    if emu.hires:
+        emu.hires_rows = [int.from_bytes(schip[start:start + HIRES_WIDTH], 'big')
+                          for start in range(RPL_FLAGS, RPL_FLAGS + HIRES_WIDTH * HIRES_HEIGHT_PX, HIRES_WIDTH)]
+    emu.prev_keypad = prev_keypad
+    emu.encode_keypad(keypad)
+    emu.rng.seed = seed
+    emu.rng.seek(drawn)
+    opcode = emu.ram[calling_pc:calling_pc + 2]
+    emu.dis_ins = Salsa(opcode) if None not in opcode else None
+    if emu.hashing:
+        emu.rehash()
+
+############################################################
+# Encoding helpers
+
+def pack_state(emu):
+    stack = emu.stack[:16]
+    flags = (FLAG_WAITING if emu.waiting_for_key else 0) | (FLAG_SPINNING if emu.spinning else 0) | \
+            (FLAG_FATAL if emu.fatal else 0) | (FLAG_HIRES if emu.hires else 0)
+    state = ESCABECHE_STATE.pack(bytes(emu.register), emu.index_register,
+        emu.delay_timer_register, emu.sound_timer_register, emu.program_counter, emu.calling_pc,
+        emu.stack_pointer, *(stack + [0] * (16 - len(stack))), len(stack), flags,
+        emu.prev_keypad, emu.decode_keypad(), emu.rng.seed, emu.rng.drawn) + bytes(emu.rpl_flags)
+    if emu.hires:
+        state += b''.join(row.to_bytes(HIRES_WIDTH, 'big') for row in emu.hires_rows)
+    return state
+
+def pack_record(count, pages, state):
+    mask = 0
+    for page in pages:
+        mask |= 0x8000 >> page
+    body = ESCABECHE_PAGES.pack(mask) + b''.join(pages[p] for p in sorted(pages)) + state
+    return ESCABECHE_RECORD.pack(len(body), crc32(body), count) + body
+
+def encode_page(data):
+    page = array('h', (-1 if v is None else v for v in data))
+    if byteorder == 'little':
+        page.byteswap()
+    return page.tobytes()
+
+def decode_page(data):
+    page = array('h')
+    page.frombytes(data)
+    if byteorder == 'little':
+        page.byteswap()
+    return [None if v < 0 else v for v in page]
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+from . import export
+from . import EmulationError
+import os
+import asyncio
+from struct import Struct
+from time import monotonic
+from itertools import count
+from .guacamole import Guacamole
+from .pozole import Pozole
+from .constants.graphics import GFX_ADDRESS, GFX_RESOLUTION, HIRES_WIDTH
+__all__ = []
+
+# Messages are a type byte and the length of the payload, then the payload
+#   Client: NEW      path of the ROM to run, relative to the host's ROM directory
+#           WATCH    id of a session to join, 4 bytes
+#           KEYS     keypad mask, 2 bytes (key 0 is the top bit)
+#   Host:   SESSION  id of the session joined, 4 bytes
+#           KEYFRAME the whole screen, sent on joining and when the resolution
+#                    changes, see Pozole
+#           DELTA    the rows that changed since the last frame, see Pozole
+#           STATE    one byte of STATE_* flags, sent when it changes
+#           ERROR    utf-8 message, the host then closes the connection
+FONDA_MESSAGE = Struct('>BH')
+FONDA_KEYS    = Struct('>H')
+FONDA_ID      = Struct('>I')
+MSG_NEW      = 1
+MSG_WATCH    = 2
+MSG_KEYS     = 3
+MSG_SESSION  = 4
+MSG_KEYFRAME = 5
+MSG_DELTA    = 6
+MSG_STATE    = 7
+MSG_ERROR    = 8
+
+STATE_RUNNING     = 0
+STATE_WAITING_KEY = 1
+STATE_SPINNING    = 2
+STATE_FATAL       = 4
+
+# Bytes queued for a client before its frames are held back
+FONDA_BACKLOG = 64 * 1024
+
+@export
+class FondaSession:
+    '''
+    A Guacamole run by Fonda, and the connections viewing it. Each viewer
+    has a Pozole with the screen as it last saw it, a viewer that is not
+    keeping up skips frames and gets one delta for all of them later.
+    Any viewer may press keys, the session ends when the last one leaves.
+    '''
+    def __init__(self, session_id, emu):
+        self.id = session_id
+        self.emu = emu
+        self.viewers = {}
+        self.screen = screen_bytes(emu)
+        self.owed = 0.0
+        self.parked_at = None
+        self.state = STATE_RUNNING
+        self.instructions = 0
+
+    def join(self, writer):
+        send_message(writer, MSG_SESSION, FONDA_ID.pack(self.id))
+        viewer = self.viewers[writer] = Pozole()
+        send_message(writer, MSG_KEYFRAME, viewer.keyframe(self.screen))
+        send_message(writer, MSG_STATE, bytes((self.state,)))
+
+    def leave(self, writer):
+        self.viewers.pop(writer, None)
+
+    def run(self, slice_hz):
+        '''
+        Runs the instructions due in one slice of 1/slice_hz seconds, with
+        timers stepped by instruction count, then sends what changed. Parks
+        the session if it is left waiting for a key, spinning, or dead. An
+        exception raised by the emulator kills this session only.
+        '''
+        emu = self.emu
+        self.owed += emu.cpu_hz / slice_hz
+        cycles = int(self.owed)
+        self.owed -= cycles
+        try:
+            self.instructions += emu.run_for(cycles)
+            if emu.draw_flag:
+                emu.draw_flag = False
+                self.screen = screen_bytes(emu)
+        except Exception as error:
+            emu.log("Session {} stopped by {}: {}", EmulationError._Fatal,
+                self.id, type(error).__name__, error)
+        self.send_frames()
+
+        state = (STATE_WAITING_KEY if emu.waiting_for_key else 0) | \
+                (STATE_SPINNING if emu.spinning else 0) | (STATE_FATAL if emu.fatal else 0)
+        if state:
+            self.parked_at = monotonic()
+            self.owed = 0.0
+        if state != self.state:
+            self.state = state
+            for writer in self.viewers:
+                send_message(writer, MSG_STATE, bytes((state,)))
+
+    def send_frames(self):
+        for writer, viewer in self.viewers.items():
+            if writer.transport.get_write_buffer_size() > FONDA_BACKLOG:
+                continue
+            if len(self.screen) != len(viewer.screen):
+                send_message(writer, MSG_KEYFRAME, viewer.keyframe(self.screen))
+                continue
+            delta = viewer.delta(self.screen)
+            if delta is not None:
+                send_message(writer, MSG_DELTA, delta)
+
+    def press(self, mask):
+        '''
+        Sets the keypad and wakes the session. The timers are wound down by
+        the time spent parked, as if it had been running all along.
+        '''
+        emu = self.emu
+        emu.encode_keypad(mask)
+        if self.parked_at is None or emu.fatal:
+            return
+        ticks = int((monotonic() - self.parked_at) * emu.delay_hz)
+        emu.delay_timer_register = max(0, emu.delay_timer_register - ticks)
+        emu.sound_timer_register = max(0, emu.sound_timer_register - ticks)
+        emu.spinning = False
+        self.parked_at = None
+
+@export
+class Fonda:
+    '''
+    Fonda hosts many Guacamole sessions in one process, for kiosks and bot
+    farms. Clients connect over a Unix socket, start a session with a ROM
+    or join one to spectate, send key presses, and receive the screen as a
+    keyframe followed by deltas of the rows that changed (see Pozole).
+    Every 1/slice_hz seconds each running session runs the instructions it
+    is due, starting from a different session each time so that none is
+    always last. When the host falls behind the debt is dropped, slowing
+    every session alike. Sessions waiting for a key, spinning, or stopped
+    by a fatal error are parked and cost nothing until a key arrives.
+    '''
+
+    def __init__(self, rom_dir='.', cpuhz=500, slice_hz=60, max_sessions=512, **emu_args):
+        '''
+        Emu_args are passed to every Guacamole, rewind is off by default.
+        '''
+        self.rom_dir = os.path.realpath(rom_dir)
+        self.cpu_hz = cpuhz
+        self.slice_hz = slice_hz
+        self.max_sessions = max_sessions
+        emu_args.setdefault('rewind_frames', 0)
+        self.emu_args = emu_args
+        self.sessions = []
+        self.by_id = {}
+        self.ids = count(1)
+        self.turn = 0
+
+    async def serve(self, path):
+        '''
+        Serves clients on the Unix socket at path until cancelled.
+        '''
+        server = await asyncio.start_unix_server(self.client, path, backlog=self.max_sessions)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.schedule())
+
+    def open_rom(self, name):
+        '''
+        Path of a ROM in rom_dir, or None if there is no such ROM.
+        '''
+        path = os.path.realpath(os.path.join(self.rom_dir, name))
+        if os.path.commonpath((path, self.rom_dir)) != self.rom_dir or not os.path.isfile(path):
+            return None
+        return path
+
+    async def client(self, reader, writer):
+        session = None
+        try:
+            kind, payload = await read_message(reader)
+            if kind == MSG_NEW:
+                path = self.open_rom(payload.decode('utf-8', 'replace'))
+                if path is None:
+                    send_message(writer, MSG_ERROR, b'No such ROM')
+                    return
+                if len(self.sessions) >= self.max_sessions:
+                    send_message(writer, MSG_ERROR, b'Too many sessions')
+                    return
+                session = FondaSession(next(self.ids), Guacamole(path, self.cpu_hz, **self.emu_args))
+                self.sessions.append(session)
+                self.by_id[session.id] = session
+            elif kind == MSG_WATCH and len(payload) == FONDA_ID.size:
+                session = self.by_id.get(FONDA_ID.unpack(payload)[0])
+                if session is None:
+                    send_message(writer, MSG_ERROR, b'No such session')
+                    return
+            else:
+                send_message(writer, MSG_ERROR, b'Expected a ROM or a session to watch')
+                return
+
+            session.join(writer)
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == MSG_KEYS and len(payload) == FONDA_KEYS.size:
+                    session.press(FONDA_KEYS.unpack(payload)[0])
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            if session is not None:
+                session.leave(writer)
+                if not session.viewers:
+                    self.end(session)
+            writer.close()
+
+    def end(self, session):
+        if self.by_id.pop(session.id, None) is not None:
+            self.sessions.remove(session)
+
+    async def schedule(self):
+        '''
+        Runs a slice of every running session, slice_hz times a second.
+        '''
+        period = 1 / self.slice_hz
+        deadline = monotonic()
+        while True:
+            sessions = self.sessions
+            if sessions:
+                first = self.turn % len(sessions)
+                for session in sessions[first:] + sessions[:first]:
+                    if session.parked_at is None:
+                        session.run(self.slice_hz)
+                        await asyncio.sleep(0)
+                self.turn += 1
+
+            deadline += period
+            delay = deadline - monotonic()
+            if delay < 0:
+                deadline, delay = monotonic(), 0
+            await asyncio.sleep(delay)
+
+def screen_bytes(emu):
+    '''
+    The screen of emu as Pozole encodes it, one row after another.
+    '''
+    if emu.hires:
+        return b''.join(row.to_bytes(HIRES_WIDTH, 'big') for row in emu.hires_rows)
+    return bytes(emu.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION])
+
+############################################################
+# Framing shared by the host and its clients
+
+@export
+def pack_message(kind, payload=b''):
+    return FONDA_MESSAGE.pack(kind, len(payload)) + payload
+
+@export
+def send_message(writer, kind, payload=b''):
+    writer.write(pack_message(kind, payload))
+
+@export
+def unpack_messages(buffer):
+    '''
+    Removes the complete messages from the front of buffer, a bytearray,
+    and returns them as a list of (type, payload).
+    '''
+    messages, start = [], 0
+    while len(buffer) - start >= FONDA_MESSAGE.size:
+        kind, length = FONDA_MESSAGE.unpack_from(buffer, start)
+        end = start + FONDA_MESSAGE.size + length
+        if end > len(buffer):
+            break
+        messages.append((kind, bytes(buffer[start + FONDA_MESSAGE.size:end])))
+        start = end
+    del buffer[:start]
+    return messages
+
+@export
+async def read_message(reader):
+    '''
+    Returns the type and payload of the next message.
+    '''
+    kind, length = FONDA_MESSAGE.unpack(await reader.readexactly(FONDA_MESSAGE.size))
+    return kind, await reader.readexactly(length)
@@ -2,23 +2,118 @@
 
 from . import export
 from . import EmulationError
+from os import urandom
 from os.path import getsize
 from time import time
+from random import Random
 from .salsa import Salsa
 from collections import namedtuple, deque
 from .instructions import *
 from .constants.reg_rom_stack import BYTES_OF_RAM, PROGRAM_BEGIN_ADDRESS, \
-                                     NUMB_OF_REGS, MAX_ROM_SIZE
-from .constants.graphics import GFX_FONT, GFX_FONT_ADDRESS, GFX_RESOLUTION, GFX_ADDRESS
+                                     NUMB_OF_REGS, MAX_ROM_SIZE, STACK_ADDRESS, RPL_FLAGS
+from .constants.graphics import GFX_FONT, GFX_FONT_ADDRESS, GFX_RESOLUTION, GFX_ADDRESS, \
+                                GFX_WIDTH, GFX_WIDTH_PX, SET_VF_ON_GFX_OVERFLOW, \
+                                GFX_BIG_FONT, GFX_BIG_FONT_ADDRESS, HIRES_HEIGHT_PX, HIRES_WIDTH_PX
 __all__ = []
 
+# Number of log events kept in the error log
+LOG_SIZE = 256
+
+# Random bytes generated at a time for rnd
+RNG_BLOCK = 4096
+
+# Instructions between full RAM checks in debug mode, see debug_sweep
+DEBUG_SWEEP = 4096
+
+# Keys for the RAM hash, one per address and one per value (None is 256).
+# Generated from a fixed seed so hashes can be compared between runs.
+_hash_keys = Random(0x7A8)
+HASH_ADDRESS_KEYS = [_hash_keys.getrandbits(64) | 1 for _ in range(BYTES_OF_RAM)]
+HASH_VALUE_KEYS   = [_hash_keys.getrandbits(64) for _ in range(257)]
+HASH_MASK         = (1 << 64) - 1
+
 # TODO Rewind bug when waiting for keypress
 # TODO Rewind isn't storing all of RAM, so ld [i], reg will break rewind
 
 @export
 class RewindData( namedtuple('RewindData', 'gfx_buffer register index_register ' + \
     'delay_timer_register sound_timer_register program_counter calling_pc ' + \
-    'dis_ins stack stack_pointer draw_flag waiting_for_key spinning') ):
+    'dis_ins stack stack_pointer draw_flag waiting_for_key spinning hires_rows') ):
+    '''
+    hires_rows is a copy of the high resolution screen, None in low
+    resolution (where the screen is in gfx_buffer).
+    '''
+    pass
+
+@export
+class Quirks( namedtuple('Quirks', 'legacy_shift index_overflow stack_address ' + \
+    'index_increment jump_vx') ):
+    '''
+    Behaviours that differ between Chip-8 interpreters. legacy_shift shifts
+    VY into VX, index_overflow sets VF when 'add i, vx' passes 0xFFF,
+    stack_address mirrors the stack to RAM at that address (None to not),
+    index_increment leaves I past the registers after 'ld [i], vx' and
+    'ld vx, [i]', and jump_vx makes 'jp v0, xnn' jump to xnn plus VX.
+    '''
+    pass
+
+# Named quirk profiles, see Guacamole's quirks argument
+QUIRK_PROFILES = {
+    'modern'      : Quirks(False, False, None,  False, False),
+    'cosmac'      : Quirks(True,  False, 0xEA0, True,  False),
+    'schip-compat': Quirks(False, False, None,  False, True),
+    'amiga'       : Quirks(False, True,  None,  False, False)}
+
+@export
+class Rng:
+    '''
+    Seedable source of random bytes for the rnd instruction. Bytes are
+    served from a buffer that is refilled RNG_BLOCK bytes at a time, and
+    the same 32 bit seed always gives the same bytes, on any machine. The
+    seed and the number of bytes drawn are enough to restore the state.
+    '''
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = int.from_bytes(urandom(4), 'big')
+        self.seed = seed & 0xFFFFFFFF
+        self.seek(0)
+
+    def seek(self, drawn):
+        '''
+        Restarts the generator as if drawn bytes had been taken from it.
+        '''
+        self.random = Random(self.seed)
+        for _ in range(drawn // RNG_BLOCK):
+            self.random.getrandbits(RNG_BLOCK * 8)
+        self.refill()
+        self.pos = drawn % RNG_BLOCK
+        self.drawn = drawn
+
+    def refill(self):
+        self.buffer = self.random.getrandbits(RNG_BLOCK * 8).to_bytes(RNG_BLOCK, 'little')
+        self.pos = 0
+
+    def byte(self):
+        if self.pos == RNG_BLOCK:
+            self.refill()
+        self.pos += 1
+        self.drawn += 1
+        return self.buffer[self.pos - 1]
+
+# Kinds of EmuEvent, see Guacamole.events
+EVENT_FRAME     = 'frame'
+EVENT_SOUND_ON  = 'sound on'
+EVENT_SOUND_OFF = 'sound off'
+EVENT_KEY_WAIT  = 'key wait'
+EVENT_FATAL     = 'fatal'
+EVENT_SPIN      = 'spin'
+
+@export
+class EmuEvent( namedtuple('EmuEvent', 'kind cycle data') ):
+    pass
+
+@export
+class LogEvent( namedtuple('LogEvent', 'error_type message cycle program_counter') ):
     pass
 
 @export
@@ -29,16 +124,21 @@ class Guacamole:
     '''
     def __init__(self, rom=None, cpuhz=200, audiohz=60, delayhz=60,
                  init_ram=False, legacy_shift=False, err_unoffical="None",
-                 rewind_frames=1000):
+                 rewind_frames=1000, log_level=None, quirks=None, seed=None):
         '''
         Init the RAM, registers, instruction information, IO, load the ROM etc. ROM
         is a path to a chip-8 rom, *hz is the frequency to target for for the cpu,
         audio register, or delay register. Init_Ram signals that the RAM should be
         initialized to zero. Not initializing the RAM is a great way to find
         incorrect RAM accesses. Legacy Shift can be set to true to use the older
-        'Store shift Y to X' rather than 'Shift X' method of bitshifting. Lastly,
-        err_unoffical can be used to log an error when an offical instruction is
-        found in the program.
+        'Store shift Y to X' rather than 'Shift X' method of bitshifting.
+        Err_unoffical can be used to log an error when an offical instruction is
+        found in the program. Lastly, log_level is the least severe EmulationError
+        kept in the error log, by default nothing is logged or even formatted.
+        Quirks is a name from QUIRK_PROFILES or a Quirks and replaces
+        legacy_shift, by default the quirks are set by legacy_shift and the
+        graphics and stack constants. Seed is the 32 bit seed of the random
+        number generator used by rnd, by default a random one.
         '''
 
         # # # # # # # # # # # # # # # # # # # # # # # #
@@ -56,6 +156,9 @@ class Guacamole:
         # Current dissassembled instruction / OP Code
         self.dis_ins = None
 
+        # Dissassembled instruction at each address, see disassemble
+        self.dis_cache = [None] * BYTES_OF_RAM
+
         # Program Counter
         self.program_counter = PROGRAM_BEGIN_ADDRESS
         self.calling_pc      = PROGRAM_BEGIN_ADDRESS
@@ -67,12 +170,31 @@ class Guacamole:
         self.waiting_for_key = False
         self.spinning = False
 
+        # Super Chip-8 high resolution screen (the low resolution one is in
+        # RAM), one int per pixel row, see screen_rows
+        self.hires = False
+        self.hires_rows = [0] * HIRES_HEIGHT_PX
+
+        # Super Chip-8 'ld r, vx' storage
+        self.rpl_flags = [0] * RPL_FLAGS
+
         # Stack
         self.stack = []
         self.stack_pointer = 0
 
+        # Random numbers for rnd
+        self.rng = Rng(seed)
+
         # Instruction modification settings
-        self.legacy_shift = legacy_shift
+        if quirks is None:
+            quirks = Quirks(legacy_shift, SET_VF_ON_GFX_OVERFLOW, STACK_ADDRESS, False, False)
+        elif not isinstance(quirks, Quirks):
+            if quirks not in QUIRK_PROFILES:
+                raise ValueError("Unknown quirk profile '" + str(quirks) + "'. Options: " + \
+                    ', '.join(QUIRK_PROFILES))
+            quirks = QUIRK_PROFILES[quirks]
+        self.quirks = quirks
+        self.legacy_shift = quirks.legacy_shift
         self.warn_exotic_ins = EmulationError.from_string(err_unoffical)
 
         # Rewind Info
@@ -81,9 +203,40 @@ class Guacamole:
         # # # # # # # # # # # # # # # # # # # # # # # #
         # Private (ish)
 
-        # Warning control
+        # Warning control, see log and subscribe
+        self.fatal = False
+        self.log_level = log_level
+        self.log_subscribers = []
+        self.log_threshold = None
+        self.error_log = deque(maxlen=LOG_SIZE)
+        self.update_log_threshold()
+
+        # Called with the emulator before/after every instruction, see add_tick_hook
+        self.pre_tick_hooks = []
+        self.tick_hooks = []
+        self.debug_writes = ()
+        self.debug_sweep = DEBUG_SWEEP
         self.debug = False
-        self.error_log = []
+
+        # RAM hash kept up to date while hashing, see state_hash
+        self._hashing = False
+        self._detect_loops = False
+        self.ram_hash = 0
+        self.hash_writes = ()
+        self.seen_states = set()
+
+        # Step timers by instruction count in run as well, see count_timers
+        self._count_timers = False
+
+        # Number of cpu ticks since the emulator was started
+        self.cycle_count = 0
+
+        # Called with the emulator every time the 60hz delay timer ticks
+        self.frame_hooks = []
+
+        # Called with the emulator every time the sound timer ticks, before
+        # it is decremented, so a sound timer of 1 is still seen
+        self.sound_hooks = []
 
         # Timming variables
         self.cpu_hz     = cpuhz
@@ -96,25 +249,22 @@ class Guacamole:
         self.delay_wait = 1/delayhz
         self.delay_time = 0
 
-        # Load Font, clear screen
+        # Load Fonts, clear screen
         self.ram[GFX_FONT_ADDRESS:GFX_FONT_ADDRESS + len(GFX_FONT)] = GFX_FONT
+        self.ram[GFX_BIG_FONT_ADDRESS:GFX_BIG_FONT_ADDRESS + len(GFX_BIG_FONT)] = GFX_BIG_FONT
         self.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION] = [0x00] * GFX_RESOLUTION
 
         # Notification
-        self.log("Initializing emulator at " + str(cpuhz) + " hz" ,EmulationError._Information)
-        self.log("Max Rewind of " + str(rewind_frames) + " instructions" ,EmulationError._Information)
+        self.log("Initializing emulator at {} hz", EmulationError._Information, cpuhz)
+        self.log("Max Rewind of {} instructions", EmulationError._Information, rewind_frames)
+        self.log("Random seed {}", EmulationError._Information, self.rng.seed)
 
         # Load Rom
         if rom is not None:
             self.load_rom(rom)
 
-        # Instruction lookup table
-        self.ins_tbl={
-        'cls' :i_cls, 'ret' :i_ret,  'sys' :i_sys, 'call':i_call,
-        'skp' :i_skp, 'sknp':i_sknp, 'se'  :i_se,  'sne' :i_sne,
-        'add' :i_add, 'or'  :i_or,   'and' :i_and, 'xor' :i_xor,
-        'sub' :i_sub, 'subn':i_subn, 'shr' :i_shr, 'shl' :i_shl,
-        'rnd' :i_rnd, 'jp'  :i_jp,   'ld'  :i_ld,  'drw' :i_drw}
+        # Instruction lookup table, built once for the quirks in use
+        self.ins_tbl = ins_table(self.quirks, self.warn_exotic_ins)
 
     def load_rom(self, file_path):
         '''
@@ -122,34 +272,47 @@ class Guacamole:
         '''
         file_size = getsize(file_path)
         if file_size > MAX_ROM_SIZE:
-            self.log("Rom file exceeds maximum rom size of " + str(MAX_ROM_SIZE) + \
-                " bytes" , EmulationError._Fatal)
+            self.log("Rom file exceeds maximum rom size of {} bytes", EmulationError._Fatal, MAX_ROM_SIZE)
             return
 
         with open(file_path, "rb") as fh:
             self.ram[PROGRAM_BEGIN_ADDRESS:PROGRAM_BEGIN_ADDRESS + file_size] = \
                 [int.from_bytes(fh.read(1), 'big') for i in range(file_size)]
             self.log("Rom file loaded" , EmulationError._Information)
+        self.invalidate(PROGRAM_BEGIN_ADDRESS, file_size)
+        if self._hashing:
+            self.rehash()
 
     def reset(self, rom=None, cpuhz=None, audiohz=None, delayhz=None,
               init_ram=None, legacy_shift=None, err_unoffical="None",
-              rewind_frames=1000):
+              rewind_frames=1000, quirks=None, seed=None):
         '''
         Resets the emulator to run another game. By default all frequencies
-        and the init_ram flag are preserved.
+        and the init_ram flag are preserved, as are the quirks (unless
+        legacy_shift is given), the random seed, all hooks, log subscribers,
+        and the log level.
         '''
         if cpuhz is None: cpuhz = self.cpu_hz
         if audiohz is None: audiohz = self.audio_hz
         if delayhz is None: delayhz = self.delay_hz
         if init_ram is None: init_ram = True if self.ram[0] == 0 else False
-        if legacy_shift is None: legacy_shift = self.legacy_shift
+        if legacy_shift is None and quirks is None: quirks = self.quirks
+        if seed is None: seed = self.rng.seed
         if err_unoffical is None: err_unoffical = str(self.warn_exotic_ins)
         if rewind_frames is None:
             rewind_frames =  0 if self.rewind_frames == None else self.rewind_frames.maxlen
 
+        hooks = self.frame_hooks, self.sound_hooks, self.pre_tick_hooks, self.tick_hooks, self.log_subscribers, \
+                self.debug, self._hashing, self._detect_loops, self._count_timers
         self.__init__(rom, cpuhz, audiohz, delayhz,
                       init_ram, legacy_shift, err_unoffical,
-                      rewind_frames)
+                      rewind_frames, self.log_level, quirks, seed)
+        self.frame_hooks, self.sound_hooks, self.pre_tick_hooks, self.tick_hooks, self.log_subscribers, \
+            self._debug, self._hashing, self._detect_loops, self._count_timers = hooks
+        if self._hashing:
+            self.rehash()
+        self.update_log_threshold()
+        self.select_tick()
 
     def run(self):
         '''
@@ -163,16 +326,133 @@ class Guacamole:
 
         if self.audio_wait <= (time() - self.audio_time):
             self.audio_time = time()
+            for hook in self.sound_hooks:
+                hook(self)
             self.sound_timer_register -= 1 if self.sound_timer_register != 0 else 0
 
         if self.delay_wait <= (time() - self.delay_time):
             self.delay_time = time()
             self.delay_timer_register -= 1 if self.delay_timer_register != 0 else 0
+            for hook in self.frame_hooks:
+                hook(self)
+
+    def run_for(self, cycles):
+        '''
+        Run up to cycles instructions as fast as possible. Unlike run, the
+        sound and delay timers are stepped by instruction count (one tick
+        every cpu_hz/audio_hz instructions) rather than by wall time, so a
+        ROM always produces the same run. Stops early on a fatal error and
+        returns the number of instructions executed.
+        '''
+        for i in range(cycles):
+            if self.fatal:
+                return i
+            self.cpu_tick()
+            self.step_timers()
+        return cycles
+
+    def step_timers(self):
+        '''
+        Ticks the sound and delay timers if they are due at the current
+        instruction count, more than once if the cpu is slower than them.
+        '''
+        count = self.cycle_count
+        if (count * self.audio_hz) % self.cpu_hz < self.audio_hz:
+            for tick in range(timer_ticks(count, self.audio_hz, self.cpu_hz)):
+                for hook in self.sound_hooks:
+                    hook(self)
+                self.sound_timer_register -= 1 if self.sound_timer_register != 0 else 0
+        if (count * self.delay_hz) % self.cpu_hz < self.delay_hz:
+            for tick in range(timer_ticks(count, self.delay_hz, self.cpu_hz)):
+                self.delay_timer_register -= 1 if self.delay_timer_register != 0 else 0
+                for hook in self.frame_hooks:
+                    hook(self)
+            return True
+        return False
+
+    def events(self, cycles=None, idle_frames=False):
+        '''
+        Generator that runs the emulator like run_for and yields an EmuEvent
+        only when something a front end cares about happens:
+
+            frame       a 60hz frame where the screen was drawn, data is the
+                        list of pixel rows that changed (every frame if
+                        idle_frames is set, with an empty list if nothing did),
+                        rows of the high resolution screen while hires is set
+            sound on    the sound timer was started, sound off when it stops
+            key wait    'ld vx, k' is waiting for a key, data is its address
+            fatal       a fatal error, data is the address, the run ends
+            spin        a jump to itself, data is the address, the run ends
+
+        Keys may be pressed between events. Runs for cycles instructions, or
+        until the run ends if not given. Pace the run by sleeping on frames,
+        the cycle of an event divided by cpu_hz is its time into the run.
+        '''
+        shown = self.screen_rows()
+        sound = self.sound_timer_register != 0
+        waiting = self.waiting_for_key
+        end = None if cycles is None else self.cycle_count + cycles
+
+        while end is None or self.cycle_count < end:
+            self.cpu_tick()
+            frame = self.step_timers()
+            count = self.cycle_count
+
+            if self.fatal:
+                yield EmuEvent(EVENT_FATAL, count, self.calling_pc)
+                return
+            if (self.sound_timer_register != 0) != sound:
+                sound = not sound
+                yield EmuEvent(EVENT_SOUND_ON if sound else EVENT_SOUND_OFF, count, None)
+            if self.waiting_for_key != waiting:
+                waiting = self.waiting_for_key
+                if waiting:
+                    yield EmuEvent(EVENT_KEY_WAIT, count, self.program_counter)
+            if frame and (self.draw_flag or idle_frames):
+                rows = []
+                if self.draw_flag:
+                    self.draw_flag = False
+                    screen = self.screen_rows()
+                    rows = changed_rows(shown, screen)
+                    shown = screen
+                if rows or idle_frames:
+                    yield EmuEvent(EVENT_FRAME, count, rows)
+            if self.spinning:
+                yield EmuEvent(EVENT_SPIN, count, self.program_counter)
+                return
+
+    def counted_run(self):
+        '''
+        Run with the timers stepped by instruction count, see count_timers.
+        '''
+        if self.cpu_wait <= (time() - self.cpu_time):
+            self.cpu_time = time()
+            self.cpu_tick()
+            self.step_timers()
+
+    @property
+    def count_timers(self):
+        '''
+        While set, run steps the timers by instruction count like run_for
+        does, so a run only depends on the ROM, the seed, and the keypad at
+        each instruction. Used when recording input movies.
+        '''
+        return self._count_timers
+
+    @count_timers.setter
+    def count_timers(self, value):
+        self._count_timers = bool(value)
+        if value:
+            self.run = self.counted_run
+        else:
+            self.__dict__.pop('run', None)
 
     def cpu_tick(self):
         '''
         Ticks the CPU forward a cycle without regard for the target frequency.
         '''
+        self.cycle_count += 1
+
         # Handle the ld reg,k instruction
         if self.waiting_for_key:
             self.handle_load_key()
@@ -180,40 +460,29 @@ class Guacamole:
         else:
             self.prev_keypad = self.decode_keypad()
 
-        # Record current PC, Reset error log
+        # Record current PC
         self.calling_pc = self.program_counter
-        self.error = []
 
-        # Dissassemble next instruction
-        self.dis_ins = None
+        # Dissassemble next instruction, usually from the cache. Running off
+        # the end of RAM is the same as finding no instruction.
         try:
-            self.dis_ins = Salsa(self.ram[self.program_counter:self.program_counter+2])
-        except TypeError:
-            self.log("No instruction found at " + hex(self.program_counter), EmulationError._Fatal)
+            self.dis_ins = self.dis_cache[self.program_counter] or self.disassemble(self.program_counter)
+        except (TypeError, IndexError):
+            self.dis_ins = None
+            self.log("No instruction found at {:#x}", EmulationError._Fatal, self.program_counter)
             return
 
         # Execute instruction
         if self.dis_ins.is_valid:
-            if self.warn_exotic_ins and self.dis_ins.unoffical_op:
-                self.log("Unoffical instruction '" + self.dis_ins.mnemonic + \
-                    "' executed at " + hex(self.program_counter), self.warn_exotic_ins)
             self.ins_tbl[self.dis_ins.mnemonic](self)
 
         # Error out. NOTE: to add new instruction update OP_CODES and self.ins_tbl
-        elif self.dis_ins.is_super8:
-            self.log("Super8 instruction " + self.dis_ins.hex_instruction + " at " + \
-                hex(self.program_counter), EmulationError._Fatal)
         elif self.dis_ins.is_banned:
-            self.log("Banned instruction (makes a modification to VF)" + self.dis_ins.hex_instruction + \
-                " at " + hex(self.program_counter), EmulationError._Fatal)
+            self.log("Banned instruction (makes a modification to VF) {} at {:#x}", EmulationError._Fatal,
+                self.dis_ins.hex_instruction, self.program_counter)
         else:
-            self.log("Unknown instruction " + self.dis_ins.hex_instruction + " at " + \
-                hex(self.program_counter), EmulationError._Fatal)
-
-        # Print what was processed to screen
-        if self.debug:
-            self.enforce_rules()
-            print( hex(self.calling_pc) + " " + self.dis_ins.hex_instruction + " " + self.dis_ins.mnemonic )
+            self.log("Unknown instruction {} at {:#x}", EmulationError._Fatal,
+                self.dis_ins.hex_instruction, self.program_counter)
 
         # Increment the PC, Store Rewind Data
         self.program_counter += 2
@@ -231,7 +500,7 @@ class Guacamole:
         self.rewind_frames.append( RewindData(gfx_buffer, self.register.copy(), self.index_register,
             self.delay_timer_register, self.sound_timer_register, self.program_counter, self.calling_pc,
             self.dis_ins + (), self.stack.copy(), self.stack_pointer, self.draw_flag, self.waiting_for_key,
-            self.spinning ) )
+            self.spinning, self.hires_rows.copy() if self.hires else None ) )
 
     def rewind(self, depth):
         '''
@@ -246,6 +515,7 @@ class Guacamole:
                 return
         self.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION] = \
             frame.gfx_buffer
+        self.invalidate(GFX_ADDRESS, GFX_RESOLUTION)
         self.register, self.index_register = \
             frame.register, frame.index_register
         self.delay_timer_register, self.sound_timer_register = \
@@ -256,45 +526,285 @@ class Guacamole:
             self.dis_ins, frame.stack, frame.stack_pointer
         self.draw_flag, self.waiting_for_key, self.spinning = \
             frame.draw_flag, frame.waiting_for_key, frame.spinning
+        self.hires = frame.hires_rows is not None
+        if self.hires:
+            self.hires_rows = frame.hires_rows.copy()
+        if self._hashing:
+            self.rehash()
+
+    def disassemble(self, address):
+        '''
+        Returns the instruction at address, dissassembled once and then kept
+        until the RAM under it is written. Raises TypeError if that RAM was
+        never written, IndexError if address is past the last instruction.
+        '''
+        self.dis_cache[address] = Salsa(self.ram[address:address+2])
+        return self.dis_cache[address]
+
+    def invalidate(self, start, length):
+        '''
+        Drops the cached instructions overlapping length bytes of RAM from
+        start. Instructions call this for the RAM they write, call it after
+        changing RAM from outside the emulator.
+        '''
+        start, end = max(start - 1, 0), min(start + length, BYTES_OF_RAM)
+        if end > start:
+            self.dis_cache[start:end] = [None] * (end - start)
+
+    def screen_rows(self):
+        '''
+        The screen as a list of ints, one per pixel row with the leftmost
+        pixel in the top bit. 128x64 while hires is set, else 64x32.
+        '''
+        if self.hires:
+            return self.hires_rows.copy()
+        ram = self.ram
+        return [int.from_bytes(bytes(ram[start:start + GFX_WIDTH]), 'big')
+                for start in range(GFX_ADDRESS, GFX_ADDRESS + GFX_RESOLUTION, GFX_WIDTH)]
 
     def graphics(self):
         '''
         Generator that returns true/false if the nth pixel is set.
         '''
-        for i in self.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION]:
-            for j in bin(i)[2:].zfill(8):
-                yield j=='1'
+        width = HIRES_WIDTH_PX if self.hires else GFX_WIDTH_PX
+        for row in self.screen_rows():
+            for bit in range(width - 1, -1, -1):
+                yield (row >> bit) & 1 == 1
+
+    def log(self, message, error_type, *args):
+        '''
+        Logs an EmulationError that can be latter addressed by the instantiator.
+        Message is a format string that is only filled in with args if the
+        error is at or above the log level or a subscriber wants it, so
+        logging costs next to nothing when no one is listening. Kept events
+        go to error_log, a ring buffer of the most recent LOG_SIZE events.
+        '''
+        if error_type is EmulationError._Fatal:
+            self.fatal = True
+        if self.log_threshold is None or error_type.value < self.log_threshold:
+            return
+
+        event = LogEvent(error_type, message.format(*args) if args else message,
+                         self.cycle_count, self.program_counter)
+        if self.log_level is not None and error_type.value >= self.log_level.value:
+            self.error_log.append(event)
+        for level, callback in self.log_subscribers:
+            if error_type.value >= level.value:
+                callback(event)
+
+    def subscribe(self, callback, level=EmulationError._Information):
+        '''
+        Calls callback with a LogEvent for every error at or above level.
+        '''
+        self.log_subscribers.append( (level, callback) )
+        self.update_log_threshold()
+
+    def unsubscribe(self, callback):
+        self.log_subscribers = [s for s in self.log_subscribers if s[1] != callback]
+        self.update_log_threshold()
+
+    def update_log_threshold(self):
+        levels = [level.value for level, _ in self.log_subscribers]
+        if self.log_level is not None:
+            levels.append(self.log_level.value)
+        self.log_threshold = min(levels) if levels else None
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Tick Hooks
+
+    def add_tick_hook(self, hook, before=False):
+        '''
+        Calls hook with the emulator after every instruction, or before it
+        is fetched if 'before' is set. While no hooks are added cpu_tick runs
+        without checking for any.
+        '''
+        (self.pre_tick_hooks if before else self.tick_hooks).append(hook)
+        self.select_tick()
+
+    def remove_tick_hook(self, hook):
+        if hook in self.pre_tick_hooks:
+            self.pre_tick_hooks.remove(hook)
+        else:
+            self.tick_hooks.remove(hook)
+        self.select_tick()
+
+    def select_tick(self):
+        '''
+        Swaps cpu_tick for hooked_tick when there are hooks to call.
+        '''
+        if self.pre_tick_hooks or self.tick_hooks:
+            self.cpu_tick = self.hooked_tick
+        else:
+            self.__dict__.pop('cpu_tick', None)
+
+    def hooked_tick(self):
+        for hook in self.pre_tick_hooks:
+            hook(self)
+        Guacamole.cpu_tick(self)
+        for hook in self.tick_hooks:
+            hook(self)
+
+    @property
+    def debug(self):
+        '''
+        Debug mode prints every instruction and logged error to screen and
+        checks the emulator's state after every instruction. Only the RAM
+        the instruction wrote is checked, all of it is checked every
+        debug_sweep instructions (never if zero).
+        '''
+        return self._debug
+
+    @debug.setter
+    def debug(self, value):
+        self._debug = bool(value)
+        if value and self.debug_hook not in self.tick_hooks:
+            self.add_tick_hook(self.debug_before, before=True)
+            self.add_tick_hook(self.debug_hook)
+            self.subscribe(print_event)
+        elif not value and self.debug_hook in self.tick_hooks:
+            self.remove_tick_hook(self.debug_before)
+            self.remove_tick_hook(self.debug_hook)
+            self.unsubscribe(print_event)
+
+    def debug_before(self, emu):
+        pc, ram = self.program_counter, self.ram
+        if pc + 1 >= BYTES_OF_RAM or ram[pc] is None or ram[pc + 1] is None:
+            self.debug_writes = ()
+        else:
+            self.debug_writes = ram_access(self, (ram[pc] << 8) | ram[pc + 1])[1]
+
+    def debug_hook(self, emu):
+        if self.debug_sweep and self.cycle_count % self.debug_sweep == 0:
+            self.enforce_rules()
+        else:
+            self.enforce_written()
+        if self.dis_ins is not None:
+            print( hex(self.calling_pc) + " " + self.dis_ins.hex_instruction + " " + str(self.dis_ins.mnemonic) )
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # State Hashing
+
+    def state_hash(self):
+        '''
+        Hash of the whole machine state: RAM, registers, I, PC, stack,
+        timers (and while one runs, how far it is from its next tick), a
+        pending key wait, and the random bytes drawn so far. Two equal hashes
+        mean the emulator will do the same thing from there on. While hashing
+        is on RAM is not rehashed, so this is cheap enough to call after every
+        instruction.
+        '''
+        ram_hash = self.ram_hash if self._hashing else self.ram_hash_of(0, BYTES_OF_RAM) & HASH_MASK
+        phase = (self.delay_timer_register or self.sound_timer_register) and \
+            ((self.cycle_count * self.delay_hz) % self.cpu_hz, (self.cycle_count * self.audio_hz) % self.cpu_hz)
+        return hash( (ram_hash, tuple(self.register), self.index_register, self.program_counter,
+            self.stack_pointer, tuple(self.stack), self.delay_timer_register,
+            self.sound_timer_register, phase, self.waiting_for_key, self.rng.drawn,
+            self.hires and tuple(self.hires_rows), tuple(self.rpl_flags)) )
+
+    @property
+    def hashing(self):
+        '''
+        While hashing, ram_hash is updated with the RAM each instruction is
+        about to write (see instructions.ram_access) instead of rehashing all
+        of RAM. Call rehash after changing RAM from outside the emulator.
+        '''
+        return self._hashing
+
+    @hashing.setter
+    def hashing(self, value):
+        if bool(value) == self._hashing:
+            return
+        self._hashing = bool(value)
+        if value:
+            self.rehash()
+            self.add_tick_hook(self.hash_before, before=True)
+            self.add_tick_hook(self.hash_after)
+        else:
+            self.remove_tick_hook(self.hash_before)
+            self.remove_tick_hook(self.hash_after)
 
-    def log(self, message, error_type):
+    @property
+    def detect_loops(self):
         '''
-        Logs an EmulationError that can be latter addressed by the instantiator
-        or prints it to screen if called from command line.
+        Logs a fatal error when the machine state repeats, which can only
+        happen in an infinite loop. Every state is kept, so memory grows
+        with the number of instructions run.
         '''
-        if self.debug:
-            print(str(error_type) + ": " + message)
-            if error_type is EmulationError._Fatal:
-                print("Fatal error has occured, please reset.")
+        return self._detect_loops
+
+    @detect_loops.setter
+    def detect_loops(self, value):
+        if bool(value) == self._detect_loops:
+            return
+        self._detect_loops = bool(value)
+        self.seen_states = set()
+        if value:
+            self.hashing = True
+            self.add_tick_hook(self.loop_hook)
         else:
-            self.error_log.append( (error_type, message) )
+            self.remove_tick_hook(self.loop_hook)
+
+    def ram_hash_of(self, start, length):
+        ram, total = self.ram, 0
+        for addr in range(start, min(start + length, BYTES_OF_RAM)):
+            value = ram[addr]
+            total += HASH_ADDRESS_KEYS[addr] * HASH_VALUE_KEYS[256 if value is None else value]
+        return total
+
+    def rehash(self):
+        self.ram_hash = self.ram_hash_of(0, BYTES_OF_RAM) & HASH_MASK
+
+    def hash_before(self, emu):
+        pc, ram = self.program_counter, self.ram
+        if pc + 1 >= BYTES_OF_RAM or ram[pc] is None or ram[pc + 1] is None:
+            self.hash_writes = ()
+            return
+        self.hash_writes = ram_access(self, (ram[pc] << 8) | ram[pc + 1])[1]
+        for start, length in self.hash_writes:
+            self.ram_hash -= self.ram_hash_of(start, length)
+
+    def hash_after(self, emu):
+        for start, length in self.hash_writes:
+            self.ram_hash += self.ram_hash_of(start, length)
+        self.ram_hash &= HASH_MASK
+
+    def loop_hook(self, emu):
+        state = self.state_hash()
+        if state in self.seen_states:
+            self.log("Infinite loop, the state at {:#x} has been seen before", EmulationError._Fatal,
+                self.program_counter)
+        self.seen_states.add(state)
 
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
     # Helpers for Load Key ( Private )
 
     def decode_keypad(self):
         '''
-        Helper method to decode the current keypad into a binary string
+        Helper method to decode the current keypad into a 16 bit int mask,
+        key 0 is the top bit
+        '''
+        mask = 0
+        for pressed in self.keypad:
+            mask = (mask << 1) | pressed
+        return mask
+
+    def encode_keypad(self, mask):
+        '''
+        Sets the keypad from a mask as returned by decode_keypad.
         '''
-        return int(''.join(['1' if x else '0' for x in self.keypad]),2)
+        self.keypad = [bool(mask & (0x8000 >> i)) for i in range(16)]
 
     def handle_load_key(self):
         '''
         Helper method to check if keys have changed and, if so, load the
-        key per the ld reg,k instruction.
+        key per the ld reg,k instruction. Released keys are forgotten, so
+        they count as new when pressed again.
         '''
         k = self.decode_keypad()
-        nk = bin( (k ^ self.prev_keypad) & k )[2:].zfill(16).find('1')
-        if nk != -1:
-            self.register[ self.get_reg1() ] = nk
+        pressed = (k ^ self.prev_keypad) & k
+        self.prev_keypad = k
+        if pressed:
+            self.register[ get_reg1(self) ] = 16 - pressed.bit_length()
             self.program_counter += 2
             self.waiting_for_key = False
 
@@ -309,10 +819,10 @@ class Guacamole:
                 print('0x' + hex(i)[2:].zfill(3) + '  ' + '0x' + hex(val)[2:].zfill(2))
 
     def dump_gfx(self):
-        for i,b in enumerate(self.ram[ GFX_ADDRESS : GFX_ADDRESS + GFX_RESOLUTION ]):
-            if i%8 == 0:
-                print()
-            print( bin(b)[2:].zfill(8).replace('1','X').replace('0','.'), end='')
+        width = HIRES_WIDTH_PX if self.hires else GFX_WIDTH_PX
+        for row in self.screen_rows():
+            print()
+            print( bin(row)[2:].zfill(width).replace('1','X').replace('0','.'), end='')
         print()
 
     def dump_reg(self):
@@ -337,15 +847,55 @@ class Guacamole:
         assert(self.delay_timer_register >= 0x00)
         assert(self.sound_timer_register <= 0xFF)
         assert(self.sound_timer_register >= 0x00)
+        self.enforce_registers()
+        self.enforce_ram(0, BYTES_OF_RAM)
+
+    def enforce_written(self):
+        '''
+        Same checks as enforce_rules, but only for the RAM the last
+        instruction wrote.
+        '''
+        assert(self.index_register is not None)
+        assert(0x000 <= self.index_register <= 0xFFF)
+        assert(0x00 <= self.delay_timer_register <= 0xFF)
+        assert(0x00 <= self.sound_timer_register <= 0xFF)
+        self.enforce_registers()
+        for start, length in self.debug_writes:
+            self.enforce_ram(start, length)
+
+    def enforce_registers(self):
         for i,val in enumerate(self.register):
             assert val is not None, "Register " + hex(i) + " has value 'None'" + self.dump_pc()
             assert val >= 0x00, "Register " + hex(i) + "is less than 0x00" + self.dump_pc()
             assert val <= 0xFF, "Register " + hex(i) + "is greater than 0xFF" + self.dump_pc()
-        for i,val in enumerate(self.ram):
+
+    def enforce_ram(self, start, length):
+        for i in range(start, min(start + length, BYTES_OF_RAM)):
+            val = self.ram[i]
             if val is None: continue
             assert val >= 0x00, "Ram Address " + hex(i) + "is less than 0x00" + self.dump_pc()
             assert val <= 0xFF, "Ram Address " + hex(i) + "is greater than 0xFF" + self.dump_pc()
+        assert len(self.ram) == BYTES_OF_RAM, "RAM has grown to " + str(len(self.ram)) + " bytes" + self.dump_pc()
 
     def dump_pc(self):
         return "\nPC: " + hex(self.program_counter) + " INS: " + self.dis_ins.hex_instruction
 
+def timer_ticks(count, timer_hz, cpu_hz):
+    # Ticks of a timer_hz timer due at instruction count, see step_timers
+    return int((count * timer_hz) // cpu_hz - ((count - 1) * timer_hz) // cpu_hz)
+
+@export
+def changed_rows(shown, rows):
+    '''
+    Indices of the rows that differ between two screen_rows, every row if
+    the resolution changed between them.
+    '''
+    if len(shown) != len(rows):
+        return list(range(len(rows)))
+    return [y for y, (old, new) in enumerate(zip(shown, rows)) if old != new]
+
+def print_event(event):
+    print(str(event.error_type) + ": " + event.message)
+    if event.error_type is EmulationError._Fatal:
+        print("Fatal error has occured, please reset.")
+
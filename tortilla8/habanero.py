@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+from . import export
+from array import array
+from math import log
+from struct import pack
+from zlib import compress
+from .instructions import ram_access
+from .churro import PNG_SIGNATURE, png_chunk
+from .constants.reg_rom_stack import BYTES_OF_RAM
+__all__ = []
+
+HEATMAP_WIDTH = 64 # 4096 addresses as a 64x64 image, one row per 64 bytes
+
+@export
+class Habanero:
+    '''
+    Habanero counts every read and write of each RAM address made by a
+    Guacamole instance: instruction fetches, sprite reads by drw, loads and
+    stores through I ('ld [i]' and BCD), and writes to the screen. Counts
+    are kept in preallocated arrays, and the hook is only attached while
+    counting so the emulator runs at full speed otherwise.
+    '''
+
+    def __init__(self):
+        self.fetches = array('L', [0] * BYTES_OF_RAM)
+        self.reads   = array('L', [0] * BYTES_OF_RAM)
+        self.writes  = array('L', [0] * BYTES_OF_RAM)
+
+    def attach(self, emu):
+        emu.add_tick_hook(self.count, before=True)
+
+    def detach(self, emu):
+        emu.remove_tick_hook(self.count)
+
+    def count(self, emu):
+        '''
+        Tick hook, run before the instruction at the program counter.
+        '''
+        if emu.waiting_for_key:
+            return
+        pc = emu.program_counter
+        ram = emu.ram
+        if pc + 1 >= BYTES_OF_RAM or ram[pc] is None or ram[pc + 1] is None:
+            return
+        self.fetches[pc] += 1
+        self.fetches[pc + 1] += 1
+
+        reads, writes = ram_access(emu, (ram[pc] << 8) | ram[pc + 1])
+        for start, length in reads:
+            for addr in range(start, min(start + length, BYTES_OF_RAM)):
+                self.reads[addr] += 1
+        for start, length in writes:
+            for addr in range(start, min(start + length, BYTES_OF_RAM)):
+                self.writes[addr] += 1
+
+    def export_csv(self, file_handler):
+        '''
+        One line per accessed address: address, fetches, reads, writes.
+        '''
+        file_handler.write('address,fetches,reads,writes\n')
+        for addr in range(BYTES_OF_RAM):
+            if self.fetches[addr] or self.reads[addr] or self.writes[addr]:
+                file_handler.write(format(addr, '#05x') + ',' + str(self.fetches[addr]) + ',' +
+                    str(self.reads[addr]) + ',' + str(self.writes[addr]) + '\n')
+
+    def export_png(self, file_handler, scale=8):
+        '''
+        Writes a 64x64 heatmap, one pixel per address from the top left.
+        Writes are red, data reads green, and fetches blue, each on a log
+        scale so rarely touched addresses still show up.
+        '''
+        def levels(counts):
+            top = log(1 + max(counts)) or 1
+            return [int(255 * log(1 + c) / top) for c in counts]
+
+        red, green, blue = levels(self.writes), levels(self.reads), levels(self.fetches)
+        lines = []
+        for y in range(BYTES_OF_RAM // HEATMAP_WIDTH):
+            line = bytearray()
+            for x in range(HEATMAP_WIDTH):
+                addr = y * HEATMAP_WIDTH + x
+                line += bytes((red[addr], green[addr], blue[addr])) * scale
+            lines.append((b'\x00' + bytes(line)) * scale)
+
+        width = HEATMAP_WIDTH * scale
+        height = BYTES_OF_RAM // HEATMAP_WIDTH * scale
+        file_handler.write(PNG_SIGNATURE)
+        file_handler.write(png_chunk(b'IHDR', pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        file_handler.write(png_chunk(b'IDAT', compress(b''.join(lines), 9)))
+        file_handler.write(png_chunk(b'IEND', b''))
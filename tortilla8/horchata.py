@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+from . import export
+from array import array
+import wave
+
+# Import Sound (optional)
+try: import simpleaudio as sa
+except ImportError:
+    sa = None
+
+__all__ = []
+
+MAX_TIMER_VALUE = 0xFF
+
+@export
+class Horchata:
+    '''
+    Horchata is the sound system for Guacamole. A square wave (or the
+    samples of a WAV file) is rendered once into a preallocated ring buffer
+    and the sound timer gates it. When the timer is raised the backend is
+    handed exactly the samples for the time the timer will stay raised, so
+    the tone stops on the right sample without anything having to run
+    while it plays. Backends are only called when the timer is raised,
+    reloaded past the end of the tone, or cleared early, never once per
+    loop iteration.
+    '''
+
+    def __init__(self, backend=None, tone_hz=440, sample_rate=44100,
+                 timer_hz=60, volume=0.25, wave_file=None):
+        '''
+        Backend is one of the *Sink classes below, by default a NullSink.
+        A 16 bit WAV file can be given to be used instead of the square wave,
+        in which case tone_hz and sample_rate are ignored. Only the first
+        channel of the file is used.
+        '''
+        if wave_file is not None:
+            with wave.open(wave_file, 'rb') as fh:
+                if fh.getsampwidth() != 2:
+                    raise ValueError("Only 16 bit WAV files are supported.")
+                sample_rate = fh.getframerate()
+                period = array('h', fh.readframes(fh.getnframes()))[::fh.getnchannels()]
+        else:
+            amplitude = int(0x7FFF * volume)
+            period = array('h', (amplitude if (i * tone_hz * 2 // sample_rate) % 2 == 0
+                                 else -amplitude for i in range(sample_rate)))
+
+        self.sample_rate = sample_rate
+        self.tick_samples = sample_rate // timer_hz
+        self.backend = NullSink() if backend is None else backend
+        self.backend.open(sample_rate)
+
+        # One repeating period plus enough to play the longest tone, so
+        # any tone is a contiguous slice starting at the current phase
+        longest = MAX_TIMER_VALUE * self.tick_samples
+        self.period = len(period)
+        self.ring = array('h', period * (1 + -(-longest // self.period)))
+        self.phase = 0
+
+        # Gate state, end is the tick the samples handed to the backend
+        # run out on
+        self.ticks = 0
+        self.end = 0
+
+    def attach(self, emu):
+        '''
+        Update the gate on every tick of the emulator's sound timer.
+        '''
+        emu.sound_hooks.append(self.update)
+
+    def detach(self, emu):
+        emu.sound_hooks.remove(self.update)
+
+    def update(self, emu):
+        '''
+        Should be called once per sound timer tick, before the timer is
+        decremented, so a timer of n sounds for n ticks. Starts, extends,
+        or ends the tone as needed.
+        '''
+        self.ticks += 1
+        timer = emu.sound_timer_register
+
+        # Still inside the tone that was handed to the backend, front ends
+        # that step the timers themselves may be a tick out of step
+        if timer and self.ticks + timer <= self.end + 1:
+            pass
+
+        # Raised, exactly as long as the timer will be up
+        elif timer and self.end <= self.ticks:
+            self.play(timer)
+
+        # Reloaded past the end of the tone, hand over the longest tone so
+        # a timer reloaded every frame doesn't restart it every frame
+        elif timer:
+            self.play(MAX_TIMER_VALUE)
+
+        # Cleared before the tone ran out
+        elif self.end > self.ticks + 1:
+            self.backend.stop(self.ticks * self.tick_samples)
+            self.phase = (self.phase - (self.end - self.ticks) * self.tick_samples) % self.period
+            self.end = self.ticks
+
+    def play(self, ticks):
+        count = ticks * self.tick_samples
+        self.backend.play(memoryview(self.ring)[self.phase:self.phase + count],
+                          self.ticks * self.tick_samples)
+        self.phase = (self.phase + count) % self.period
+        self.end = self.ticks + ticks
+
+    def close(self):
+        self.backend.stop(self.ticks * self.tick_samples)
+        self.backend.close(self.ticks * self.tick_samples)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Backends, 'at' is the position of the call in samples from the start
+
+@export
+class NullSink:
+    '''
+    Discards all audio. Counts tones so headless runs can still check them.
+    '''
+    def open(self, sample_rate):
+        self.tones = 0
+
+    def play(self, samples, at):
+        self.tones += 1
+
+    def stop(self, at):
+        pass
+
+    def close(self, at):
+        pass
+
+@export
+class WaveSink:
+    '''
+    Writes all audio, silence included, to a mono 16 bit WAV file.
+    '''
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def open(self, sample_rate):
+        self.fh = wave.open(self.file_path, 'wb')
+        self.fh.setnchannels(1)
+        self.fh.setsampwidth(2)
+        self.fh.setframerate(sample_rate)
+        self.written = 0
+        self.pending = None
+        self.pending_at = 0
+
+    def play(self, samples, at):
+        self.stop(at)
+        self.pending, self.pending_at = samples, at
+
+    def stop(self, at):
+        if self.pending is not None:
+            self.silence(self.pending_at)
+            tone = self.pending[:max(0, at - self.pending_at)]
+            self.fh.writeframesraw(tone)
+            self.written += len(tone)
+            self.pending = None
+
+    def silence(self, at):
+        if at > self.written:
+            self.fh.writeframesraw(bytes(2 * (at - self.written)))
+            self.written = at
+
+    def close(self, at):
+        self.silence(at)
+        self.fh.close()
+
+@export
+class SimpleAudioSink:
+    '''
+    Plays audio through SimpleAudio, one play call per tone.
+    '''
+    def open(self, sample_rate):
+        if sa is None:
+            raise ImportError("SimpleAudio is missing from your system. " + \
+                "You can install it via 'pip install simpleaudio'.")
+        self.sample_rate = sample_rate
+        self.play_obj = None
+
+    def play(self, samples, at):
+        self.stop(at)
+        self.play_obj = sa.play_buffer(samples, 1, 2, self.sample_rate)
+
+    def stop(self, at):
+        if self.play_obj is not None:
+            self.play_obj.stop()
+            self.play_obj = None
+
+    def close(self, at):
+        self.stop(at)
@@ -1,17 +1,21 @@
 #!/usr/bin/env python3
 
-from random import randint
 from . import EmulationError
-from .constants.reg_rom_stack import STACK_ADDRESS, STACK_SIZE
+from .constants.reg_rom_stack import STACK_SIZE, RPL_FLAGS
+from .constants.opcodes import UNOFFICIAL_OP_CODES
 from .constants.graphics import GFX_FONT_ADDRESS, GFX_RESOLUTION, GFX_ADDRESS, \
-                                GFX_WIDTH, GFX_HEIGHT_PX, GFX_WIDTH_PX, \
-                                SET_VF_ON_GFX_OVERFLOW
+                                GFX_WIDTH, GFX_HEIGHT_PX, GFX_WIDTH_PX, GFX_BIG_FONT_ADDRESS, \
+                                HIRES_HEIGHT_PX, HIRES_WIDTH_PX, BIG_SPRITE_PX
 
-# Instructions - All 20 mnemonics, 35 total instructions
-# Add-3 SE-2 SNE-2 LD-11 JP-2 (mnemonics w/ extra instructions)
+# Instructions - All 26 mnemonics, 44 total instructions
+# Add-3 SE-2 SNE-2 LD-14 JP-2 (mnemonics w/ extra instructions)
 
 def i_cls(emu):
-    emu.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION] = [0x00] * GFX_RESOLUTION
+    if emu.hires:
+        emu.hires_rows[:] = [0] * HIRES_HEIGHT_PX
+    else:
+        emu.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION] = [0x00] * GFX_RESOLUTION
+        emu.invalidate(GFX_ADDRESS, GFX_RESOLUTION)
     emu.draw_flag = True
 
 def i_ret(emu):
@@ -21,15 +25,13 @@ def i_ret(emu):
     emu.program_counter = emu.stack.pop()
 
 def i_sys(emu):
-    emu.log("RCA 1802 call to " + hex( get_address(emu) ) + " was ignored.", EmulationError._Warning)
+    emu.log("RCA 1802 call to {:#x} was ignored.", EmulationError._Warning, get_address(emu))
 
 def i_call(emu):
-    if STACK_ADDRESS:
-        emu.ram[stack_pointer] = emu.program_counter
     emu.stack_pointer += 1
     emu.stack.append(emu.program_counter)
     if emu.stack_pointer > STACK_SIZE:
-        emu.log("Stack overflow. Stack is now size " + emu.stack_pointer, EmulationError._Warning)
+        emu.log("Stack overflow. Stack is now size {}", EmulationError._Warning, emu.stack_pointer)
     emu.program_counter = get_address(emu) - 2
 
 def i_skp(emu):
@@ -51,20 +53,12 @@ def i_sne(emu):
         emu.program_counter += 2
 
 def i_shl(emu):
-    if emu.legacy_shift:
-        emu.register[0xF] = 0x01 if get_reg2_val(emu) >= 0x80 else 0x0
-        emu.register[ get_reg1(emu) ] = ( get_reg2_val(emu) << 1 ) & 0xFF
-    else:
-        emu.register[0xF] = 0x01 if get_reg1_val(emu) >= 0x80 else 0x0
-        emu.register[ get_reg1(emu) ] = ( get_reg1_val(emu) << 1 ) & 0xFF
+    emu.register[0xF] = 0x01 if get_reg1_val(emu) >= 0x80 else 0x0
+    emu.register[ get_reg1(emu) ] = ( get_reg1_val(emu) << 1 ) & 0xFF
 
 def i_shr(emu):
-    if emu.legacy_shift:
-        emu.register[0xF] = 0x01 if ( get_reg2_val(emu) % 2) == 1 else 0x0
-        emu.register[ get_reg1(emu) ] = get_reg2_val(emu) >> 1
-    else:
-        emu.register[0xF] = 0x01 if ( get_reg1_val(emu) % 2) == 1 else 0x0
-        emu.register[ get_reg1(emu) ] = get_reg1_val(emu) >> 1
+    emu.register[0xF] = 0x01 if ( get_reg1_val(emu) % 2) == 1 else 0x0
+    emu.register[ get_reg1(emu) ] = get_reg1_val(emu) >> 1
 
 def i_or(emu):
     emu.register[ get_reg1(emu) ] = get_reg1_val(emu) | get_reg2_val(emu)
@@ -94,13 +88,13 @@ def i_jp(emu):
     elif numb_args == 1:
         emu.program_counter = get_address(emu) - 2
     else:
-        emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
+        emu.log("Unknown argument at address {:#x}", EmulationError._Fatal, emu.program_counter)
 
     if init_pc == emu.program_counter + 2:
         emu.spinning = True
 
 def i_rnd(emu):
-    emu.register[ get_reg1(emu) ] = randint(0, 255) & get_lower_byte(emu)
+    emu.register[ get_reg1(emu) ] = emu.rng.byte() & get_lower_byte(emu)
 
 def i_add(emu):
     arg1 = emu.dis_ins.mnemonic_arg_types[0]
@@ -116,16 +110,14 @@ def i_add(emu):
             emu.register[0xF] = 0x01 if emu.register[ get_reg1(emu) ] > 0xFF else 0x00
             emu.register[ get_reg1(emu) ] &= 0xFF
         else:
-            emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
+            emu.log("Unknown argument at address {:#x}", EmulationError._Fatal, emu.program_counter)
 
     elif 'i' in arg1 and 'reg' is arg2:
         emu.index_register += get_reg1_val(emu)
-        if (emu.index_register > 0xFF) and SET_VF_ON_GFX_OVERFLOW:
-            emu.register[0xF] = 0x01
         emu.index_register &= 0xFFF
 
     else:
-        emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
+        emu.log("Unknown argument at address {:#x}", EmulationError._Fatal, emu.program_counter)
 
 def i_ld(emu):
     arg1 = emu.dis_ins.mnemonic_arg_types[0]
@@ -143,9 +135,12 @@ def i_ld(emu):
             emu.program_counter -= 2
         elif '[i]' == arg2:
             emu.register[0: get_reg1(emu) + 1] = emu.ram[ emu.index_register : emu.index_register + get_reg1(emu) + 1]
+        elif 'r' == arg2:
+            count = rpl_count(emu)
+            emu.register[0: count] = emu.rpl_flags[0: count]
         else:
-            emu.log("Loads with second argument type '" + arg2 + \
-                "' are not supported.", EmulationError._Fatal)
+            emu.log("Loads with second argument type '{}' are not supported.",
+                EmulationError._Fatal, arg2)
 
     elif 'reg' is arg2:
         if   'dt' is arg1:
@@ -157,41 +152,244 @@ def i_ld(emu):
         elif 'b'  is arg1:
             bcd = [int(f) for f in list(str( get_reg1_val(emu) ).zfill(3))]
             emu.ram[ emu.index_register : emu.index_register + len(bcd)] = bcd
+            emu.invalidate(emu.index_register, len(bcd))
         elif '[i]' == arg1:
             emu.ram[ emu.index_register : emu.index_register + get_reg1(emu) + 1] = emu.register[0: get_reg1(emu) + 1]
+            emu.invalidate(emu.index_register, get_reg1(emu) + 1)
+        elif 'hf' == arg1:
+            emu.index_register = GFX_BIG_FONT_ADDRESS + ( 10 * get_reg1_val(emu) )
+        elif 'r' == arg1:
+            count = rpl_count(emu)
+            emu.rpl_flags[0: count] = emu.register[0: count]
         else:
-            emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
+            emu.log("Unknown argument at address {:#x}", EmulationError._Fatal, emu.program_counter)
 
     elif 'i' is arg1 and 'addr' is arg2:
         emu.index_register =  get_address(emu)
 
     else:
-        emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
+        emu.log("Unknown argument at address {:#x}", EmulationError._Fatal, emu.program_counter)
 
 def i_drw(emu):
     emu.draw_flag = True
     height = int(emu.dis_ins.hex_instruction[3],16)
-    x_origin_byte = int( get_reg1_val(emu) / 8 ) % GFX_WIDTH
-    y_origin_byte = (get_reg2_val(emu) % GFX_HEIGHT_PX) * GFX_WIDTH
-    shift_amount = get_reg1_val(emu) % GFX_WIDTH_PX % 8
-    next_byte_offset = 1 if x_origin_byte + 1 != GFX_WIDTH else 1-GFX_WIDTH
+    sprite_px = 8
+    if height == 0:
+        height = sprite_px = BIG_SPRITE_PX
+    ram, address = emu.ram, emu.index_register
+    collided = 0
+
+    # High resolution, each line of the sprite is rotated into place and
+    # xor'd with its screen row as a single int, wrapping at the right edge
+    if emu.hires:
+        rows = emu.hires_rows
+        x_origin = get_reg1_val(emu) % HIRES_WIDTH_PX
+        y_origin = get_reg2_val(emu) % HIRES_HEIGHT_PX
+        row_mask = (1 << HIRES_WIDTH_PX) - 1
+        for y in range(height):
+            if sprite_px == 8:
+                sprite = ram[address + y]
+            else:
+                sprite = (ram[address + 2 * y] << 8) | ram[address + 2 * y + 1]
+            sprite <<= HIRES_WIDTH_PX - sprite_px
+            sprite = ( (sprite >> x_origin) | (sprite << (HIRES_WIDTH_PX - x_origin)) ) & row_mask
+            screen_y = (y_origin + y) % HIRES_HEIGHT_PX
+            original = rows[screen_y]
+            rows[screen_y] = original ^ sprite
+            collided |= original & sprite
+
+    # Low resolution, the screen is in RAM. Each line is shifted into the
+    # bytes it covers (the last wraps to the start of the row) as one int
+    else:
+        x_origin_byte = int( get_reg1_val(emu) / 8 ) % GFX_WIDTH
+        y_origin = get_reg2_val(emu) % GFX_HEIGHT_PX
+        shift_amount = get_reg1_val(emu) % 8
+        offsets = [ (x_origin_byte + i) % GFX_WIDTH for i in range(sprite_px // 8 + 1) ]
+        for y in range(height):
+            if sprite_px == 8:
+                sprite = ram[address + y] << (8 - shift_amount)
+            else:
+                sprite = ( (ram[address + 2 * y] << 8) | ram[address + 2 * y + 1] ) << (8 - shift_amount)
+            start = GFX_ADDRESS + ( (y_origin + y) % GFX_HEIGHT_PX ) * GFX_WIDTH
+            original = 0
+            for offset in offsets:
+                original = (original << 8) | ram[start + offset]
+            xor = original ^ sprite
+            for offset in reversed(offsets):
+                ram[start + offset] = xor & 0xFF
+                xor >>= 8
+            collided |= original & sprite
+        emu.invalidate(GFX_ADDRESS, GFX_RESOLUTION)
+
+    emu.register[0xF] = 0x01 if collided else 0x00
 
-    emu.register[0xF] = 0x00
-    for y in range(height):
-        sprite =  emu.ram[ emu.index_register + y ] << (8-shift_amount)
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Super Chip-8. Scrolls move whole rows, or shift every row int, in the
+# resolution in use
+
+def i_scd(emu):
+    rows = emu.screen_rows()
+    lines = int(emu.dis_ins.hex_instruction[3],16)
+    set_screen_rows(emu, [0] * lines + rows[:len(rows) - lines])
+
+def i_scr(emu):
+    set_screen_rows(emu, [row >> 4 for row in emu.screen_rows()])
+
+def i_scl(emu):
+    row_mask = (1 << (HIRES_WIDTH_PX if emu.hires else GFX_WIDTH_PX)) - 1
+    set_screen_rows(emu, [(row << 4) & row_mask for row in emu.screen_rows()])
+
+def i_exit(emu):
+    emu.log("Program exited at {:#x}", EmulationError._Information, emu.program_counter)
+    emu.program_counter -= 2
+    emu.spinning = True
+
+def i_low(emu):
+    emu.hires = False
+    i_cls(emu)
 
-        working_bytes = (
-            GFX_ADDRESS + (( x_origin_byte + y_origin_byte + (y * GFX_WIDTH) ) % GFX_RESOLUTION) ,
-            GFX_ADDRESS + (( x_origin_byte + y_origin_byte + (y * GFX_WIDTH) + next_byte_offset ) % GFX_RESOLUTION)
-        )
+def i_high(emu):
+    emu.hires = True
+    i_cls(emu)
 
-        original = ( emu.ram[ working_bytes[0] ], emu.ram[ working_bytes[1] ] )
-        xor = (original[0]*256 + original[1]) ^ sprite
-        emu.ram[ working_bytes[0] ], emu.ram[ working_bytes[1] ] = xor >> 8, xor & 0x00FF
+def set_screen_rows(emu, rows):
+    if emu.hires:
+        emu.hires_rows[:] = rows
+    else:
+        emu.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION] = \
+            b''.join(row.to_bytes(GFX_WIDTH, 'big') for row in rows)
+        emu.invalidate(GFX_ADDRESS, GFX_RESOLUTION)
+    emu.draw_flag = True
+
+def rpl_count(emu):
+    if get_reg1(emu) >= RPL_FLAGS:
+        emu.log("Only v0 to v{} can be kept in the rpl flags, {:#x}", EmulationError._Warning,
+            RPL_FLAGS - 1, emu.program_counter)
+    return min(get_reg1(emu) + 1, RPL_FLAGS)
 
-        if (bin( ( emu.ram[ working_bytes[0] ] ^ original[0] ) & original[0] ) + \
-            bin( ( emu.ram[ working_bytes[1] ] ^ original[1] ) & original[1] )).find('1') != -1:
-            emu.register[0xF] = 0x01
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Quirks, only placed in the instruction table by ins_table when enabled
+
+def i_shl_legacy(emu):
+    emu.register[0xF] = 0x01 if get_reg2_val(emu) >= 0x80 else 0x0
+    emu.register[ get_reg1(emu) ] = ( get_reg2_val(emu) << 1 ) & 0xFF
+
+def i_shr_legacy(emu):
+    emu.register[0xF] = 0x01 if ( get_reg2_val(emu) % 2) == 1 else 0x0
+    emu.register[ get_reg1(emu) ] = get_reg2_val(emu) >> 1
+
+def i_add_index_overflow(emu):
+    if 'i' not in emu.dis_ins.mnemonic_arg_types[0]:
+        i_add(emu)
+        return
+    emu.index_register += get_reg1_val(emu)
+    if emu.index_register > 0xFFF:
+        emu.register[0xF] = 0x01
+    emu.index_register &= 0xFFF
+
+def i_ld_index_increment(emu):
+    i_ld(emu)
+    if '[i]' in emu.dis_ins.mnemonic_arg_types:
+        emu.index_register = (emu.index_register + get_reg1(emu) + 1) & 0xFFF
+
+def i_jp_vx(emu):
+    if 'v0' != emu.dis_ins.mnemonic_arg_types[0]:
+        i_jp(emu)
+        return
+    init_pc = emu.program_counter
+    emu.program_counter = get_address(emu) + get_reg1_val(emu) - 2
+    if init_pc == emu.program_counter + 2:
+        emu.spinning = True
+
+def i_call_ram_stack(emu):
+    address = emu.quirks.stack_address + 2 * emu.stack_pointer
+    emu.ram[address:address + 2] = [emu.program_counter >> 8, emu.program_counter & 0xFF]
+    emu.invalidate(address, 2)
+    i_call(emu)
+
+def i_unofficial(handler, error_type):
+    def i_warn(emu):
+        emu.log("Unoffical instruction '{}' executed at {:#x}", error_type,
+            emu.dis_ins.mnemonic, emu.program_counter)
+        handler(emu)
+    return i_warn
+
+def ins_table(quirks, warn_unofficial=None):
+    '''
+    Builds the mnemonic to handler table for a set of Quirks. Each quirk
+    swaps in its own handler, so no handler checks for quirks while running.
+    If warn_unofficial is an EmulationError the unoffical instructions log
+    it every time they run.
+    '''
+    tbl={
+    'cls' :i_cls, 'ret' :i_ret,  'sys' :i_sys, 'call':i_call,
+    'skp' :i_skp, 'sknp':i_sknp, 'se'  :i_se,  'sne' :i_sne,
+    'add' :i_add, 'or'  :i_or,   'and' :i_and, 'xor' :i_xor,
+    'sub' :i_sub, 'subn':i_subn, 'shr' :i_shr, 'shl' :i_shl,
+    'rnd' :i_rnd, 'jp'  :i_jp,   'ld'  :i_ld,  'drw' :i_drw,
+    'scd' :i_scd, 'scr' :i_scr,  'scl' :i_scl, 'exit':i_exit,
+    'low' :i_low, 'high':i_high}
+
+    if quirks.legacy_shift:
+        tbl['shl'], tbl['shr'] = i_shl_legacy, i_shr_legacy
+    if quirks.index_overflow:
+        tbl['add'] = i_add_index_overflow
+    if quirks.stack_address is not None:
+        tbl['call'] = i_call_ram_stack
+    if quirks.index_increment:
+        tbl['ld'] = i_ld_index_increment
+    if quirks.jump_vx:
+        tbl['jp'] = i_jp_vx
+    if warn_unofficial:
+        for mnemonic in UNOFFICIAL_OP_CODES:
+            tbl[mnemonic] = i_unofficial(tbl[mnemonic], warn_unofficial)
+    return tbl
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Memory Access
+
+NO_ACCESS = ((), ())
+
+def ram_access(emu, opcode):
+    '''
+    RAM that opcode will read and write if executed now, as a tuple of two
+    lists of (start, length) ranges. Instruction fetches are not included.
+    Only meant for instrumentation, call before the instruction executes.
+    '''
+    top = opcode >> 12
+    if top == 0xD:
+        height = opcode & 0xF
+        reads = [(emu.index_register, height if height else 2 * BIG_SPRITE_PX)]
+        return reads, [] if emu.hires else drw_rows(emu, opcode)
+    if top == 0xF:
+        low, x = opcode & 0xFF, (opcode >> 8) & 0xF
+        if low == 0x33:
+            return [], [(emu.index_register, 3)]
+        if low == 0x55:
+            return [], [(emu.index_register, x + 1)]
+        if low == 0x65:
+            return [(emu.index_register, x + 1)], []
+    elif opcode == 0x00FE or (not emu.hires and (opcode in (0x00E0, 0x00FB, 0x00FC) or \
+                                                 opcode & 0xFFF0 == 0x00C0)):
+        return [], [(GFX_ADDRESS, GFX_RESOLUTION)]
+    elif top == 0x2 and emu.quirks.stack_address is not None:
+        return [], [(emu.quirks.stack_address + 2 * emu.stack_pointer, 2)]
+    return NO_ACCESS
+
+def drw_rows(emu, opcode):
+    # Same addressing as i_drw in low resolution, the bytes each sprite line
+    # starts in and spills into
+    x_val, y_val = emu.register[(opcode >> 8) & 0xF], emu.register[(opcode >> 4) & 0xF]
+    height, span = opcode & 0xF, 2
+    if height == 0:
+        height, span = BIG_SPRITE_PX, 3
+    x_origin_byte = int( x_val / 8 ) % GFX_WIDTH
+    rows = []
+    for y in range(height):
+        start = GFX_ADDRESS + ( (y_val + y) % GFX_HEIGHT_PX ) * GFX_WIDTH
+        for byte in range(span):
+            rows.append( (start + (x_origin_byte + byte) % GFX_WIDTH, 1) )
+    return rows
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Hex Extraction
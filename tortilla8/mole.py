@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+from . import export
+from struct import Struct
+from zlib import compress, decompress
+from collections import namedtuple, Counter
+from .salsa import Salsa
+from .constants.reg_rom_stack import BYTES_OF_RAM
+__all__ = []
+
+# Trace layout, all values big endian
+#   Header: magic, version, flags, record size, records per chunk,
+#           random seed of the emulator (from version 2)
+#   Chunk:  number of records, size of payload, payload (zlib'd if flagged)
+#   Record: pc, opcode, written register (0xFF if none), its value, vf,
+#           index register, delay timer, sound timer
+MOLE_MAGIC     = b'T8TR'
+MOLE_VERSION   = 2
+MOLE_HEADER    = Struct('>4sBBBI')
+MOLE_SEED      = Struct('>I')
+MOLE_CHUNK     = Struct('>II')
+MOLE_RECORD    = Struct('>HHBBBHBB')
+FLAG_ZLIB      = 0x01
+NO_REGISTER    = 0xFF
+CHUNK_RECORDS  = 65536
+WRITE_BUFFER   = 1 << 20
+
+@export
+class TraceRecord( namedtuple('TraceRecord', 'cycle program_counter opcode register ' + \
+    'register_value vf index_register delay_timer_register sound_timer_register') ):
+    pass
+
+@export
+class MoleHeader( namedtuple('MoleHeader', 'version flags record_size chunk_records seed') ):
+    pass
+
+@export
+class Mole:
+    '''
+    Mole records an execution trace of a Guacamole instance, one fixed size
+    record per instruction. Records are packed into a preallocated chunk
+    that is written (optionally zlib compressed) through a large buffered
+    writer once full, so tracing millions of instructions stays cheap.
+    The seed of the emulator's random number generator is kept in the
+    header so the run can be repeated.
+    '''
+
+    def __init__(self, file_path, compressed=False, chunk_records=CHUNK_RECORDS, seed=0):
+        self.fh = open(file_path, 'wb', buffering=WRITE_BUFFER)
+        self.compressed = compressed
+        self.chunk_records = chunk_records
+        self.chunk = bytearray(chunk_records * MOLE_RECORD.size)
+        self.count = 0
+        self.fh.write(MOLE_HEADER.pack(MOLE_MAGIC, MOLE_VERSION, FLAG_ZLIB if compressed else 0,
+                                       MOLE_RECORD.size, chunk_records))
+        self.fh.write(MOLE_SEED.pack(seed))
+
+    def attach(self, emu):
+        emu.add_tick_hook(self.record)
+
+    def detach(self, emu):
+        emu.remove_tick_hook(self.record)
+
+    def record(self, emu):
+        '''
+        Tick hook, stores the instruction that was just executed. Nothing
+        is stored when there was no instruction to execute (a fatal error).
+        '''
+        pc, ram = emu.calling_pc, emu.ram
+        if pc + 1 >= BYTES_OF_RAM or ram[pc] is None or ram[pc + 1] is None:
+            return
+        opcode = (ram[pc] << 8) | ram[pc + 1]
+        reg = written_register(opcode)
+        MOLE_RECORD.pack_into(self.chunk, self.count * MOLE_RECORD.size,
+            pc, opcode, reg, NO_REGISTER if reg == NO_REGISTER else emu.register[reg],
+            emu.register[0xF], emu.index_register,
+            emu.delay_timer_register, emu.sound_timer_register)
+        self.count += 1
+        if self.count == self.chunk_records:
+            self.flush()
+
+    def flush(self):
+        if not self.count:
+            return
+        payload = self.chunk[:self.count * MOLE_RECORD.size]
+        if self.compressed:
+            payload = compress(payload, 1)
+        self.fh.write(MOLE_CHUNK.pack(self.count, len(payload)))
+        self.fh.write(payload)
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        self.fh.close()
+
+@export
+def read_mole_header(file_handler):
+    '''
+    Reads the header of a trace made by Mole as a MoleHeader. Version 1
+    traces have no seed, it is read as None.
+    '''
+    magic, version, flags, record_size, chunk_records = \
+        MOLE_HEADER.unpack(file_handler.read(MOLE_HEADER.size))
+    if magic != MOLE_MAGIC or not 1 <= version <= MOLE_VERSION or record_size != MOLE_RECORD.size:
+        raise ValueError("Not a tortilla8 trace.")
+    seed = MOLE_SEED.unpack(file_handler.read(MOLE_SEED.size))[0] if version >= 2 else None
+    return MoleHeader(version, flags, record_size, chunk_records, seed)
+
+@export
+def read_mole(file_handler, header=None):
+    '''
+    Generator that yields a TraceRecord for every instruction in a trace
+    made by Mole. The file handler must be opened in binary mode, the
+    header is read unless already read with read_mole_header.
+    '''
+    if header is None:
+        header = read_mole_header(file_handler)
+    flags = header.flags
+
+    cycle = 0
+    while True:
+        head = file_handler.read(MOLE_CHUNK.size)
+        if len(head) < MOLE_CHUNK.size:
+            return
+        count, size = MOLE_CHUNK.unpack(head)
+        payload = file_handler.read(size)
+        if flags & FLAG_ZLIB:
+            payload = decompress(payload)
+        for fields in MOLE_RECORD.iter_unpack(payload):
+            yield TraceRecord(cycle, *fields)
+            cycle += 1
+
+def written_register(opcode):
+    '''
+    The register an opcode writes to, found from the opcode alone. For
+    'ld vx, [i]' this is the last register loaded. VF is recorded on its
+    own so it is not reported here when only set as a flag.
+    '''
+    top = opcode >> 12
+    if top in (0x6, 0x7, 0x8, 0xC):
+        return (opcode >> 8) & 0xF
+    if top == 0xF and (opcode & 0xFF) in (0x07, 0x0A, 0x65):
+        return (opcode >> 8) & 0xF
+    return NO_REGISTER
+
+def mnemonic_of(opcode, cache={}):
+    if opcode not in cache:
+        cache[opcode] = Salsa([opcode >> 8, opcode & 0xFF]).disassembled_line
+    return cache[opcode]
+
+@export
+def filter_mole(records, pcs=None, mnemonics=None, first=None, last=None):
+    '''
+    Filters TraceRecords by program counter, mnemonic, and cycle range.
+    '''
+    for rec in records:
+        if first is not None and rec.cycle < first:
+            continue
+        if last is not None and rec.cycle > last:
+            return
+        if pcs and rec.program_counter not in pcs:
+            continue
+        if mnemonics and mnemonic_of(rec.opcode).split(' ')[0] not in mnemonics:
+            continue
+        yield rec
+
+@export
+def print_mole(records, file_handler=None):
+    '''
+    Prints one line per TraceRecord.
+    '''
+    for rec in records:
+        reg = '' if rec.register == NO_REGISTER else \
+            'v' + hex(rec.register)[2:] + '=' + format(rec.register_value, '#04x')
+        line = str(rec.cycle).rjust(10) + '  ' + format(rec.program_counter, '#05x') + '  ' + \
+            format(rec.opcode, '04x') + '  ' + mnemonic_of(rec.opcode).ljust(20) + \
+            reg.ljust(9) + ' vf=' + format(rec.vf, '#04x') + ' i=' + format(rec.index_register, '#05x') + \
+            ' dt=' + format(rec.delay_timer_register, '#04x') + ' st=' + format(rec.sound_timer_register, '#04x')
+        if file_handler is None:
+            print(line)
+        else:
+            file_handler.write(line + '\n')
+
+@export
+def mole_summary(records, top=10, file_handler=None, seed=None):
+    '''
+    Prints the number of records, and the most executed addresses and
+    mnemonics in a trace, and the random seed of the run if given.
+    '''
+    by_pc, by_op = Counter(), Counter()
+    total = 0
+    for rec in records:
+        by_pc[(rec.program_counter, rec.opcode)] += 1
+        total += 1
+    for (pc, opcode), count in by_pc.items():
+        by_op[mnemonic_of(opcode).split(' ')[0]] += count
+
+    lines = ["Instructions: " + str(total), "", "Hottest addresses:"]
+    if seed is not None:
+        lines.insert(0, "Random seed: " + str(seed))
+    for (pc, opcode), count in by_pc.most_common(top):
+        lines.append("  " + format(pc, '#05x') + "  " + mnemonic_of(opcode).ljust(20) + str(count).rjust(10))
+    lines += ["", "Mnemonics:"]
+    for mnemonic, count in by_op.most_common():
+        lines.append("  " + str(mnemonic).ljust(6) + str(count).rjust(10))
+    for line in lines:
+        if file_handler is None:
+            print(line)
+        else:
+            file_handler.write(line + '\n')
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
 from . import Guacamole, EmulationError
-from os.path import join as pathjoin
+from .guacamole import changed_rows
+from .horchata import Horchata, SimpleAudioSink
+from .escabeche import Escabeche, read_escabeche, restore_savestate
+from os.path import isfile
 from tkinter import *
 from tkinter import filedialog
 from webbrowser import open as openweb
@@ -37,7 +40,9 @@ class Nacho(Frame):
         self.scale = 18
         self.tile_size = (self.scale, self.scale)
         self.emu = None
-        self.prev_screen = 0
+        self.saver = None
+        self.prev_screen = []
+        self.shown = []
         self.fatal = False
         self.run_time = 1000 # 1000/this = Freq
         self.color_border = "white"
@@ -50,19 +55,14 @@ class Nacho(Frame):
             'KP_Subtract':0xC, 'KP_Add':0xD, 'KP_Enter':0xE, 'KP_Decimal':0xF}
 
         # Setup audio
-        self.wave_file = pathjoin('tortilla8','sound','play.wav')
+        self.audio = None
         self.audio_on = False
         if sa is None:
             print("SimpleAudio is missing from your system. You can install it " + \
                 "via 'pip install simpleaudio'. Audio has been disabled.")
         else:
-            try:
-                self.wave_obj = sa.WaveObject.from_wave_file(self.wave_file)
-                self.play_obj = None
-                self.audio_playing = False
-                self.audio_on = True
-            except FileNotFoundError:
-                print("An error occured while initalizing audo. Audio has been disabled.")
+            self.audio = Horchata(SimpleAudioSink(), timer_hz=1000 // Nacho.TIMER_REFRESH)
+            self.audio_on = True
 
         # Init TK and canvas
         self.root = Tk()
@@ -81,6 +81,8 @@ class Nacho(Frame):
         self.antiflicker.set(True)
         self.lock_aspect = BooleanVar()
         self.lock_aspect.set(True)
+        self.autosave = BooleanVar()
+        self.autosave.set(False)
 
         # Bind some functions
         self.root.bind("<KeyPress>", self.key_down)
@@ -102,6 +104,7 @@ class Nacho(Frame):
         else:
             setmenu.add_command(label="Audio", command=self.win_audio_settings, state='disable')
         setmenu.add_checkbutton(label="Anti-Flicker", onvalue=True, offvalue=False, variable=self.antiflicker)
+        setmenu.add_checkbutton(label="Autosave", onvalue=True, offvalue=False, variable=self.autosave)
         self.menubar.add_cascade(label="Settings", menu=setmenu)
 
         # Populate the 'Help' section
@@ -117,11 +120,37 @@ class Nacho(Frame):
         file_path = filedialog.askopenfilename()
         if file_path:
             self.emu = Guacamole(rom=file_path, cpuhz=Nacho.DEFAULT_FREQ, audiohz=60, delayhz=60,
-                       init_ram=True, legacy_shift=False, err_unoffical="None", rewind_frames=0)
+                       init_ram=True, legacy_shift=False, err_unoffical="None", rewind_frames=0,
+                       log_level=EmulationError._Information)
+            self.start_autosave(file_path)
             self.run_time = 1 # 1khz
             self.emu_event()
             self.timers_event()
 
+    def start_autosave(self, rom):
+        '''
+        Saves in the background to ROM.autosave, resuming from it first.
+        '''
+        self.stop_autosave()
+        if not self.autosave.get():
+            return
+        path = rom + '.autosave'
+        if isfile(path):
+            try:
+                with open(path, 'rb') as fh:
+                    savestate = read_escabeche(fh)
+                if savestate is not None:
+                    restore_savestate(self.emu, savestate, rom)
+            except ValueError as err:
+                print("Unable to resume from '" + path + "'. " + str(err))
+        self.saver = Escabeche(path, interval=1000 // Nacho.TIMER_REFRESH)
+        self.saver.attach(self.emu, rom)
+
+    def stop_autosave(self):
+        if self.saver is not None:
+            self.saver.detach()
+            self.saver = None
+
     def set_controls(self, *controls):
         tmp = {}
         for i, key in enumerate(controls):
@@ -175,6 +204,9 @@ class Nacho(Frame):
         label.pack(side="top", fill="both", padx=10, pady=10)
 
     def on_closing(self):
+        self.stop_autosave()
+        if self.audio is not None:
+            self.audio.close()
         self.root.destroy()
 
     def key_down(self, key):
@@ -189,57 +221,62 @@ class Nacho(Frame):
             if val:
                 self.emu.keypad[val] = False
 
-    def draw(self):
-        self.screen.delete("all")
-        self.screen.create_rectangle( 0, 0, Nacho.X_SIZE*self.scale,
-            Nacho.Y_SIZE*self.scale, fill=self.color_back )
-        for i,pix in enumerate(self.emu.graphics()):
-            if pix:
-                x = self.scale*(i%Nacho.X_SIZE)
-                y = self.scale*(i//Nacho.X_SIZE)
-                self.screen.create_rectangle( x, y, x+self.scale, y+self.scale,
-                    fill=self.color_fill, outline=self.color_border )
+    def draw(self, screen):
+        '''
+        Redraws the rows of screen that differ from the ones shown. The
+        pixels of each row are tagged with it, so a row is deleted at once.
+        '''
+        factor = len(screen) // Nacho.Y_SIZE # 2 in high resolution
+        width, size = Nacho.X_SIZE*factor, self.scale//factor
+        if len(screen) != len(self.shown):
+            self.screen.delete("pixel")
+        for y in changed_rows(self.shown, screen):
+            tag = "row" + str(y)
+            self.screen.delete(tag)
+            for x in range(width):
+                if (screen[y] >> (width-1-x)) & 1:
+                    self.screen.create_rectangle( size*x, size*y, size*(x+1), size*(y+1),
+                        fill=self.color_fill, outline=self.color_border, tags=("pixel", tag) )
+        self.shown = screen
 
     def timers_event(self):
         if (self.emu is not None) and (self.fatal is False):
             if self.audio_on:
-                if self.emu.sound_timer_register != 0:
-                    self.wave_obj.play()
-                else:
-                    sa.stop_all()
-
+                self.audio.update(self.emu)
             self.emu.sound_timer_register -= 1 if self.emu.sound_timer_register != 0 else 0
             self.emu.delay_timer_register -= 1 if self.emu.delay_timer_register != 0 else 0
+            if self.saver is not None:
+                self.saver.frame(self.emu)
 
         self.root.after(Nacho.TIMER_REFRESH, self.timers_event)
 
     def emu_event(self):
         self.emu.cpu_tick()
 
-        for err in self.emu.error_log:
-            print( str(err[0]) + ": " + err[1] )
-            if err[0] is EmulationError._Fatal:
-                self.fatal = True
-            self.emu.error_log = []
+        if self.emu.error_log:
+            for err in self.emu.error_log:
+                print( str(err[0]) + ": " + err[1] )
+            self.emu.error_log.clear()
+            self.fatal = self.emu.fatal
 
         if self.emu.draw_flag:
             self.emu.draw_flag = False
 
+            cur_screen = self.emu.screen_rows()
             if not self.antiflicker.get():
-                self.draw()
+                self.draw(cur_screen)
             else:
-                cur_screen = ''
-                for i,pix in enumerate(self.emu.graphics()):
-                    cur_screen += '1' if pix else '0'
-                cur_screen = int(cur_screen,2)
-
-                if ( ( self.prev_screen ^ cur_screen ) & self.prev_screen ) != ( self.prev_screen ^ cur_screen ):
-                    self.draw()
+                # Skip draws that only turn pixels off
+                if len(cur_screen) != len(self.prev_screen) or \
+                   any(new & ~old for old, new in zip(self.prev_screen, cur_screen)):
+                    self.draw(cur_screen)
                 self.prev_screen = cur_screen
 
         if not self.fatal:
             self.root.after(self.run_time, self.emu_event)
         else:
             self.menubar.add_cascade(label="Fatal Error has occured!", menu=Menu(self.menubar, tearoff=0))
-            sa.stop_all()
+            if self.audio_on:
+                self.audio.close()
+                self.audio_on = False
 
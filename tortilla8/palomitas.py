@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+from . import export
+from array import array
+from struct import Struct
+from zlib import crc32
+from . import EmulationError
+from .guacamole import Rng
+__all__ = []
+
+# Movie layout, all values big endian
+#   Header: magic, version, random seed, crc32 of the ROM, length in instructions,
+#           number of key events, number of frequency changes
+#   Keys:   instruction count, keypad mask (key 0 is the top bit)
+#   Freqs:  instruction count, cpu frequency (the first is the starting one)
+PALOMITAS_MAGIC   = b'T8MV'
+PALOMITAS_VERSION = 1
+PALOMITAS_HEADER  = Struct('>4sBIIQII')
+PALOMITAS_EVENT   = Struct('>QH')
+PALOMITAS_FREQ    = Struct('>Qd')
+
+@export
+class Palomitas:
+    '''
+    Palomitas records and replays input movies. A movie is every change of
+    the keypad, stamped with the instruction count it happened at, plus the
+    random seed, a checksum of the ROM, and the cpu frequency, which sets
+    when the timers tick. Played back into an emulator with timers stepped
+    by instruction count (run_for, or count_timers) the run is identical to
+    the recorded one, so movies can be used as benchmarks and regression
+    tests.
+    '''
+
+    def __init__(self):
+        self.cycles = array('Q')
+        self.masks  = array('H')
+        self.freq_cycles = array('Q')
+        self.freqs  = array('d')
+        self.seed   = 0
+        self.rom_crc = 0
+        self.length = 0
+        self.next   = 0
+        self.emu    = None
+
+    def record(self, emu, rom=None):
+        '''
+        Starts recording the keypad of emu, which should not have run yet.
+        Rom is the path of the ROM, its checksum is stored with the movie.
+        '''
+        self.emu = emu
+        self.seed = emu.rng.seed
+        self.rom_crc = rom_checksum(rom)
+        self.restart(emu)
+        emu.count_timers = True
+        emu.add_tick_hook(self.capture, before=True)
+
+    def capture(self, emu):
+        '''
+        Pre-tick hook, stores the keypad and frequency when they change.
+        Starts over if the emulator was reset.
+        '''
+        count = emu.cycle_count
+        if count < self.seen:
+            self.restart(emu)
+        self.seen = count
+        if emu.keypad != self.keypad:
+            self.keypad = emu.keypad.copy()
+            self.cycles.append(count)
+            self.masks.append(emu.decode_keypad())
+        if emu.cpu_hz != self.freqs[-1]:
+            self.freq_cycles.append(count)
+            self.freqs.append(emu.cpu_hz)
+
+    def restart(self, emu):
+        del self.cycles[:], self.masks[:], self.freq_cycles[:], self.freqs[:]
+        self.seen = emu.cycle_count
+        self.keypad = emu.keypad.copy()
+        self.freq_cycles.append(emu.cycle_count)
+        self.freqs.append(emu.cpu_hz)
+
+    def play(self, emu, rom=None):
+        '''
+        Plays the movie into emu, which should not have run yet. Uses the
+        seed of the movie, and warns if rom is not the ROM it was made with.
+        Stops itself once every event has been played.
+        '''
+        if rom is not None and self.rom_crc and rom_checksum(rom) != self.rom_crc:
+            emu.log("Movie was recorded with a different ROM", EmulationError._Warning)
+        self.emu = emu
+        self.next, self.next_freq = 0, 1
+        emu.rng = Rng(self.seed)
+        set_frequency(emu, self.freqs[0])
+        if self.cycles or len(self.freqs) > 1:
+            emu.add_tick_hook(self.feed, before=True)
+
+    def feed(self, emu):
+        '''
+        Pre-tick hook, sets the keypad and frequency at the recorded
+        instruction counts.
+        '''
+        count = emu.cycle_count
+        if self.next < len(self.cycles) and count == self.cycles[self.next]:
+            emu.encode_keypad(self.masks[self.next])
+            self.next += 1
+        if self.next_freq < len(self.freqs) and count == self.freq_cycles[self.next_freq]:
+            set_frequency(emu, self.freqs[self.next_freq])
+            self.next_freq += 1
+        if self.next == len(self.cycles) and self.next_freq == len(self.freqs):
+            emu.remove_tick_hook(self.feed)
+
+    def stop(self):
+        if self.capture in self.emu.pre_tick_hooks:
+            self.emu.remove_tick_hook(self.capture)
+            self.length = self.emu.cycle_count
+        if self.feed in self.emu.pre_tick_hooks:
+            self.emu.remove_tick_hook(self.feed)
+
+    def export(self, file_handler):
+        file_handler.write(PALOMITAS_HEADER.pack(PALOMITAS_MAGIC, PALOMITAS_VERSION,
+            self.seed, self.rom_crc, self.length, len(self.cycles), len(self.freqs)))
+        for cycle, mask in zip(self.cycles, self.masks):
+            file_handler.write(PALOMITAS_EVENT.pack(cycle, mask))
+        for cycle, freq in zip(self.freq_cycles, self.freqs):
+            file_handler.write(PALOMITAS_FREQ.pack(cycle, freq))
+
+@export
+def read_palomitas(file_handler):
+    '''
+    Reads a movie written by Palomitas.export, ready to play.
+    '''
+    magic, version, seed, rom_crc, length, count, freq_count = \
+        PALOMITAS_HEADER.unpack(file_handler.read(PALOMITAS_HEADER.size))
+    if magic != PALOMITAS_MAGIC or version != PALOMITAS_VERSION:
+        raise ValueError("Not a tortilla8 movie.")
+    movie = Palomitas()
+    movie.seed, movie.rom_crc, movie.length = seed, rom_crc, length
+    for cycle, mask in PALOMITAS_EVENT.iter_unpack(file_handler.read(count * PALOMITAS_EVENT.size)):
+        movie.cycles.append(cycle)
+        movie.masks.append(mask)
+    for cycle, freq in PALOMITAS_FREQ.iter_unpack(file_handler.read(freq_count * PALOMITAS_FREQ.size)):
+        movie.freq_cycles.append(cycle)
+        movie.freqs.append(freq)
+    return movie
+
+def set_frequency(emu, hz):
+    emu.cpu_hz = hz
+    emu.cpu_wait = 1/hz
+
+def rom_checksum(rom):
+    if rom is None:
+        return 0
+    with open(rom, 'rb') as fh:
+        return crc32(fh.read())
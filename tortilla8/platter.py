@@ -10,6 +10,7 @@ except ImportError:
 try: import simpleaudio as sa
 except ImportError:
     sa = None
+from .horchata import Horchata, SimpleAudioSink
 
 # Import System to clear keybuffer
 try:
@@ -21,17 +22,19 @@ except ImportError:
     from msvcrt import getch, kbhit
 
 # Everything else
-from os import path
 from enum import Enum
+from array import array
 from sys import platform
 from textwrap import wrap
-from time import time, sleep
+from time import time, sleep, perf_counter
 from collections import deque
 from .constants.curses import *
 from .guacamole import Guacamole
-from .guacamole import EmulationError
+from .guacamole import EmulationError, changed_rows
+from .queso import Queso
+from .tamal import Tamal
+from .salsa import Salsa
 from .constants.reg_rom_stack import PROGRAM_BEGIN_ADDRESS, NUMB_OF_REGS
-from .constants.graphics import GFX_RESOLUTION, GFX_ADDRESS, GFX_HEIGHT_PX, GFX_WIDTH
 from resource import getrusage, RUSAGE_SELF
 
 # TODO Prevent menu from drawing when screen is small
@@ -46,7 +49,9 @@ class Platter:
                  init_ram, legacy_shift, enforce_ins,
                  rewind_depth, drawfix,
                  enable_screen_unicode, enable_menu_unicode,
-                 wave_file=None):
+                 wave_file=None, breaks=None, quirks=None):
+
+        self.audio = None
 
         # Check if windows (no unicode in their Curses)
         self.screen_unicode = enable_screen_unicode
@@ -60,7 +65,7 @@ class Platter:
 
         # Used for graphics "smoothing" w/ -d flag
         self.draw_fix = drawfix
-        self.prev_board=[0x00]*GFX_RESOLUTION
+        self.prev_board=[]
 
         # General Prep
         self.rom = rom
@@ -73,29 +78,33 @@ class Platter:
             self.console_print("Window must be atleast " + str(DISPLAY_MIN_W) + \
                 "x" + str(DISPLAY_MIN_H) +" to display the game screen")
 
-        # Load default sound
-        self.wave_obj = None
-        if not wave_file:
-            wave_file = path.join('tortilla8','sound','play.wav')
-
         # Print FYI for sound if no SA
         if sa is None:
             self.console_print("SimpleAudio is missing from your system." + \
                 "You can install it via 'pip install simpleaudio'. " + \
                 "The sound timmer will not be raised.")
 
-        # Init sound if available
-        elif wave_file.lower() != 'off':
+        # Init sound if available, by default a square wave is generated
+        elif not wave_file or wave_file.lower() != 'off':
             try:
-                self.wave_obj = sa.WaveObject.from_wave_file(wave_file)
-                self.play_obj = None
-                self.audio_playing = False
-            except FileNotFoundError:
-                self.console_print("No sound file provided as parameter. " + \
-                    "Unable to load default 'play.wav' from sound directory.")
-
-        # Init the emulator
-        self.emu = Guacamole(rom, cpuhz, audiohz, delayhz, init_ram, legacy_shift, enforce_ins, rewind_depth)
+                self.audio = Horchata(SimpleAudioSink(), timer_hz=audiohz, wave_file=wave_file)
+            except (FileNotFoundError, ValueError) as err:
+                self.console_print("Unable to load sound file '" + str(wave_file) + "'. " + str(err))
+
+        # Init the emulator, rewinding is done by the timeline rather than
+        # the emulator's own snapshots
+        self.emu = Guacamole(rom, cpuhz, audiohz, delayhz, init_ram, legacy_shift, enforce_ins, 0,
+                             EmulationError._Information, quirks)
+        if self.audio is not None:
+            self.audio.attach(self.emu)
+        self.breaks = Queso() if breaks is None else breaks
+        self.breaks.attach(self.emu)
+        self.timeline = None
+        self.rewind_depth = rewind_depth
+        if rewind_depth:
+            self.timeline = Tamal()
+            self.timeline.attach(self.emu)
+        self.metrics = None
         self.check_log()
         self.init_emu_status()
         self.rewind_size = 5
@@ -110,11 +119,12 @@ class Platter:
         self.halt        = False
 
     def init_logs(self):
-        self.instr_history   = deque(maxlen = self.w_instr.getmaxyx()[0] - BORDERS)
+        self.instr_history   = InstructionHistory(self.w_instr.getmaxyx()[0] - BORDERS)
+        self.instr_drawn     = -1
         self.console_history = deque(maxlen = self.w_console.getmaxyx()[0] - BORDERS)
 
     def resize_logs(self):
-        if (self.w_instr.getmaxyx()[0] - BORDERS) != self.instr_history.maxlen:
+        if (self.w_instr.getmaxyx()[0] - BORDERS) != self.instr_history.size:
             self.instr_history
         self.console_history
 
@@ -157,7 +167,6 @@ class Platter:
 
                 # Update Keypad press
                 if time() - key_press_time > 0.5: #TODO Better input?
-                    self.emu.prev_keypad = 0
                     self.emu.keypad = [False] * 16
                     key_press_time = time()
                 if key in KEY_CONTROLS:
@@ -167,15 +176,20 @@ class Platter:
                 if key == KEY_EXIT:
                     break
 
-                # Rewind check:
-                if key == KEY_REWIN:
-                    self.emu.rewind(self.rewind_size)
-                    self.instr_history.appendleft("rewind: " + hex3(self.emu.program_counter))
+                # Rewind and forward check, moves through the recorded run
+                if (key == KEY_REWIN or key == KEY_FORWD) and self.timeline is not None:
+                    step = -self.rewind_size if key == KEY_REWIN else self.rewind_size
+                    target = min(self.emu.cycle_count + step, self.timeline.end + 1)
+                    self.timeline.seek(max(target, self.timeline.start, self.timeline.end - self.rewind_depth))
+                    self.instr_history.append(self.emu.program_counter | HIST_REWIND)
+                    self.previous_pc = self.emu.program_counter
                     continue
 
                 # Reset check
                 if key == KEY_RESET:
                     self.emu.reset( self.rom )
+                    if self.timeline is not None:
+                        self.timeline.clear()
                     self.init_emu_status()
                     self.init_logs()
                     self.clear_all_windows()
@@ -191,10 +205,27 @@ class Platter:
                     step_mode = False
                     self.halt = False
 
+                # Toggle a breakpoint at the current address
+                if key == KEY_BREAK:
+                    pc = self.emu.program_counter
+                    if pc in self.breaks.breakpoints:
+                        self.breaks.remove_breakpoint(pc)
+                        self.console_print("Breakpoint at " + hex3(pc) + " removed.")
+                    else:
+                        self.breaks.add_breakpoint(pc)
+                        self.console_print("Breakpoint at " + hex3(pc) + " added.")
+
                 # Try to tick the cpu
                 if not self.halt:
                     self.emu.run()
 
+                # Stop on breakpoints, watchpoints, and conditions
+                if self.breaks.hit is not None:
+                    self.console_print(self.breaks.hit + ". Press '" + chr(KEY_RESUM).upper() + \
+                        "' to resume or '" + chr(KEY_STEP).upper() + "' to step.")
+                    self.breaks.hit = None
+                    step_mode = True
+
                 # Update Display if we executed
                 if self.emu.program_counter != self.previous_pc:
                     self.previous_pc = self.emu.program_counter
@@ -203,13 +234,13 @@ class Platter:
 
                 # Watch for spin for key
                 elif self.emu.waiting_for_key and not key_msg_displayed:
-                    self.instr_history.appendleft(hex3(self.emu.program_counter) + " key  ld")
+                    self.instr_history.append(self.emu.program_counter | HIST_KEY)
                     self.console_print("Program is trying to load a key press.")
                     key_msg_displayed = True
 
                 # Detect jp Spinning
                 elif not self.halt and self.emu.spinning:
-                    self.instr_history.appendleft(hex3(self.emu.program_counter) + " spin jp")
+                    self.instr_history.append(self.emu.program_counter | HIST_SPIN)
                     self.console_print("Spin detected. Press '" + chr(KEY_EXIT).upper() + "' to exit")
                     self.halt  = True
 
@@ -217,19 +248,6 @@ class Platter:
                 if step_mode:
                     self.halt = True
 
-                # Start/stop Audio
-                if sa is not None and self.wave_obj is not None:
-                    self.audio_playing = False if self.emu.sound_timer_register == 0 else True
-                    if not self.audio_playing and self.play_obj is None:
-                        pass
-                    elif self.audio_playing and self.play_obj is None:
-                        self.play_obj = self.wave_obj.play()
-                    elif not self.audio_playing and self.play_obj is not None:
-                        self.play_obj.stop()
-                        self.play_obj = None
-                    elif self.audio_playing and not self.play_obj.is_playing():
-                        self.play_obj = self.wave_obj.play()
-
                 # Check if screen was re-sized
                 if platform != 'win32':
                     if curses.is_term_resized(self.L, self.C):
@@ -258,6 +276,9 @@ class Platter:
             self.cleanup()
 
     def check_log(self):
+        if not self.emu.error_log:
+            return
+
         # Print all logged errors in the emu
         for err in reversed(self.emu.error_log):
             self.console_print( str(err[0]) + ": " + err[1] )
@@ -267,9 +288,11 @@ class Platter:
                     chr(KEY_RESET).upper() + "' to reset" )
 
         # Manually reset
-        self.emu.error_log = []
+        self.emu.error_log.clear()
 
     def cleanup(self):
+        if self.audio is not None:
+            self.audio.close()
         curses.nocbreak()
         curses.echo()
         curses.endwin()
@@ -283,9 +306,31 @@ class Platter:
         curses.doupdate()
 
     def update_instr_history(self):
-        self.instr_history.appendleft(hex3(self.emu.calling_pc) + " " + \
-                                           self.emu.dis_ins.hex_instruction + " " + \
-                                           self.emu.dis_ins.mnemonic)
+        pc = self.emu.calling_pc
+        self.instr_history.append(pc, (self.emu.ram[pc] << 8) | self.emu.ram[pc + 1])
+
+    def instr_text(self, pc, opcode):
+        '''
+        Returns the text for a row of the instruction window, made from the
+        emulator's disassembly of the address (see Guacamole.disassemble),
+        which it drops whenever the RAM under it is written. An address that
+        no longer holds the opcode recorded has that opcode disassembled.
+        '''
+        mark, pc = pc & ~HIST_PC_MASK, pc & HIST_PC_MASK
+        if mark == HIST_REWIND:
+            return "rewind: " + hex3(pc)
+        if mark == HIST_KEY:
+            return hex3(pc) + " key  ld"
+        if mark == HIST_SPIN:
+            return hex3(pc) + " spin jp"
+
+        try:
+            dis_ins = self.emu.dis_cache[pc] or self.emu.disassemble(pc)
+        except (TypeError, IndexError):
+            dis_ins = None
+        if dis_ins is None or int(dis_ins.hex_instruction, 16) != opcode:
+            dis_ins = Salsa([opcode >> 8, opcode & 0xFF])
+        return hex3(pc) + " " + dis_ins.hex_instruction + " " + (dis_ins.mnemonic or "")
 
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
     # Display functions for windows
@@ -299,6 +344,8 @@ class Platter:
         self.w_console.noutrefresh()
 
     def clear_all_windows(self):
+        self.reg_drawn = self.stack_drawn = self.menu_drawn = None
+        self.shown_rows = []
         self.screen.clear()
         self.w_stack.clear()
         self.w_console.clear()
@@ -337,37 +384,36 @@ class Platter:
     def display_game(self):
         if not self.w_game or not self.emu.draw_flag: return
         self.emu.draw_flag = False
+        start = perf_counter()
+        rows = self.emu.screen_rows()
 
         if self.draw_fix:
-            prev_str = ""
-            curr_str = ""
-            for val in self.prev_board:
-                prev_str += bin(val)[2:].zfill(8)
-            for val in self.emu.ram[GFX_ADDRESS:GFX_ADDRESS+GFX_RESOLUTION]:
-                curr_str += bin(val)[2:].zfill(8)
-            int_prev = int(prev_str,2)
-            int_curr = int(curr_str,2)
-            self.prev_board = self.emu.ram[GFX_ADDRESS:GFX_ADDRESS+GFX_RESOLUTION]
-            if ( ( int_prev ^ int_curr ) & int_prev ) == ( int_prev ^ int_curr ):
+            prev, self.prev_board = self.prev_board, rows
+            if len(prev) == len(rows) and not any(new & ~old for old, new in zip(prev, rows)):
                 #Only 1s were changed to 0s, skip the draw to prevent SOME flicker
                 return
 
-        for y in range( int(GFX_HEIGHT_PX / 2) ):
-            for x in range(GFX_WIDTH):
-                upper_chunk = int( bin( self.emu.ram[ GFX_ADDRESS + ( (y * 2 + 0) * GFX_WIDTH) + x ] )[2:] )
-                lower_chunk = int( bin( self.emu.ram[ GFX_ADDRESS + ( (y * 2 + 1) * GFX_WIDTH) + x ] )[2:].replace('1','2') )
-                total_chunk  = str(upper_chunk + lower_chunk).zfill(8) \
-                    .replace('3', self.draw_char.both ).replace('2', self.draw_char.lower ) \
-                    .replace('1', self.draw_char.upper ).replace('0', self.draw_char.empty )
-                self.w_game.addstr( 1 + y, 1 + x * 8, total_chunk )
+        # Only text rows holding a pixel row that changed are drawn again
+        per_text_row = len(rows) // TEXT_ROWS
+        for y in sorted(set(row // per_text_row for row in changed_rows(self.shown_rows, rows))):
+            self.w_game.addstr( 1 + y, 1, ''.join(screen_cells(rows, y, self.draw_char)) )
+        self.shown_rows = rows
         self.w_game.noutrefresh()
+        if self.metrics is not None:
+            self.metrics.rendered(perf_counter() - start)
 
     def display_instructions(self):
-        for i,val in enumerate(self.instr_history):
-            self.w_instr.addstr( 1 + i, 2, val.ljust(15))
+        if self.instr_history.count == self.instr_drawn: return
+        self.instr_drawn = self.instr_history.count
+        for i,(pc,opcode) in enumerate(self.instr_history):
+            self.w_instr.addstr( 1 + i, 2, self.instr_text(pc, opcode).ljust(15))
         self.w_instr.noutrefresh()
 
     def display_registers(self):
+        drawn = (tuple(self.emu.register), self.emu.delay_timer_register,
+                 self.emu.sound_timer_register, self.emu.index_register)
+        if drawn == self.reg_drawn: return
+        self.reg_drawn = drawn
         for i, reg in enumerate(self.emu.register):
             self.w_reg.addstr( ( i // 4 ) + 2, i % 4 * 9 + 2, hex(i)[2] + ": " + hex2(reg) )
         self.w_reg.addstr(6, 1, " dt: " + hex2(self.emu.delay_timer_register) + \
@@ -376,6 +422,9 @@ class Platter:
         self.w_reg.noutrefresh()
 
     def display_stack(self):
+        drawn = (self.emu.stack_pointer, tuple(self.emu.stack))
+        if drawn == self.stack_drawn: return
+        self.stack_drawn = drawn
         top = max(3, self.w_stack.getmaxyx()[0] - 1 - self.emu.stack_pointer)
         if top > 3:
             self.w_stack.addstr( top - 2, 1, " " * 10 )
@@ -387,6 +436,9 @@ class Platter:
 
     def display_menu(self):
         if self.w_menu is None: return
+        drawn = (self.emu.cpu_hz, self.rewind_size)
+        if drawn == self.menu_drawn: return
+        self.menu_drawn = drawn
         prefix = ""
         cpu_hz = str(self.emu.cpu_hz) if self.emu.cpu_hz > 1e3 else str(self.emu.cpu_hz)[0:5]
         for pre,val in PREFIX:
@@ -396,11 +448,11 @@ class Platter:
                 break
 
         if self.menu_unicode:
-            left = "E̲xit  ̲Reset  ̲Step  Re̲wind  Res̲ume"
+            left = "E̲xit  ̲Reset  ̲Step  Re̲wind  ̲Fwd  Res̲ume  ̲Break"
             right = "⇄RwSize " + str(self.rewind_size) + "  ⇅Freq " + cpu_hz + prefix + "hz"
-            middle = " " * ( self.w_menu.getmaxyx()[1] - len(left) - len(right) + 1 )
+            middle = " " * ( self.w_menu.getmaxyx()[1] - len(left) - len(right) + 3 )
         else:
-            left = "eXit  Reset  Step  reWind  resUme"
+            left = "eXit  Reset  Step  reWind  Fwd  resUme  Break"
             right = "RwSize " + str(self.rewind_size) + "  Freq " + cpu_hz + prefix + "hz"
             middle = " " * ( self.w_menu.getmaxyx()[1] - len(left) - len(right) - 4 )
 
@@ -438,6 +490,37 @@ class Platter:
             self.w_game    = curses.newwin( DISPLAY_H, DISPLAY_W, 0, ( self.C - WIN_REG_W - DISPLAY_W ) // 2 )
             self.w_console = curses.newwin( self.L - DISPLAY_H - WIN_MENU_H, self.w_reg.getbegyx()[1], DISPLAY_H, 0 )
 
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Instruction History
+
+class InstructionHistory:
+    '''
+    Fixed size ring of raw (pc, opcode) pairs, newest first when iterated.
+    Nothing is formatted when an instruction is recorded; text is only made
+    for rows that are drawn. Markers (rewind, key wait, spin) are stored in
+    the upper bits of the pc.
+    '''
+    def __init__(self, size):
+        self.size   = max(size, 1)
+        self.pcs    = array('H', [0] * self.size)
+        self.ops    = array('H', [0] * self.size)
+        self.head   = 0
+        self.count  = 0
+
+    def append(self, pc, opcode=0):
+        self.head = (self.head + 1) % self.size
+        self.pcs[self.head] = pc
+        self.ops[self.head] = opcode
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            j = (self.head - i) % self.size
+            yield self.pcs[j], self.ops[j]
+
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Helper functions
 
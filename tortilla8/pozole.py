@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+from . import export
+from struct import Struct
+from .constants.graphics import GFX_RESOLUTION, GFX_WIDTH, GFX_HEIGHT_PX, \
+                                HIRES_RESOLUTION, HIRES_WIDTH, HIRES_HEIGHT_PX
+__all__ = []
+
+# Delta layout: a mask of the rows that changed (row 0 is the top bit), then
+# the XOR of each changed row with its previous value, run length encoded.
+# The mask is 4 bytes for the low resolution screen and 8 for the high.
+# RLE tokens: 0x80 | (n - 1) is a run of n zero bytes, n - 1 is n literal
+# bytes that follow, n is at most 128.
+POZOLE_ROWS       = Struct('>I')
+POZOLE_HIRES_ROWS = Struct('>Q')
+RLE_ZEROS   = 0x80
+RLE_MAX     = 128
+
+# Bytes per row, rows, and row mask of each screen size
+POZOLE_LAYOUTS = {
+    GFX_RESOLUTION   : (GFX_WIDTH, GFX_HEIGHT_PX, POZOLE_ROWS),
+    HIRES_RESOLUTION : (HIRES_WIDTH, HIRES_HEIGHT_PX, POZOLE_HIRES_ROWS)}
+
+@export
+class Pozole:
+    '''
+    Pozole encodes the Chip-8 screen for streaming. The first frame is a
+    keyframe, the 256 bytes of the screen (1024 in Super Chip-8 high
+    resolution). After that only deltas are sent: the changed rows as the
+    XOR with what the other side has, which is mostly zeros and so run
+    length encoded, usually to a few bytes. A change of resolution needs a
+    new keyframe. Both ends keep a Pozole holding the screen as the viewer
+    has it, the sender encodes with keyframe and delta, the viewer applies
+    them with apply_keyframe and apply_delta.
+    '''
+
+    def __init__(self):
+        self.screen = bytes(GFX_RESOLUTION)
+
+    @property
+    def hires(self):
+        return len(self.screen) == HIRES_RESOLUTION
+
+    @property
+    def height(self):
+        return POZOLE_LAYOUTS[len(self.screen)][1]
+
+    def keyframe(self, screen):
+        self.screen = bytes(screen)
+        return self.screen
+
+    def delta(self, screen):
+        '''
+        Encodes the change to screen, None if nothing changed. Screen must
+        be the size of the last keyframe.
+        '''
+        screen = bytes(screen)
+        if screen == self.screen:
+            return None
+        width, height, row_mask = POZOLE_LAYOUTS[len(screen)]
+        changes = (int.from_bytes(screen, 'big') ^ int.from_bytes(self.screen, 'big')) \
+            .to_bytes(len(screen), 'big')
+        self.screen = screen
+
+        mask, rows = 0, bytearray()
+        for y in range(height):
+            row = changes[y * width:(y + 1) * width]
+            mask <<= 1
+            if any(row):
+                mask |= 1
+                rows += row
+        return row_mask.pack(mask) + rle_encode(rows)
+
+    def apply_keyframe(self, payload):
+        '''
+        Returns the rows of the new screen, which is every row.
+        '''
+        if len(payload) not in POZOLE_LAYOUTS:
+            raise ValueError("Keyframe of " + str(len(payload)) + " bytes")
+        self.screen = bytes(payload)
+        return list(range(self.height))
+
+    def apply_delta(self, payload):
+        '''
+        Returns the rows that changed.
+        '''
+        width, height, row_mask = POZOLE_LAYOUTS[len(self.screen)]
+        mask = row_mask.unpack_from(payload)[0]
+        rows = [y for y in range(height) if mask & (1 << (height - 1 - y))]
+        changes = rle_decode(payload[row_mask.size:], len(rows) * width)
+
+        screen = bytearray(self.screen)
+        for i, y in enumerate(rows):
+            start = y * width
+            row = int.from_bytes(screen[start:start + width], 'big') ^ \
+                  int.from_bytes(changes[i * width:(i + 1) * width], 'big')
+            screen[start:start + width] = row.to_bytes(width, 'big')
+        self.screen = bytes(screen)
+        return rows
+
+    def row(self, y):
+        width = POZOLE_LAYOUTS[len(self.screen)][0]
+        return self.screen[y * width:(y + 1) * width]
+
+############################################################
+# Run length encoding of XOR deltas
+
+@export
+def rle_encode(data):
+    out, i, end = bytearray(), 0, len(data)
+    while i < end:
+        j, zero = i + 1, data[i] == 0
+        while j < end and j - i < RLE_MAX and (data[j] == 0) == zero:
+            j += 1
+        if zero:
+            out.append(RLE_ZEROS | (j - i - 1))
+        else:
+            out.append(j - i - 1)
+            out += data[i:j]
+        i = j
+    return bytes(out)
+
+@export
+def rle_decode(data, size):
+    '''
+    Decodes data, which must decode to size bytes.
+    '''
+    out, i = bytearray(), 0
+    while i < len(data):
+        token = data[i]
+        count = (token & ~RLE_ZEROS) + 1
+        if token & RLE_ZEROS:
+            out += bytes(count)
+            i += 1
+        else:
+            out += data[i + 1:i + 1 + count]
+            i += 1 + count
+    if len(out) != size:
+        raise ValueError("Delta decodes to " + str(len(out)) + " bytes, expected " + str(size))
+    return bytes(out)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import ast
+from . import export
+from .constants.reg_rom_stack import BYTES_OF_RAM
+__all__ = []
+
+# Names usable in watchpoints and conditions, and what they read from the emulator
+QUESO_NAMES = {'i':'emu.index_register', 'pc':'emu.program_counter', 'sp':'emu.stack_pointer',
+               'dt':'emu.delay_timer_register', 'st':'emu.sound_timer_register',
+               'ram':'emu.ram', 'cycle':'emu.cycle_count'}
+QUESO_NAMES.update( ('v' + format(r, 'x'), 'emu.register[' + str(r) + ']') for r in range(16) )
+
+@export
+class Queso:
+    '''
+    Queso holds the breakpoints, watchpoints, and conditional breaks of a
+    debugging session. Its tick hook is only attached to the emulator while
+    at least one of them is set, so without any the emulator runs without a
+    single extra check. Every instruction is checked after it executes and
+    the reason for the first break found is kept in 'hit' until cleared.
+
+    Breakpoints stop before the instruction at an address is executed.
+    Watchpoints stop after a register ('v3', 'i', 'dt', ...) or a range of
+    RAM changes value. Conditions are Python expressions over the same
+    names, e.g. 'v3 == 0x10 and i > 0x300' or 'ram[0x300] != 0', compiled
+    once when added. They stop when they become true.
+    '''
+
+    def __init__(self):
+        self.breakpoints = set()
+        self.watches     = []
+        self.conditions  = []
+        self.hit  = None
+        self.emu  = None
+
+    def attach(self, emu):
+        self.emu = emu
+        self.update()
+
+    def detach(self):
+        if self.emu is not None and self.check in self.emu.tick_hooks:
+            self.emu.remove_tick_hook(self.check)
+        self.emu = None
+
+    def update(self):
+        '''
+        Adds or removes the tick hook depending on whether anything is set.
+        '''
+        if self.emu is None:
+            return
+        active = self.check in self.emu.tick_hooks
+        if (self.breakpoints or self.watches or self.conditions) and not active:
+            self.emu.add_tick_hook(self.check)
+        elif not (self.breakpoints or self.watches or self.conditions) and active:
+            self.emu.remove_tick_hook(self.check)
+
+    def add_breakpoint(self, address):
+        self.breakpoints.add(address)
+        self.update()
+
+    def remove_breakpoint(self, address):
+        self.breakpoints.discard(address)
+        self.update()
+
+    def add_watch(self, target):
+        '''
+        Target is a register name or a RAM address or range in hex,
+        such as '0x300' or '0x300-0x30f'.
+        '''
+        target = target.strip().lower()
+        if target in QUESO_NAMES and target not in ('ram', 'cycle', 'pc'):
+            read = compile_expression(target)
+        else:
+            first, _, last = target.partition('-')
+            try:
+                first = int(first, 16)
+                last  = int(last, 16) if last else first
+            except ValueError:
+                raise ValueError("Cannot watch '" + target + "', expected a register or RAM address.")
+            if not 0 <= first <= last < BYTES_OF_RAM:
+                raise ValueError("RAM range '" + target + "' is out of bounds.")
+            read = lambda emu: emu.ram[first:last + 1]
+        self.watches.append( [target, read, None if self.emu is None else read(self.emu)] )
+        self.update()
+
+    def add_condition(self, expression):
+        self.conditions.append( [expression, compile_expression(expression), False] )
+        self.update()
+
+    def clear(self):
+        self.breakpoints.clear()
+        self.watches.clear()
+        self.conditions.clear()
+        self.hit = None
+        self.update()
+
+    def check(self, emu):
+        '''
+        Tick hook. Stores the reason in hit and returns it if the emulator
+        should stop.
+        '''
+        hit = None
+        for watch in self.watches:
+            value = watch[1](emu)
+            if value != watch[2]:
+                if watch[2] is not None and hit is None:
+                    hit = "Watch " + watch[0] + " changed at " + format(emu.calling_pc, '#05x')
+                watch[2] = value
+        for cond in self.conditions:
+            value = bool(cond[1](emu))
+            if value and not cond[2] and hit is None:
+                hit = "Condition '" + cond[0] + "' met at " + format(emu.calling_pc, '#05x')
+            cond[2] = value
+        if hit is None and emu.program_counter in self.breakpoints:
+            hit = "Breakpoint at " + format(emu.program_counter, '#05x')
+        if hit is not None:
+            self.hit = hit
+        return hit
+
+class QuesoNames(ast.NodeTransformer):
+    def visit_Name(self, node):
+        if node.id not in QUESO_NAMES:
+            raise ValueError("Unknown name '" + node.id + "', expected one of: " + ', '.join(sorted(QUESO_NAMES)))
+        return ast.copy_location(ast.parse(QUESO_NAMES[node.id], mode='eval').body, node)
+
+def compile_expression(expression):
+    '''
+    Compiles an expression over register names into a function of the emulator.
+    '''
+    try:
+        body = QuesoNames().visit(ast.parse(expression.strip(), mode='eval').body)
+    except SyntaxError:
+        raise ValueError("Cannot parse '" + expression + "'.")
+    func = ast.parse('def queso(emu):\n    return None')
+    func.body[0].body[0].value = body
+    namespace = {}
+    exec(compile(ast.fix_missing_locations(func), '<' + expression + '>', 'exec'), namespace)
+    return namespace['queso']
@@ -32,11 +32,8 @@ def Salsa(byte_list):
     is_super8 = False
 
     try:
-        # Check if the Op-Code a Super-8 instruction
-        if hex_instruction in SUPER_CHIP_OP_CODES_EXPLODED:
-            mnemonic = 'SPR'
-            is_super8 = True
-            raise EarlyExit
+        # Flag Super-8 instructions, they are otherwise matched like the rest
+        is_super8 = hex_instruction in SUPER_CHIP_OP_CODES_EXPLODED
 
         # Match the instruction via a regex index
         for mnemonic, reg_patterns in OP_CODES.items():
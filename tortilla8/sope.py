@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Import curses
+try: import curses
+except ImportError:
+    raise ImportError("Curses is missing from your system. " + \
+        "Consult the README for information on installing for your platform.")
+
+from select import select
+from time import time
+from socket import socket, AF_UNIX, SOCK_STREAM
+from .pozole import Pozole
+from .fonda import pack_message, unpack_messages, FONDA_KEYS, FONDA_ID, \
+                   MSG_NEW, MSG_WATCH, MSG_KEYS, MSG_SESSION, MSG_KEYFRAME, MSG_DELTA, MSG_STATE, \
+                   MSG_ERROR, STATE_WAITING_KEY, STATE_SPINNING, STATE_FATAL
+from .constants.curses import UNICODE_DRAW, WIN_DRAW, KEY_CONTROLS, KEY_EXIT, DISPLAY_H, DISPLAY_W, \
+                              TEXT_ROWS, screen_cells
+from .constants.ansi import KEY_DECAY
+
+class Sope:
+    '''
+    Sope is a curses viewer for sessions hosted by Fonda. It starts a
+    session with a ROM, or joins one by id to spectate, draws the screen
+    from the keyframe and deltas it is sent, and sends the keypad back
+    whenever it changes. Nothing is emulated locally.
+    '''
+
+    def __init__(self, path, rom=None, watch=None, enable_screen_unicode=True):
+        self.draw_char = UNICODE_DRAW if enable_screen_unicode else WIN_DRAW
+        self.view = Pozole()
+        self.buffer = bytearray()
+        self.session_id = None
+        self.error = None
+        self.keys = 0
+
+        self.sock = socket(AF_UNIX, SOCK_STREAM)
+        self.sock.connect(path)
+        if watch is None:
+            self.sock.sendall(pack_message(MSG_NEW, rom.encode('utf-8')))
+        else:
+            self.sock.sendall(pack_message(MSG_WATCH, FONDA_ID.pack(watch)))
+
+    def start(self):
+        screen = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        curses.curs_set(0)
+        screen.nodelay(True)
+        self.w_game = curses.newwin(DISPLAY_H, DISPLAY_W, 0, 0)
+        self.w_game.box()
+        self.w_status = curses.newwin(1, DISPLAY_W, DISPLAY_H, 0)
+        self.status("Connecting")
+        connected = True
+        key_press_time = 0
+
+        try:
+            while True:
+                # Draw what the host sent, for up to a frame
+                if connected and select([self.sock], [], [], 1 / 60)[0]:
+                    data = self.sock.recv(65536)
+                    if data:
+                        self.buffer += data
+                        for kind, payload in unpack_messages(self.buffer):
+                            self.receive(kind, payload)
+                    else:
+                        connected = False
+                        self.status(self.error or "The host closed the connection")
+
+                curses.doupdate()
+                key = screen.getch()
+                if key == KEY_EXIT:
+                    break
+                if not connected:
+                    curses.napms(50)
+                    continue
+
+                # Keys are held for KEY_DECAY, only changes are sent
+                keys = self.keys
+                if time() - key_press_time > KEY_DECAY:
+                    keys = 0
+                    key_press_time = time()
+                if key in KEY_CONTROLS:
+                    keys |= 0x8000 >> KEY_CONTROLS[key]
+                if keys != self.keys:
+                    self.keys = keys
+                    self.sock.sendall(pack_message(MSG_KEYS, FONDA_KEYS.pack(keys)))
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.sock.close()
+            curses.nocbreak()
+            curses.echo()
+            curses.endwin()
+
+    def receive(self, kind, payload):
+        if kind == MSG_KEYFRAME:
+            self.draw(self.view.apply_keyframe(payload))
+        elif kind == MSG_DELTA:
+            self.draw(self.view.apply_delta(payload))
+        elif kind == MSG_SESSION:
+            self.session_id = FONDA_ID.unpack(payload)[0]
+        elif kind == MSG_STATE:
+            state = payload[0]
+            message = "Fatal error" if state & STATE_FATAL else \
+                      "Spin detected" if state & STATE_SPINNING else \
+                      "Waiting for a key" if state & STATE_WAITING_KEY else "Running"
+            self.status(message)
+        elif kind == MSG_ERROR:
+            self.error = payload.decode('utf-8', 'replace')
+            self.status(self.error)
+
+    def status(self, message):
+        session = "" if self.session_id is None else "Session " + str(self.session_id) + ". "
+        self.w_status.erase()
+        self.w_status.addstr(0, 0, (session + message + ". Press '" + chr(KEY_EXIT).upper() + \
+            "' to exit")[:DISPLAY_W - 1])
+        self.w_status.noutrefresh()
+
+    def draw(self, rows):
+        screen = [int.from_bytes(self.view.row(y), 'big') for y in range(self.view.height)]
+        per_text_row = len(screen) // TEXT_ROWS
+        for y in sorted(set(r // per_text_row for r in rows)):
+            self.w_game.addstr(1 + y, 1, ''.join(screen_cells(screen, y, self.draw_char)))
+        self.w_game.noutrefresh()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+from . import export
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from .guacamole import Guacamole
+from .constants.reg_rom_stack import BYTES_OF_RAM
+__all__ = []
+
+# Instructions between checkpoints, a seek replays at most this many
+CHECKPOINT_INTERVAL = 2000
+
+@export
+class Checkpoint( namedtuple('Checkpoint', 'cycle_count ram register index_register ' + \
+    'delay_timer_register sound_timer_register program_counter calling_pc dis_ins stack ' + \
+    'stack_pointer draw_flag waiting_for_key spinning keypad prev_keypad rng_drawn fatal ' + \
+    'hires_rows rpl_flags') ):
+    '''
+    hires_rows is a copy of the high resolution screen, None in low
+    resolution (where the screen is in RAM).
+    '''
+    pass
+
+@export
+class Tamal:
+    '''
+    Tamal lets a Guacamole instance travel to any instruction count it has
+    already run, forward or backward. It records everything that changes the
+    emulator from outside, which is the timers counting down, key presses,
+    and the key state kept for 'ld vx, k', as one packed value per change,
+    and takes a full checkpoint every CHECKPOINT_INTERVAL instructions.
+    Seeking restores the checkpoint at or before the target and replays the
+    recorded inputs up to it, so it takes the same time an hour into a run
+    as at the start. Running on after seeking back drops the old future.
+    '''
+
+    def __init__(self, interval=CHECKPOINT_INTERVAL):
+        self.interval = interval
+        self.emu = None
+
+    def attach(self, emu):
+        self.emu = emu
+        self.clear()
+        emu.add_tick_hook(self.record, before=True)
+        emu.add_tick_hook(self.settle)
+
+    def detach(self):
+        self.emu.remove_tick_hook(self.record)
+        self.emu.remove_tick_hook(self.settle)
+        self.emu = None
+
+    def clear(self):
+        '''
+        Forgets the recording and starts a new one from the current state,
+        i.e. after the emulator is reset.
+        '''
+        emu = self.emu
+        self.cycles = array('Q')       # Instruction count of every input change
+        self.inputs = array('Q')       # The inputs at that count, see pack_inputs
+        self.checkpoints = []
+        self.end = emu.cycle_count
+        self.keypad = emu.keypad.copy()
+        self.after = (emu.delay_timer_register, emu.sound_timer_register, emu.prev_keypad)
+        self.checkpoint()
+
+    @property
+    def start(self):
+        return self.checkpoints[0].cycle_count
+
+    def record(self, emu):
+        '''
+        Pre-tick hook, logs inputs that changed since the last instruction.
+        '''
+        count = emu.cycle_count
+        if count < self.end:
+            self.truncate(count)
+        if emu.keypad != self.keypad or self.after != \
+           (emu.delay_timer_register, emu.sound_timer_register, emu.prev_keypad):
+            self.keypad = emu.keypad.copy()
+            self.cycles.append(count)
+            self.inputs.append(pack_inputs(emu))
+        if count % self.interval == 0 and count > self.checkpoints[-1].cycle_count:
+            self.checkpoint()
+        self.end = count
+
+    def settle(self, emu):
+        '''
+        Tick hook, remembers the inputs as the instruction left them.
+        '''
+        self.after = (emu.delay_timer_register, emu.sound_timer_register, emu.prev_keypad)
+
+    def truncate(self, count):
+        del self.cycles[bisect_right(self.cycles, count):]
+        del self.inputs[len(self.cycles):]
+        while self.checkpoints[-1].cycle_count > count:
+            self.checkpoints.pop()
+
+    def checkpoint(self):
+        emu = self.emu
+        self.checkpoints.append( Checkpoint(emu.cycle_count,
+            array('h', [-1 if v is None else v for v in emu.ram]), emu.register.copy(),
+            emu.index_register, emu.delay_timer_register, emu.sound_timer_register,
+            emu.program_counter, emu.calling_pc, emu.dis_ins, emu.stack.copy(), emu.stack_pointer,
+            emu.draw_flag, emu.waiting_for_key, emu.spinning, emu.keypad.copy(), emu.prev_keypad,
+            emu.rng.drawn, emu.fatal, emu.hires_rows.copy() if emu.hires else None,
+            emu.rpl_flags.copy()) )
+
+    def restore(self, point):
+        emu = self.emu
+        emu.ram[:] = [None if v < 0 else v for v in point.ram]
+        emu.invalidate(0, BYTES_OF_RAM)
+        emu.register = point.register.copy()
+        emu.stack = point.stack.copy()
+        emu.keypad = point.keypad.copy()
+        emu.cycle_count, emu.index_register = point.cycle_count, point.index_register
+        emu.delay_timer_register, emu.sound_timer_register = \
+            point.delay_timer_register, point.sound_timer_register
+        emu.program_counter, emu.calling_pc, emu.dis_ins = \
+            point.program_counter, point.calling_pc, point.dis_ins
+        emu.stack_pointer, emu.draw_flag, emu.waiting_for_key, emu.spinning = \
+            point.stack_pointer, point.draw_flag, point.waiting_for_key, point.spinning
+        emu.prev_keypad, emu.fatal = point.prev_keypad, point.fatal
+        emu.hires = point.hires_rows is not None
+        if emu.hires:
+            emu.hires_rows = point.hires_rows.copy()
+        emu.rpl_flags = point.rpl_flags.copy()
+        emu.rng.seek(point.rng_drawn)
+
+    def seek(self, count):
+        '''
+        Moves the emulator to the state it had after count instructions.
+        Counts before the recording start at its first checkpoint, and
+        counts past its end are run to with run_for. Hooks are not called
+        for the replayed instructions. Returns the count reached.
+        '''
+        emu = self.emu
+        count = max(count, self.start)
+        target = min(count, self.end)
+
+        # Restore the closest checkpoint, unless it is faster to run forward
+        point = self.checkpoints[bisect_right([c.cycle_count for c in self.checkpoints], target) - 1]
+        if not point.cycle_count <= emu.cycle_count <= target:
+            self.restore(point)
+
+        i = bisect_left(self.cycles, emu.cycle_count)
+        while True:
+            while i < len(self.cycles) and self.cycles[i] == emu.cycle_count:
+                unpack_inputs(emu, self.inputs[i])
+                i += 1
+            if emu.cycle_count >= target or emu.fatal:
+                break
+            Guacamole.cpu_tick(emu)
+
+        self.keypad = emu.keypad.copy()
+        self.after = (emu.delay_timer_register, emu.sound_timer_register, emu.prev_keypad)
+        if emu.rewind_frames is not None:
+            emu.rewind_frames.clear()
+        if emu.hashing:
+            emu.rehash()
+
+        if count > emu.cycle_count and not emu.fatal:
+            emu.run_for(count - emu.cycle_count)
+        return emu.cycle_count
+
+def pack_inputs(emu):
+    return emu.delay_timer_register | (emu.sound_timer_register << 8) | \
+           (emu.prev_keypad << 16) | (emu.decode_keypad() << 32)
+
+def unpack_inputs(emu, value):
+    emu.delay_timer_register = value & 0xFF
+    emu.sound_timer_register = (value >> 8) & 0xFF
+    emu.prev_keypad = (value >> 16) & 0xFFFF
+    emu.keypad = [bool((value >> (47 - i)) & 1) for i in range(16)]
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+from . import export
+from . import EmulationError
+from sys import getsizeof
+from time import perf_counter
+from threading import Thread
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+__all__ = []
+
+# Upper bounds (seconds) of the render time histogram buckets
+RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# Frames over which the effective frequency is measured
+HZ_WINDOW = 60
+
+@export
+class Tepache:
+    '''
+    Tepache collects live metrics from an emulator and its front end:
+    instructions executed, the effective cpu frequency against cpu_hz,
+    frames, frames drawn and the time taken to draw them, memory used by
+    rewind, and fatal errors. It hooks a frame hook and a fatal error
+    subscriber, so it costs nothing per instruction. Front ends report
+    their draws with rendered. Stats are read with stats, or served in
+    the Prometheus text format with serve.
+    '''
+
+    def __init__(self, window=HZ_WINDOW):
+        self.emu = None
+        self.timeline = None
+        self.frames = 0
+        self.fatal_errors = 0
+        self.render_counts = [0] * (len(RENDER_BUCKETS) + 1)
+        self.render_sum = 0.0
+        self.marks = deque(maxlen=window)
+        self.retired = 0
+        self.last_count = 0
+        self.server = None
+
+    def attach(self, emu, timeline=None):
+        '''
+        Timeline is a Tamal whose memory is counted with rewind.
+        '''
+        self.emu = emu
+        self.timeline = timeline
+        self.last_count = emu.cycle_count
+        emu.frame_hooks.append(self.frame)
+        emu.subscribe(self.fatal, EmulationError._Fatal)
+
+    def detach(self):
+        self.emu.frame_hooks.remove(self.frame)
+        self.emu.unsubscribe(self.fatal)
+        self.emu = None
+
+    def frame(self, emu):
+        count = emu.cycle_count
+        if count < self.last_count:
+            self.retired += self.last_count
+        self.last_count = count
+        self.frames += 1
+        self.marks.append((perf_counter(), self.retired + count))
+
+    def fatal(self, event):
+        self.fatal_errors += 1
+
+    def rendered(self, seconds):
+        '''
+        Called by front ends with the time a frame took to draw.
+        '''
+        for i, bound in enumerate(RENDER_BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            i = len(RENDER_BUCKETS)
+        self.render_counts[i] += 1
+        self.render_sum += seconds
+
+    @property
+    def instructions(self):
+        '''
+        Instructions executed, kept counting across resets (which are
+        noticed on the next frame).
+        '''
+        return self.retired + max(self.emu.cycle_count, self.last_count)
+
+    @property
+    def effective_hz(self):
+        '''
+        Instructions per second over the last window frames.
+        '''
+        if len(self.marks) < 2:
+            return 0.0
+        (start, first), (end, last) = self.marks[0], self.marks[-1]
+        return (last - first) / (end - start) if end > start else 0.0
+
+    def stats(self):
+        return {
+            'instructions'   : self.instructions,
+            'cpu_hz'         : self.emu.cpu_hz,
+            'effective_hz'   : self.effective_hz,
+            'frames'         : self.frames,
+            'frames_drawn'   : sum(self.render_counts),
+            'render_seconds' : self.render_sum,
+            'render_buckets' : list(zip(RENDER_BUCKETS + (float('inf'),), self.render_counts)),
+            'rewind_bytes'   : rewind_bytes(self.emu) + timeline_bytes(self.timeline),
+            'fatal_errors'   : self.fatal_errors}
+
+    def prometheus(self):
+        '''
+        The stats in the Prometheus text exposition format.
+        '''
+        stats = self.stats()
+        lines = []
+        def metric(name, kind, help_text, value):
+            lines.extend(("# HELP tortilla8_" + name + " " + help_text,
+                          "# TYPE tortilla8_" + name + " " + kind,
+                          "tortilla8_" + name + " " + format_value(value)))
+
+        metric('instructions_total', 'counter', 'Instructions executed.', stats['instructions'])
+        metric('cpu_hz', 'gauge', 'Target cpu frequency.', stats['cpu_hz'])
+        metric('effective_hz', 'gauge', 'Instructions executed per second.', stats['effective_hz'])
+        metric('frames_total', 'counter', 'Delay timer frames.', stats['frames'])
+        metric('rewind_bytes', 'gauge', 'Memory used by rewind.', stats['rewind_bytes'])
+        metric('fatal_errors_total', 'counter', 'Fatal emulation errors.', stats['fatal_errors'])
+
+        lines.extend(("# HELP tortilla8_render_seconds Time taken to draw a frame.",
+                      "# TYPE tortilla8_render_seconds histogram"))
+        total = 0
+        for bound, count in stats['render_buckets']:
+            total += count
+            lines.append('tortilla8_render_seconds_bucket{le="' + format_value(bound) + '"} ' + str(total))
+        lines.append("tortilla8_render_seconds_sum " + format_value(stats['render_seconds']))
+        lines.append("tortilla8_render_seconds_count " + str(total))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        '''
+        Serves the stats at http://host:port/metrics from a background
+        thread until stop is called.
+        '''
+        tepache = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = tepache.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+############################################################
+# Memory estimates
+
+@export
+def rewind_bytes(emu):
+    '''
+    Approximate memory used by the rewind snapshots of emu.
+    '''
+    if emu.rewind_frames is None:
+        return 0
+    total = getsizeof(emu.rewind_frames)
+    for frame in list(emu.rewind_frames):
+        total += getsizeof(frame) + getsizeof(frame.gfx_buffer) + getsizeof(frame.register) + \
+                 getsizeof(frame.dis_ins) + getsizeof(frame.stack) + getsizeof(frame.hires_rows)
+    return total
+
+@export
+def timeline_bytes(timeline):
+    '''
+    Approximate memory used by the checkpoints and inputs of a Tamal.
+    '''
+    if timeline is None:
+        return 0
+    total = getsizeof(timeline.cycles) + getsizeof(timeline.inputs)
+    for checkpoint in list(timeline.checkpoints):
+        total += getsizeof(checkpoint) + getsizeof(checkpoint.ram) + getsizeof(checkpoint.register) + \
+                 getsizeof(checkpoint.stack) + getsizeof(checkpoint.keypad) + getsizeof(checkpoint.hires_rows)
+    return total
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Import System to read single key presses
+try:
+    from termios import tcgetattr, tcsetattr, TCSADRAIN
+    from tty import setcbreak
+    from select import select
+    msvcrt = None
+except ImportError:
+    import msvcrt
+
+import sys
+from time import time, sleep, perf_counter
+from .guacamole import Guacamole
+from .guacamole import EmulationError
+from .guacamole import EVENT_FRAME, EVENT_FATAL, EVENT_SPIN
+from .constants.ansi import *
+from .constants.curses import UNICODE_DRAW, WIN_DRAW, KEY_CONTROLS, TEXT_ROWS, screen_cells
+
+class Tostada:
+    '''
+    Tostada is a bare bones front end for Guacamole that draws the game
+    screen with ANSI escape sequences rather than curses. Each terminal
+    cell holds two pixels (a half block), only cells that changed since the
+    previous frame are written, and a whole frame goes out as one write.
+    Intended for slow SSH links and captured logs.
+    '''
+
+    def __init__(self, rom, cpuhz, audiohz, delayhz,
+                 init_ram, legacy_shift, enforce_ins,
+                 rewind_depth, enable_screen_unicode,
+                 output=None, quirks=None):
+
+        self.draw_char = UNICODE_DRAW if enable_screen_unicode else WIN_DRAW
+        self.out = sys.stdout if output is None else output
+
+        # What the terminal currently shows, the list of cells of each text row
+        self.shown = [None] * TEXT_ROWS
+        self.halt = False
+        self.metrics = None
+
+        self.emu = Guacamole(rom, cpuhz, audiohz, delayhz, init_ram, legacy_shift, enforce_ins, rewind_depth,
+                             EmulationError._Fatal, quirks)
+
+    def start(self):
+        key_press_time = 0
+        saved_term = self.enter_terminal()
+        self.out.write(CLEAR_SCREEN + CURSOR_HOME + HIDE_CURSOR)
+        self.status("Press '" + ANSI_KEY_EXIT.upper() + "' to exit")
+
+        try:
+            # Keys are read and the screen drawn once a frame
+            start_time, start_cycle = time(), self.emu.cycle_count
+            for event in self.emu.events(idle_frames=True):
+                if event.kind == EVENT_FRAME:
+                    if event.data:
+                        self.draw(event.data)
+                    key = self.read_key()
+                    if key == ANSI_KEY_EXIT:
+                        return
+
+                    # Update Keypad press
+                    if time() - key_press_time > KEY_DECAY:
+                        self.emu.keypad = [False] * 16
+                        key_press_time = time()
+                    if key is not None and ord(key) in KEY_CONTROLS:
+                        self.emu.keypad[KEY_CONTROLS[ord(key)]] = True
+
+                    # Keep to the cpu frequency
+                    ahead = (event.cycle - start_cycle) / self.emu.cpu_hz - (time() - start_time)
+                    if ahead > 0:
+                        sleep(ahead)
+
+                elif event.kind == EVENT_FATAL:
+                    self.check_log()
+                elif event.kind == EVENT_SPIN:
+                    self.status("Spin detected. Press '" + ANSI_KEY_EXIT.upper() + "' to exit")
+
+            # The run is over, wait to exit
+            self.halt = True
+            while self.read_key() != ANSI_KEY_EXIT:
+                sleep(KEY_DECAY / 10)
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.out.write(cursor_to(STATUS_ROW + 1, 1) + RESET_ATTR + SHOW_CURSOR)
+            self.out.flush()
+            self.leave_terminal(saved_term)
+
+    def check_log(self):
+        for err in self.emu.error_log:
+            self.status(str(err[0]) + ": " + err[1])
+        self.emu.error_log.clear()
+
+    def status(self, message):
+        self.out.write(cursor_to(STATUS_ROW, 1) + CLEAR_LINE + message)
+        self.out.flush()
+
+    def draw(self, rows=None):
+        start = perf_counter()
+        frame = self.frame_diff(rows)
+        if frame:
+            self.out.write(frame)
+            self.out.flush()
+        if self.metrics is not None:
+            self.metrics.rendered(perf_counter() - start)
+
+    def frame_diff(self, rows=None):
+        '''
+        Builds the escape sequences needed to bring the terminal up to date
+        with the emulator's screen. Only the pixel rows given are looked at
+        (all if None), unchanged rows are skipped with a single compare, and
+        the cursor is only moved when the changed cells are not contiguous.
+        '''
+        screen = self.emu.screen_rows()
+        per_text_row = len(screen) // TEXT_ROWS
+        parts = []
+
+        text_rows = range(TEXT_ROWS) if rows is None else sorted(set(r // per_text_row for r in rows))
+        for y in text_rows:
+            cells = screen_cells(screen, y, self.draw_char)
+            prev = self.shown[y]
+            if prev == cells:
+                continue
+            self.shown[y] = cells
+
+            cursor = None
+            for x, cell in enumerate(cells):
+                if prev is not None and prev[x] == cell:
+                    continue
+                if cursor != x:
+                    parts.append(cursor_to(SCREEN_ROW + y, SCREEN_COL + x))
+                parts.append(cell)
+                cursor = x + 1
+
+        return ''.join(parts)
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Terminal helpers
+
+    def enter_terminal(self):
+        if msvcrt or not sys.stdin.isatty():
+            return None
+        saved = tcgetattr(sys.stdin)
+        setcbreak(sys.stdin.fileno())
+        return saved
+
+    def leave_terminal(self, saved):
+        if saved is not None:
+            tcsetattr(sys.stdin, TCSADRAIN, saved)
+
+    def read_key(self):
+        if msvcrt:
+            return msvcrt.getwch() if msvcrt.kbhit() else None
+        if not sys.stdin.isatty():
+            return None
+        if select([sys.stdin], [], [], 0)[0]:
+            return sys.stdin.read(1)
+        return None
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+from . import export
+from array import array
+from struct import Struct
+from .constants.reg_rom_stack import BYTES_OF_RAM
+__all__ = []
+
+TOTOPO_MAGIC = b'T8COV'
+TOTOPO_HITS  = Struct('>I')
+
+@export
+class Totopo:
+    '''
+    Totopo records which addresses a Guacamole instance executed, as a
+    bitmap with one bit per address plus a hit count for each. Coverage
+    files hold the bitmap followed by the counts of the executed addresses
+    only, and are read back with read_coverage. Blackbean uses them to mark
+    listing lines as executed.
+    '''
+
+    def __init__(self):
+        self.bitmap = bytearray(BYTES_OF_RAM // 8)
+        self.counts = array('L', [0] * BYTES_OF_RAM)
+
+    def attach(self, emu):
+        emu.add_tick_hook(self.mark, before=True)
+
+    def detach(self, emu):
+        emu.remove_tick_hook(self.mark)
+
+    def mark(self, emu):
+        '''
+        Tick hook, run before the instruction at the program counter. A
+        program counter past the end of RAM is not marked.
+        '''
+        pc = emu.program_counter
+        if emu.waiting_for_key or pc >= BYTES_OF_RAM:
+            return
+        self.bitmap[pc >> 3] |= 1 << (pc & 7)
+        self.counts[pc] += 1
+
+    def executed(self, address):
+        return bool(self.bitmap[address >> 3] & (1 << (address & 7)))
+
+    def hits(self, address):
+        return self.counts[address] if 0 <= address < BYTES_OF_RAM else 0
+
+    def addresses(self):
+        return [a for a in range(BYTES_OF_RAM) if self.executed(a)]
+
+    def merge(self, other):
+        '''
+        Adds the coverage of another Totopo, i.e. from a different run.
+        '''
+        for i, byte in enumerate(other.bitmap):
+            self.bitmap[i] |= byte
+        for a in other.addresses():
+            self.counts[a] += other.counts[a]
+
+    def export(self, file_handler):
+        file_handler.write(TOTOPO_MAGIC)
+        file_handler.write(self.bitmap)
+        for a in self.addresses():
+            file_handler.write(TOTOPO_HITS.pack(self.counts[a]))
+
+@export
+def read_coverage(file_handler):
+    '''
+    Reads a coverage file written by Totopo.export.
+    '''
+    if file_handler.read(len(TOTOPO_MAGIC)) != TOTOPO_MAGIC:
+        raise ValueError("Not a tortilla8 coverage file.")
+    cov = Totopo()
+    cov.bitmap[:] = file_handler.read(len(cov.bitmap))
+    for a in cov.addresses():
+        cov.counts[a] = TOTOPO_HITS.unpack(file_handler.read(TOTOPO_HITS.size))[0]
+    return cov